@@ -0,0 +1,17 @@
+"""
+libcloudph++ particles with the microphysics skipped, for measuring only the work done in parcel.py
+(shared by the microbenchmarks of the Python overhead of the timestepping)
+"""
+
+class overhead_only(object):
+  # wraps libcloudph++ particles skipping the microphysics and recording the options of each call
+  def __init__(self, micro):
+    self.micro = micro
+    self.opts_init = micro.opts_init
+    self.calls = {"step_sync" : [], "step_async" : []}
+
+  def step_sync(self, libopts, *args, **kwargs):
+    self.calls["step_sync"].append(libopts)
+
+  def step_async(self, libopts):
+    self.calls["step_async"].append(libopts)
@@ -0,0 +1,67 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+import parcel as pc
+from overhead_only import overhead_only
+import json, timeit
+
+"""
+Microbenchmark of the Python overhead of the fixed-timestep loop between output records:
+libcloudph++ step_sync/step_async calls are skipped, so that only the work done in parcel.py
+is measured. _advance (all timesteps up to the next output record in one call, with the
+thermodynamic state computed with Python floats) is compared with calling _forcing and
+_micro_step in each timestep, as parcel() does when something is checked after each timestep.
+The times are only printed, the check is done on the numbers of (skipped) libcloudph++ calls
+and of the thermodynamic state updates (_stats calls) and on the resulting state.
+"""
+
+def setup():
+  opts = pc._default_opts()
+  opts.update({"T_0" : 280., "RH_0" : .99, "outfreq" : 100})
+  r_0 = pc._r_0(opts)
+  state, th_0 = pc._state_init(dict(opts, r_0 = r_0))
+  info = {"RH_max" : 0}
+  micro = overhead_only(pc._micro_init(json.loads(opts["aerosol"]), opts, state, info))
+  nt = int(opts["z_max"] / (opts["w"] * opts["dt"]))
+  z = pc._heights(nt, opts["w"], opts["dt"])
+  forcing = {"z" : z, "prof" : pc.pprofs[opts["pprof"]](z, opts["p_0"], th_0, r_0)}
+  return micro, state, info, opts, nt, forcing
+
+def loop_steps(micro, state, info, opts, nt, forcing, plan):
+  # one timestep at a time
+  for it in range(1, nt+1):
+    pc._forcing(state, forcing, opts, it)
+    pc._micro_step(micro, state, info, opts, it, None, plan=plan)
+
+def loop_advance(micro, state, info, opts, nt, forcing, plan):
+  # up to the next output record in one call
+  it = 0
+  while it < nt:
+    it = pc._advance(micro, state, info, opts, it, min(opts["outfreq"], nt - it), forcing, plan)
+
+def test_advance_overhead(monkeypatch, n=10):
+  """ Python overhead of the timestepping loop with and without _advance """
+  times, calls, states = {}, {}, {}
+  stats = pc._stats
+  for name, loop in [("steps", loop_steps), ("advance", loop_advance)]:
+    micro, state, info, opts, nt, forcing = setup()
+    plan = pc._step_plan(micro, state, opts)
+    times[name] = min(timeit.repeat(lambda: loop(micro, state, info, opts, nt, forcing, plan), number=n, repeat=3)) / n / nt
+
+    # one more loop counting the calls (from the same initial state)
+    micro, state, info, opts, nt, forcing = setup()
+    plan = pc._step_plan(micro, state, opts)
+    n_stats = []
+    monkeypatch.setattr(pc, "_stats", lambda *args: n_stats.append(1) or stats(*args))
+    loop(micro, state, info, opts, nt, forcing, plan)
+    monkeypatch.setattr(pc, "_stats", stats)
+    calls[name] = (len(micro.calls["step_sync"]), len(micro.calls["step_async"]), len(n_stats))
+    states[name] = (state["p"], state["rhod"][0], state["T"][0], state["RH"][0], info["RH_max"][0])
+  print("\nPython overhead per timestep: " + str(round(times["steps"] * 1e6, 2)) + " us timestep by timestep and "
+        + str(round(times["advance"] * 1e6, 2)) + " us with _advance")
+
+  # the same libcloudph++ calls and state, without updating the state in numpy arrays in each timestep
+  assert calls["steps"] == (nt, nt, nt)
+  assert calls["advance"] == (nt, nt, 0)
+  assert states["advance"] == states["steps"]
@@ -0,0 +1,84 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+import parcel as pc
+from libcloudphxx import lgrngn
+import numpy as np
+import timeit
+
+"""
+Benchmark of the size distribution functors called by libcloudph++ for each radius at initialisation:
+the previous lognormal implementation (math imported and logarithms computed in each call), the
+current one and the tabulated distribution, per call and for the whole libcloudph++ initialisation.
+The times are only printed, the checks are done on the values of the distributions and on the
+aerosol concentration initialised by libcloudph++ with each of them.
+"""
+
+class lognormal_ref(object):
+  # lognormal as implemented before (reference)
+  def __init__(self, mean_r, gstdev, n_tot):
+    self.mean_r = mean_r
+    self.gstdev = gstdev
+    self.n_tot = n_tot
+
+  def __call__(self, lnr):
+    from math import exp, log, sqrt, pi
+    return self.n_tot * exp(
+      -(lnr - log(self.mean_r))**2 / 2 / log(self.gstdev)**2
+    ) / log(self.gstdev) / sqrt(2*pi);
+
+modes = [(2e-8, 1.4, 60e6), (7.5e-8, 1.6, 40e6), (5e-7, 2., 1e5)]
+
+def distros():
+  return {
+    "reference" : pc.sum_of_lognormals([lognormal_ref(*m) for m in modes]),
+    "lognormal" : pc.sum_of_lognormals([pc.lognormal(*m) for m in modes]),
+    "tabulated" : pc.tabulated(pc.sum_of_lognormals([pc.lognormal(*m) for m in modes]))
+  }
+
+def test_distro_call(n=100000, eps=1e-3):
+  """ time of one call of the size distribution """
+  lnr = np.log(3e-8)
+  print("")
+  for name, distro in distros().items():
+    t = min(timeit.repeat(lambda: distro(lnr), number=n, repeat=3)) / n
+    print(name.ljust(10) + ": " + str(round(t * 1e6, 3)) + " us per call")
+
+  # the same values (up to the interpolation error of the table where the distribution is not negligible)
+  ref = distros()["reference"]
+  lnrs = np.linspace(np.log(1e-9), np.log(1e-5), 1001)
+  pdf_ref = np.array([ref(x) for x in lnrs])
+  main = pdf_ref > pdf_ref.max() * 1e-6
+  for name, distro in distros().items():
+    pdf = np.array([distro(x) for x in lnrs])
+    assert np.isclose(pdf[main], pdf_ref[main], atol=0, rtol=eps if name == "tabulated" else 1e-12).all(), name
+
+def test_distro_init(sd_conc=4096, eps=1e-3):
+  """ time of libcloudph++ initialisation (with large_tail) with each size distribution """
+  print("")
+  conc = {}
+  for name, distro in distros().items():
+    def init():
+      opts_init = lgrngn.opts_init_t()
+      opts_init.dt = 1.
+      opts_init.sd_conc = sd_conc
+      opts_init.sd_conc_large_tail = 1
+      opts_init.n_sd_max = 4 * sd_conc
+      opts_init.sedi_switch = False
+      opts_init.coal_switch = False
+      opts_init.dry_distros = {.61 : distro}
+      micro = lgrngn.factory(lgrngn.backend_t.serial, opts_init)
+      micro.init(np.array([300.]), np.array([.01]), np.array([1.1]))
+      return micro
+    t = min(timeit.repeat(init, number=1, repeat=3))
+    print(name.ljust(10) + ": " + str(round(t * 1e3, 2)) + " ms per initialisation")
+
+    # aerosol concentration initialised with the distribution
+    micro = init()
+    micro.diag_all()
+    micro.diag_dry_mom(0)
+    conc[name] = np.frombuffer(micro.outbuf())[0]
+
+  for name in conc:
+    assert np.isclose(conc[name], conc["reference"], atol=0, rtol=eps), name
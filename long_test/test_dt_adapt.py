@@ -0,0 +1,53 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import parcel
+from libcloudphxx import common
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+"""
+checking if adaptive timestepping reproduces RH_max and the concentration
+of activated droplets of a run with a small constant timestep using fewer timesteps
+(setup as in test_timestep.py)
+"""
+
+RH_init = .99999
+T_init  = 280.
+p_init  = 100000.
+r_init  = common.eps * RH_init * common.p_vs(T_init) / (p_init - RH_init * common.p_vs(T_init))
+
+opts = {"w" : 1., "T_0" : T_init, "p_0" : p_init, "r_0" : r_init, "z_max" : 200, "sd_conc" : 1000,
+        "aerosol" : '{"ammonium_sulfate": {"kappa": 0.61, "mean_r": [5e-8], "gstdev": [1.5], "n_tot": [1e9]}}',
+        "out_bin" : '{"radii": {"rght": 1, "moms": [0], "drwt": "wet", "nbin": 1, "lnli": "lin", "left": 1e-06}}'}
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("dt_adapt")
+    data = {}
+
+    str_r = str(tmp.join("test_ref.nc"))
+    parcel(dt=1e-3, outfreq=10000, outfile=str_r, **opts)
+    data["ref"] = netcdf.netcdf_file(str_r, "r")
+
+    str_a = str(tmp.join("test_adapt.nc"))
+    parcel(dt=.1, outfreq=100, outfile=str_a, dt_adapt='{"dt_min": 1e-3, "dt_max": 1}', **opts)
+    data["adapt"] = netcdf.netcdf_file(str_a, "r")
+    return data
+
+def test_dt_adapt_output_times(data):
+    """ checking if the output is saved at the same times and heights as without adaptive timestepping """
+    assert np.isclose(data["adapt"].variables["t"][:], data["ref"].variables["t"][:], atol=1e-9, rtol=0).all()
+    assert np.isclose(data["adapt"].variables["z"][:], data["ref"].variables["z"][:], atol=1e-6, rtol=0).all()
+
+def test_dt_adapt_accuracy(data, eps=0.02):
+    """ checking if RH_max and N at the end of simulation are close to the small timestep ones """
+    assert np.isclose(data["adapt"].RH_max - 1, data["ref"].RH_max - 1, atol=0, rtol=eps)
+    assert np.isclose(data["adapt"].variables["radii_m0"][-1, 0], data["ref"].variables["radii_m0"][-1, 0], atol=0, rtol=eps)
+
+def test_dt_adapt_steps(data):
+    """ checking if adaptive timestepping uses fewer timesteps """
+    n_steps = int(200 / 1e-3)
+    assert data["adapt"].dt_adapt_steps < n_steps / 10
+    assert data["adapt"].dt_adapt_min <= data["adapt"].dt_adapt_max <= 1
@@ -0,0 +1,57 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+import json, os, subprocess, tempfile
+
+"""
+Comparison of an ensemble of parcel() runs in processes forked by parcel_ensemble with a pool
+of processes started with spawn (each one importing the libraries as a separate run would) and with
+the members run one after another: throughput (members per second) and peak memory. Both pools run
+the members in parallel, the forked processes save the imports. Each variant is run in a fresh
+interpreter; the peak memory of the pools is estimated as the peak of the parent plus the number
+of workers times the peak of the largest worker.
+"""
+
+n_members = 8
+workers   = 4
+opts      = {"z_max" : 200., "outfreq" : 100, "RH_0" : .99, "sd_conc" : 256}
+
+script = """
+import sys, json, time, resource
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+mode, members, workers, opts = sys.argv[1], json.loads(sys.argv[2]), int(sys.argv[3]), json.loads(sys.argv[4])
+t0 = time.time()
+if mode == "ensemble":
+  from parcel_ensemble import parcel_ensemble
+  parcel_ensemble(members = json.dumps(members), processes = workers, **opts)
+elif mode == "serial":
+  from parcel_ensemble import _member
+  for m in members:
+    _member(dict(opts, **m))
+else:
+  import multiprocessing
+  from concurrent.futures import ProcessPoolExecutor
+  from parcel_ensemble import _member
+  with ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context("spawn")) as pool:
+    list(pool.map(_member, [dict(opts, **m) for m in members]))
+wall = time.time() - t0
+self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+child_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+print(json.dumps({"wall" : wall, "mem" : self_kb + (workers * child_kb if mode != "serial" else 0)}))
+"""
+
+def run(mode, tmp):
+  members = [{"outfile" : os.path.join(tmp, mode + str(i) + ".nc"), "w" : .5 + .25 * i} for i in range(n_members)]
+  out = subprocess.check_output([sys.executable, "-c", script, mode, json.dumps(members), str(workers), json.dumps(opts)])
+  return json.loads(out.decode().strip().split("\n")[-1])
+
+def test_ensemble_perf():
+  tmp = tempfile.mkdtemp()
+  res = dict((mode, run(mode, tmp)) for mode in ["ensemble", "processes", "serial"])
+  print("")
+  for mode, r in res.items():
+    print(mode.ljust(10) + ": " + str(round(n_members / r["wall"], 2)) + " members/s, peak memory "
+          + str(round(r["mem"] / 1024., 1)) + " MB")
+  subprocess.call(["rm", "-r", tmp])
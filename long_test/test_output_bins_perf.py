@@ -0,0 +1,54 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+import parcel as pc
+import numpy as np
+import json, os, tempfile, timeit
+
+"""
+Benchmark of the spectra output per record against the number of bins: spectra diagnosed and
+written bin by bin (as before) and with the bulk output of _output_bins, which reads the bin edges
+once and writes all bins of each moment at once. libcloudph++ diagnoses one bin at a time in both
+cases (super-droplet arrays are not available in its Python bindings, so the bins cannot be
+computed in one pass over the super-droplets): the libcloudph++ calls are the same, the times
+differ only by the Python overhead and say nothing about the cost of the diagnostics themselves.
+Spectra sharing no bins (e.g. one wet and one dry spectrum) are diagnosed with the same number
+of calls as before.
+"""
+
+def output_bins_ref(fout, t, micro, opts, spectra):
+  # spectra diagnosed and written bin by bin (as before the bulk output)
+  for dim, dct in spectra.items():
+    for bin in range(dct["nbin"]):
+      micro.diag_wet_rng(
+        fout.variables[dim+"_r_wet"][bin],
+        fout.variables[dim+"_r_wet"][bin] + fout.variables[dim+"_dr_wet"][bin]
+      )
+      for vm in dct["moms"]:
+        micro.diag_wet_mom(vm)
+        fout.variables[dim+'_m'+str(vm)][int(t), ..., int(bin)] = np.frombuffer(micro.outbuf())
+
+def setup():
+  opts = pc._default_opts()
+  opts.update({"RH_0" : .95})
+  state, _ = pc._state_init(dict(opts, r_0 = pc._r_0(opts)))
+  micro = pc._micro_init(json.loads(opts["aerosol"]), opts, state, {"RH_max" : 0})
+  return micro, opts
+
+def test_output_bins_perf(n=5):
+  micro, opts = setup()
+  tmp = tempfile.mkdtemp()
+  print("\ntime per record [ms] (bin by bin / bulk)")
+  for nbin in [10, 100, 1000]:
+    spectra = {"radii" : {"rght": 1e-4, "left": 1e-9, "drwt": "wet", "lnli": "log", "nbin": nbin, "moms": [0, 1, 2, 3]}}
+    times = []
+    for name, output_bins in [("ref", output_bins_ref), ("bulk", pc._output_bins)]:
+      outfile = os.path.join(tmp, name + ".nc")
+      fout = pc._output_init(micro, dict(opts, outfile = outfile), spectra)
+      times.append(min(timeit.repeat(lambda: output_bins(fout, 0, micro, opts, spectra), number=n, repeat=3)) / n)
+      fout.close()
+      os.remove(outfile)
+    print("nbin = " + str(nbin).rjust(4) + ": " + " / ".join(str(round(t * 1e3, 2)) for t in times)
+          + " (Python overhead only, ratio " + str(round(times[0] / times[1], 2)) + ")")
+  os.rmdir(tmp)
@@ -0,0 +1,80 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+import parcel as pc
+from overhead_only import overhead_only
+from libcloudphxx import common, lgrngn
+import numpy as np
+import json, timeit
+
+"""
+Microbenchmark of the Python overhead of one timestep: libcloudph++ step_sync/step_async
+calls are skipped, so that only the work done in parcel.py is measured. The step plan
+(options and trace gases built once per run) is compared with a copy of the timestep
+as it was before the step plan (options and trace gases built in each step). The times
+are only printed, the check is done on the options passed to the (skipped) libcloudph++ calls.
+"""
+
+def stats_ref(state, info):
+  # _stats before the step plan
+  state["T"] = np.array([common.T(th_d, rhod) for th_d, rhod in zip(state["th_d"], state["rhod"])])
+  p_vs = np.array([common.p_vs(T) for T in state["T"]])
+  state["RH"] = state["p"] * state["r_v"] / (state["r_v"] + common.eps) / p_vs
+  info["RH_max"] = np.maximum(info["RH_max"], state["RH"])
+
+def micro_step_ref(micro, state, info, opts, it, fout, dt=None, cond=True, chem=True):
+  # _micro_step before the step plan
+  libopts = lgrngn.opts_t()
+  libopts.cond = cond
+  libopts.coal = False
+  libopts.adve = False
+  libopts.sedi = False
+
+  if dt is not None:
+    libopts.dt = dt
+
+  chem = chem and micro.opts_init.chem_switch
+  if chem:
+    libopts.chem_dsl = opts["chem_dsl"]
+    libopts.chem_dsc = opts["chem_dsc"]
+    libopts.chem_rct = opts["chem_rct"]
+
+  ambient_chem = {}
+  if micro.opts_init.chem_switch:
+    ambient_chem = dict((v, state[k]) for k,v in pc._Chem_g_id.items())
+
+  micro.step_sync(libopts, state["th_d"], state["r_v"], state["rhod"], ambient_chem=ambient_chem)
+  micro.step_async(libopts)
+
+  stats_ref(state, info)
+
+  if chem:
+    micro.diag_all()
+    for id_str, id_int in pc._Chem_g_id.items():
+      micro.diag_chem(id_int)
+      state[id_str.replace('_g', '_a')] = pc._outbuf(micro)
+
+def setup():
+  opts = pc._default_opts()
+  opts.update({"T_0" : 280., "RH_0" : .99})
+  state, _ = pc._state_init(dict(opts, r_0 = pc._r_0(opts)))
+  info = {"RH_max" : 0}
+  micro = overhead_only(pc._micro_init(json.loads(opts["aerosol"]), opts, state, info))
+  return micro, state, info, opts
+
+def test_step_plan_overhead(n=20000):
+  """ Python overhead per timestep with and without the step plan """
+  micro_ref, state, info, opts = setup()
+  before = min(timeit.repeat(lambda: micro_step_ref(micro_ref, state, info, opts, 0, None), number=n, repeat=3)) / n
+  micro, state, info, opts = setup()
+  plan = pc._step_plan(micro, state, opts)
+  after  = min(timeit.repeat(lambda: pc._micro_step(micro, state, info, opts, 0, None, plan=plan), number=n, repeat=3)) / n
+  print("\nPython overhead per timestep: " + str(round(before * 1e6, 2)) + " us without and "
+        + str(round(after * 1e6, 2)) + " us with the step plan")
+
+  # the same libcloudph++ calls, with the options built in each timestep before and once with the step plan
+  for call in ["step_sync", "step_async"]:
+    assert len(micro.calls[call]) == len(micro_ref.calls[call]) == 3 * n
+    assert len(set(map(id, micro_ref.calls[call]))) == 3 * n
+    assert all(libopts is plan.libopts[True, False] for libopts in micro.calls[call])
@@ -8,11 +8,20 @@ from scipy import __version__ as scipy_version
 assert Version(scipy_version) >= Version("0.12"), "see https://github.com/scipy/scipy/pull/491"
 
 from scipy.io import netcdf
+from scipy import interpolate, special
+import collections
+import functools
+import hashlib
 import json, inspect, numpy as np
+from math import exp, log, sqrt, pi
+import os
 import pdb
+import pickle
 import subprocess
+import threading
+import time
 
-from libcloudphxx import common, lgrngn
+from libcloudphxx import common, lgrngn, blk_2m
 from libcloudphxx import git_revision as libcloud_version
 
 parcel_version = subprocess.check_output(["git", "rev-parse", "HEAD"]).rstrip()
@@ -39,17 +48,92 @@ _Chem_a_id = {
   "S_VI"   : lgrngn.chem_species_t.S_VI
 }
 
+# backend labels (as accepted by the backend option) mapped onto libcloudph++ backends
+_backend_id = {
+  "serial"    : lgrngn.backend_t.serial,
+  "multicore" : lgrngn.backend_t.OpenMP
+}
+
+# minimal number of super-droplets for which backend="auto" chooses the multicore backend
+_backend_auto_sd_conc = 4096
+
+# default settings of the adaptive timestepping (see dt_adapt option)
+_dt_adapt_dflt = {"dt_min" : 1e-3, "dt_max" : 1., "RH_tol" : 1e-2, "N_tol" : 1e-2}
+
+# default settings of the automatic substepping (see sstp_auto option)
+_sstp_auto_dflt = {"cond_max" : 16, "RH_tol" : 1e-5, "chem_max" : 16, "chem_tol" : 1e-2}
+
+# parcel() options available only with the lagrangian scheme (see scheme option)
+_lgrngn_opts = ["chem_dsl", "chem_dsc", "chem_rct", "large_tail", "backend", "dt_adapt", "stop", "checkpoint",
+                "restart", "ff_RH", "sstp_auto", "chem_gate", "sd_alloc", "sd_adapt", "init_cache", "out_bin"]
+
+# chemical composition parameter of aerosol in the bulk scheme (as for ammonium sulfate)
+_blk_2m_chem_b = .55
+
+# range of dry radii [m], relative threshold of the main part of the spectrum and the upper limit of
+# n_sd_max per cell used in estimating the space needed with large_tail (see _n_sd_tail)
+_n_sd_tail_r = [1e-10, 1e-3]
+_n_sd_tail_rtol = 1e-3
+_n_sd_tail_max = int(1e6)
+
+# default weights of the activation and tail regions of the spectrum, the supersaturation defining the
+# activation radius, the sampling and the seed of the random numbers (see sd_alloc option), valid samplings,
+# fraction of particles below the tail of tabulated distributions (as two standard deviations above the mean),
+# width of the activation region (as geometric standard deviation), surface tension of water [N/m] and number
+# of points of the ln(r) grid used in placing the SDs
+_sd_alloc_dflt = {"act" : 0., "S_act" : .003, "tail" : 0., "sampling" : "midpoint", "seed" : None}
+_sd_alloc_sampling = ["midpoint", "stratified", "quasi"]
+_sd_alloc_tail_cdf = .977
+_sd_alloc_act_gstdev = 1.5
+_sd_alloc_sgm_w = .072
+_sd_alloc_n_lnr = 4001
+
+# default RH threshold of re-allocating the SDs and number of SDs after it (None: sd_conc), and the weight
+# of the activation region if no weights are given (see sd_adapt option)
+_sd_adapt_dflt = {"RH" : .99, "sd_conc" : None}
+_sd_adapt_act = 1.
+
+# number of points of the tables handed to libcloudph++ for tabulated aerosol distributions and
+# the files with tabulated distributions parsed so far (shared by all runs in the process)
+_aerosol_tab_n = 10001
+_aerosol_files = {}
+_aerosol_files_lock = threading.Lock()
+
+# default settings of the cache of the SD placements computed for init() and the SD placements
+# cached in memory (pickled, least recently used first, shared by all runs in the process, see init_cache option)
+_init_cache_dflt = {"dir" : None, "max_mb" : 64}
+_init_cache = collections.OrderedDict()
+_init_cache_lock = threading.Lock()
+
+# valid thresholds for switching chemistry on and the default number of timesteps
+# between the diagnostics of the liquid water content (see chem_gate option)
+_chem_gate_keys = ["RH", "LWC", "every"]
+_chem_gate_every = 10
+
+# valid criteria for stopping the simulation (see stop option)
+_stop_keys = ["z", "t_after_RH_max", "N_tol", "LWC", "wait_tol"]
+
+# options that may differ between a checkpointed run and its restart
+_restart_opts = ["z_max", "wait", "stop", "checkpoint", "checkpoint_file", "restart", "init_cache"]
+
 class lognormal(object):
+  # called by libcloudph++ with a float for each radius (constants computed once),
+  # returns an array if called with an array of ln(r)
   def __init__(self, mean_r, gstdev, n_tot):
     self.mean_r = mean_r
     self.gstdev = gstdev
     self.n_tot = n_tot
+    self._lnm = log(mean_r)
+    self._lns = log(gstdev)
+    self._lns2 = log(gstdev)**2
+    self._sqrt_2pi = sqrt(2*pi)
 
   def __call__(self, lnr):
-    from math import exp, log, sqrt, pi
+    if isinstance(lnr, np.ndarray):
+      return self.n_tot * np.exp(-(lnr - self._lnm)**2 / 2 / self._lns2) / self._lns / self._sqrt_2pi
     return self.n_tot * exp(
-      -(lnr - log(self.mean_r))**2 / 2 / log(self.gstdev)**2
-    ) / log(self.gstdev) / sqrt(2*pi);
+      -(lnr - self._lnm)**2 / 2 / self._lns2
+    ) / self._lns / self._sqrt_2pi;
 
 class sum_of_lognormals(object):
   def __init__(self, lognormals=[]):
@@ -61,27 +145,368 @@ class sum_of_lognormals(object):
       res += lognormal(lnr)
     return res
 
-def _micro_init(aerosol, opts, state, info):
+class tabulated(object):
+  # size distribution (e.g. sum_of_lognormals) tabulated on a uniform grid in ln(r) between r_min and r_max:
+  # one linear interpolation per call instead of evaluating all modes (zero outside the table),
+  # the table is available as lnr and pdf arrays
+  # (parcel() uses it only for aerosol files, lognormal modes are passed as sum_of_lognormals so that the
+  # initial spectra do not change by the interpolation error; for lognormals it is opt-in for callers
+  # building the libcloudph++ opts_init themselves, see long_test/test_distro_perf.py)
+  def __init__(self, distro, r_min=1e-10, r_max=1e-3, n=10001):
+    self.lnr = np.linspace(log(r_min), log(r_max), n)
+    self.pdf = np.asarray(distro(self.lnr), dtype=float)
+    self._lnr_min = self.lnr[0]
+    self._dlnr = self.lnr[1] - self.lnr[0]
+    self._n = n
+    self._pdf = self.pdf.tolist()
+
+  def __call__(self, lnr):
+    if isinstance(lnr, np.ndarray):
+      return np.interp(lnr, self.lnr, self.pdf, left=0., right=0.)
+    x = (lnr - self._lnr_min) / self._dlnr
+    if x < 0 or x >= self._n - 1:
+      return 0.
+    i = int(x)
+    return self._pdf[i] + (self._pdf[i+1] - self._pdf[i]) * (x - i)
+
+def _n_sd_tail(dry_distros, sd_conc):
+  # estimated number of tail SDs per cell: the range of radii resolved with sd_conc SDs is extended
+  # with bins of the same width in ln(r) as long as they contain at least one particle (in 1 m^3)
+  lnr = np.linspace(np.log(_n_sd_tail_r[0]), np.log(_n_sd_tail_r[1]), 1001)
+  n_tail = 0
+  for distro in dry_distros.values():
+    n_lnr = distro(lnr)
+    main = np.where(n_lnr >= n_lnr.max() * _n_sd_tail_rtol)[0]
+    dlnr = (lnr[main[-1]] - lnr[main[0]]) / sd_conc
+    tail = np.where(n_lnr * dlnr >= 1)[0]
+    if dlnr > 0 and len(tail) and tail[-1] > main[-1]:
+      n_tail += int(np.ceil((lnr[tail[-1]] - lnr[main[-1]]) / dlnr))
+  # some margin (the model is recreated with more space if it is not enough anyway)
+  return int(1.25 * n_tail) + 1
+
+def _sd_alloc(name, dct, alloc, sd_conc, T):
+  # dry radii and concentrations of sd_conc SDs representing one aerosol type (as libcloudph++ dry_sizes):
+  # sd_conc equal-probability bins of an importance density in ln(r) (sum of normalised densities of the
+  # modes, the activation region and the tail, each with its weight) with one SD in each bin, which gets
+  # the concentration and the mean dry mass of aerosol in its bin
+  lnr = np.linspace(np.log(_n_sd_tail_r[0]), np.log(_n_sd_tail_r[1]), _sd_alloc_n_lnr)
+  dlnr = lnr[1] - lnr[0]
+  if "file" in dct:
+    # tabulated distribution as a single mode
+    n_lnr = _dry_distro(dct)(lnr)
+    imp = n_lnr / np.sum(n_lnr * dlnr)
+  else:
+    weights = alloc.get("modes", {}).get(name, [1.] * len(dct["mean_r"]))
+    n_lnr, imp = np.zeros(lnr.size), np.zeros(lnr.size)
+    for mean_r, gstdev, n_tot, weight in zip(dct["mean_r"], dct["gstdev"], dct["n_tot"], weights):
+      mode = lognormal(mean_r, gstdev, n_tot)(lnr)
+      n_lnr += mode
+      imp += weight * mode / n_tot
+
+  # activation region: around the dry radius activating at supersaturation S_act (kappa-Koehler theory)
+  # (for an array of temperatures, e.g. of the parcels of parcel_batch() sharing the placement,
+  # the mean of the normalised densities around the activation radius at each of them)
+  alloc = dict(_sd_alloc_dflt, **alloc)
+  if alloc["act"] > 0:
+    Ts = np.unique(T)
+    for T_i in Ts:
+      A = 2 * _sd_alloc_sgm_w / common.rho_w / common.R_v / T_i
+      r_act = (4 * A**3 / 27 / dct["kappa"] / alloc["S_act"]**2)**(1./3)
+      imp += alloc["act"] / Ts.size * lognormal(r_act, _sd_alloc_act_gstdev, 1.)(lnr)
+
+  # tail: uniform in ln(r) from two standard deviations above the largest mode (for tabulated distributions,
+  # from the radius with the same fraction of particles above it) up to the largest radius with
+  # at least one particle (in 1 m^3) per unit ln(r)
+  if alloc["tail"] > 0:
+    if "file" in dct:
+      cdf = np.cumsum(n_lnr) / np.sum(n_lnr)
+      lo = lnr[np.searchsorted(cdf, _sd_alloc_tail_cdf)]
+    else:
+      lo = max(np.log(r) + 2 * np.log(g) for r, g in zip(dct["mean_r"], dct["gstdev"]))
+    hi = lnr[np.where(n_lnr >= 1)[0][-1]] if np.any(n_lnr >= 1) else lo
+    if hi > lo:
+      imp += alloc["tail"] * np.where((lnr >= lo) & (lnr <= hi), 1. / (hi - lo), 0.)
+
+  # cumulative distribution of the importance density
+  cdf_imp = np.concatenate([[0.], np.cumsum((imp[1:] + imp[:-1]) / 2 * dlnr)])
+  imp /= cdf_imp[-1]
+  cdf_imp /= cdf_imp[-1]
+  ok = np.concatenate([[True], np.diff(cdf_imp) > 0])
+
+  if alloc["sampling"] == "midpoint":
+    # aerosol concentration of each bin at the radius of its mean dry mass, so that both the number and the
+    # dry mass of each bin are preserved (midpoints of the bins without aerosol); both are integrated exactly
+    # in each bin (on the ln(r) grid, all bins within one grid cell would get the same radius)
+    edges = np.interp(np.linspace(0, 1, sd_conc + 1), cdf_imp[ok], lnr[ok])
+    x = np.interp((np.arange(sd_conc) + .5) / sd_conc, cdf_imp[ok], lnr[ok])
+    if "file" in dct:
+      conc, m3 = [np.diff(_tabulated_int(_dry_distro(dct), edges, k)) for k in [0, 3]]
+    else:
+      conc, m3 = np.zeros(sd_conc), np.zeros(sd_conc)
+      for mean_r, gstdev, n_tot in zip(dct["mean_r"], dct["gstdev"], dct["n_tot"]):
+        lnm, lns = log(mean_r), log(gstdev)
+        conc += n_tot * _lognormal_int(edges, lnm, lns)
+        m3 += n_tot * exp(3 * lnm + 4.5 * lns**2) * _lognormal_int(edges, lnm + 3 * lns**2, lns)
+    full = (conc > 0) & (m3 > 0)
+    x[full] = np.log(m3[full] / conc[full]) / 3
+  else:
+    # one random point in each bin (stratified) or a randomly shifted van der Corput sequence (quasi)
+    # with the importance sampling weights n(r) / (sd_conc * importance density)
+    rng = np.random.RandomState(alloc["seed"])
+    if alloc["sampling"] == "stratified":
+      u = (np.arange(sd_conc) + rng.uniform(size=sd_conc)) / sd_conc
+    else:
+      u = (_van_der_corput(sd_conc) + rng.uniform()) % 1
+    x = np.interp(u, cdf_imp[ok], lnr[ok])
+    conc = np.interp(x, lnr, n_lnr) / sd_conc / np.interp(x, lnr, imp)
+
+  sizes = {}
+  for r, c in zip(np.exp(x), conc):
+    if c > 0:
+      sizes[float(r)] = [sizes.get(float(r), [0.])[0] + float(c), 1]
+  return sizes
+
+def _dry_sizes(aerosol, opts, alloc, T, info):
+  # dry_sizes of all aerosol types placed as given by sd_alloc, taken from the cache (in memory, then on disk)
+  # if init_cache is set and the placement is deterministic (midpoint sampling or a given seed)
+  sizes = lambda: dict((dct["kappa"], _sd_alloc(name, dct, alloc, opts["sd_conc"], T)) for name, dct in aerosol.items())
+  cache = json.loads(opts["init_cache"])
+  if not cache or (alloc.get("sampling", _sd_alloc_dflt["sampling"]) != "midpoint" and alloc.get("seed") is None):
+    return sizes()
+  cache = dict(_init_cache_dflt, **cache)
+  max_b = cache["max_mb"] * 2**20
+
+  # all inputs of the placement (with the modification times of aerosol files) and the libcloudph++ revision
+  mtimes = sorted(os.path.getmtime(dct["file"]) for dct in aerosol.values() if "file" in dct)
+  key = hashlib.sha1(json.dumps([aerosol, mtimes, alloc, opts["sd_conc"], np.unique(T).tolist(), str(libcloud_version)],
+    sort_keys=True).encode()).hexdigest()
+  path = os.path.join(cache["dir"], key + ".pkl") if cache["dir"] is not None else None
+
+  with _init_cache_lock:
+    if key in _init_cache:
+      _init_cache.move_to_end(key)
+      info["init_cache"] = "memory"
+      return pickle.loads(_init_cache[key])
+  if path is not None and os.path.exists(path):
+    with open(path, "rb") as f:
+      data = f.read()
+    val = pickle.loads(data)
+    os.utime(path)
+    info["init_cache"] = "disk"
+  else:
+    val = sizes()
+    data = pickle.dumps(val)
+    info["init_cache"] = "miss"
+    if path is not None:
+      # written atomically, the least recently used files removed above max_mb
+      os.makedirs(cache["dir"], exist_ok=True)
+      tmp = path + "." + str(os.getpid()) + ".tmp"
+      with open(tmp, "wb") as f:
+        f.write(data)
+      os.replace(tmp, path)
+      files = sorted((os.path.join(cache["dir"], fn) for fn in os.listdir(cache["dir"]) if fn.endswith(".pkl")),
+        key=os.path.getmtime)
+      size = sum(os.path.getsize(fn) for fn in files)
+      for fn in files[:-1]:
+        if size <= max_b:
+          break
+        size -= os.path.getsize(fn)
+        os.remove(fn)
+
+  with _init_cache_lock:
+    _init_cache[key] = data
+    while len(_init_cache) > 1 and sum(len(val) for val in _init_cache.values()) > max_b:
+      _init_cache.popitem(last=False)
+  return val
+
+def _lognormal_int(edges, lnm, lns):
+  # fractions of a lognormal distribution (with ln of the mean radius lnm and of the geometric
+  # standard deviation lns) between consecutive edges in ln(r) (erfc on the side of each tail)
+  a, b = (edges[:-1] - lnm) / lns / sqrt(2), (edges[1:] - lnm) / lns / sqrt(2)
+  return np.where(a + b > 0, special.erfc(a) - special.erfc(b), special.erfc(-b) - special.erfc(-a)) / 2
+
+def _tabulated_int(distro, x, k):
+  # integrals of a tabulated distribution times r^k from its smallest radius up to each of x
+  # (exact for the linear interpolation between the points of the table)
+  lnr, pdf = distro.lnr, distro.pdf
+  x = np.clip(x, lnr[0], lnr[-1])
+  def seg(i, y):
+    # integral over [lnr[i], y] in the i-th interval of the table
+    slope = (pdf[i+1] - pdf[i]) / (lnr[i+1] - lnr[i])
+    if k == 0:
+      return (pdf[i] + slope * (y - lnr[i]) / 2) * (y - lnr[i])
+    prim = lambda u: np.exp(k * u) * ((pdf[i] + slope * (u - lnr[i])) / k - slope / k**2)
+    return prim(y) - prim(lnr[i])
+  cum = np.concatenate([[0.], np.cumsum(seg(np.arange(lnr.size - 1), lnr[1:]))])
+  i = np.clip(np.searchsorted(lnr, x, side="right") - 1, 0, lnr.size - 2)
+  return cum[i] + seg(i, x)
+
+def _van_der_corput(n):
+  # first n points of the base-2 van der Corput low-discrepancy sequence in [0, 1)
+  i, u, f = np.arange(n), np.zeros(n), .5
+  while np.any(i > 0):
+    u += f * (i & 1)
+    i, f = i >> 1, f / 2
+  return u
+
+def _water(micro):
+  # liquid water mixing ratio of all particles (wet minus dry volume) [kg/kg]
+  micro.diag_all()
+  micro.diag_wet_mom(3)
+  wet = _outbuf(micro)
+  micro.diag_dry_mom(3)
+  return 4./3 * np.pi * common.rho_w * (wet - _outbuf(micro))
+
+def _sd_adapt(micro, aerosol, opts, state, info, resmpl):
+  # SDs re-allocated as given by the sd_adapt option: the new SDs are initialised from the dry spectrum
+  # at the current state with wet radii in equilibrium with RH; the liquid water they gain (or lose)
+  # is taken from (or given back to) the water vapour with the latent heat, as in condensation
+  water = _water(micro)
+  alloc = dict(json.loads(opts["sd_alloc"]), **dict((k, v) for k, v in resmpl.items() if k not in _sd_adapt_dflt))
+  if not any(k in alloc for k in ["act", "tail", "modes"]):
+    alloc["act"] = _sd_adapt_act
+  sd_conc = resmpl["sd_conc"] if resmpl["sd_conc"] is not None else opts["sd_conc"]
+  micro = _micro_init(aerosol, dict(opts, sd_conc=sd_conc, sd_alloc=json.dumps(alloc)), state, info)
+
+  micro.diag_sd_conc()
+  info["sd_adapt_t"] = state["t"]
+  info["sd_adapt_n_sd"] = int(round(np.sum(_outbuf(micro))))
+  info["sd_adapt_water_before"], info["sd_adapt_water_after"] = water, _water(micro)
+
+  # total water and energy conserved (the next step_sync takes th_d and r_v from state)
+  dw = info["sd_adapt_water_after"] - water
+  T = state["T"][0]
+  state["th_d"][0] += common.l_v(T) / common.c_pd * state["th_d"][0] / T * dw
+  state["r_v"][0] -= dw
+  _stats(state, info)
+  return micro
+
+def _aerosol_file(path):
+  # file with tabulated aerosol size distributions, parsed once per process (and again only if modified,
+  # replacing the entry of the previous version): CSV files are read as a whole, NetCDF variables
+  # are read when first used (the file is closed after reading)
+  key, mtime = os.path.abspath(path), os.path.getmtime(path)
+  if key not in _aerosol_files or _aerosol_files[key]["mtime"] != mtime:
+    if path.endswith(".csv"):
+      # (column names taken from the header as they are, without the changes made by genfromtxt)
+      with open(path) as f:
+        names = [name.strip().strip('"') for name in f.readline().split(",")]
+      data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+      cols = dict((name, data[:, i]) for i, name in enumerate(names))
+      _aerosol_files[key] = {"nc" : None, "r" : names[0], "cols" : cols, "distros" : {}, "mtime" : mtime}
+    else:
+      _aerosol_files[key] = {"nc" : path, "cols" : {}, "distros" : {}, "mtime" : mtime}
+  return _aerosol_files[key]
+
+def _aerosol_table(path, dist):
+  # radii [m] and dN/dlnr [m^-3] of the distribution dist (sorted by radius)
+  with _aerosol_files_lock:
+    fil = _aerosol_file(path)
+    if fil["nc"] is None:
+      r, n = fil["cols"][fil["r"]], fil["cols"][dist]
+    else:
+      if dist not in fil["cols"]:
+        with netcdf.netcdf_file(fil["nc"], 'r', mmap=False) as nc:
+          var = nc.variables[dist]
+          fil["cols"][dist] = (np.array(nc.variables[var.dimensions[0]][:], dtype=float), np.array(var[:], dtype=float))
+      r, n = fil["cols"][dist]
+  order = np.argsort(r)
+  return r[order], n[order]
+
+def _aerosol_tabulated(dct):
+  # tabulated distribution built once from the monotone (PCHIP) interpolant of dN/dlnr in ln(r)
+  # (libcloudph++ gets an evaluator with one linear interpolation per call, see tabulated)
+  with _aerosol_files_lock:
+    distros = _aerosol_file(dct["file"])["distros"]
+    if dct["dist"] in distros:
+      return distros[dct["dist"]]
+  r, n = _aerosol_table(dct["file"], dct["dist"])
+  pchip = interpolate.PchipInterpolator(np.log(r), n, extrapolate=False)
+  distro = tabulated(lambda lnr: np.maximum(np.nan_to_num(pchip(lnr)), 0.), r_min=r[0], r_max=r[-1], n=_aerosol_tab_n)
+  with _aerosol_files_lock:
+    return _aerosol_file(dct["file"])["distros"].setdefault(dct["dist"], distro)
+
+def _dry_distro(dct):
+  # size distribution of one aerosol type: lognormal modes or tabulated (see aerosol option)
+  if "file" in dct:
+    return _aerosol_tabulated(dct)
+  return sum_of_lognormals([lognormal(dct["mean_r"][i], dct["gstdev"][i], dct["n_tot"][i]) for i in range(len(dct["mean_r"]))])
+
+def _n_threads():
+  # number of threads available to the OpenMP backend
+  if "OMP_NUM_THREADS" in os.environ:
+    return int(os.environ["OMP_NUM_THREADS"])
+  if hasattr(os, "sched_getaffinity"):
+    return len(os.sched_getaffinity(0))
+  return os.cpu_count() or 1
+
+def _backend_choice(opts_init, opts):
+  # returns the list of backends to try (in order of preference)
+  if opts["backend"] != "auto":
+    return [opts["backend"]]
+  # n_sd_max includes the space reserved for the large tail SDs
+  if opts_init.n_sd_max >= _backend_auto_sd_conc and _n_threads() > 1:
+    return ["multicore", "serial"]
+  return ["serial"]
+
+def _micro_factory(opts_init, opts, info):
+  # creating the libcloudph++ particle model using the selected backend
+  # (with "auto", falling back to serial if the library was built without OpenMP)
+  choice = _backend_choice(opts_init, opts)
+  for backend in choice:
+    try:
+      micro = lgrngn.factory(_backend_id[backend], opts_init)
+    except Exception:
+      if backend == choice[-1]: raise
+      continue
+    info["backend_used"] = backend
+    info["backend_threads"] = 1 if backend == "serial" else _n_threads()
+    return micro
+
+def _micro_init(aerosol, opts, state, info, nx=0):
 
   # lagrangian scheme options
   opts_init = lgrngn.opts_init_t()
   for opt in ["dt", "sd_conc", "chem_rho", "sstp_cond"]:
     setattr(opts_init, opt, opts[opt])
-  opts_init.n_sd_max = opts_init.sd_conc
+
+  # nx > 0: independent parcels as grid cells (see parcel_batch.py)
+  if nx > 0:
+    opts_init.nx = nx
+    opts_init.dx = 1.
+    opts_init.x1 = nx * opts_init.dx
+  opts_init.n_sd_max = opts_init.sd_conc * max(1, nx)
 
   # read in the initial aerosol size distribution
   dry_distros = {}
   for name, dct in aerosol.items(): # loop over kappas
-    lognormals = []
-    for i in range(len(dct["mean_r"])):
-      lognormals.append(lognormal(dct["mean_r"][i], dct["gstdev"][i], dct["n_tot"][i]))
-    dry_distros[dct["kappa"]] = sum_of_lognormals(lognormals)
+    dry_distros[dct["kappa"]] = _dry_distro(dct)
   opts_init.dry_distros = dry_distros
 
+  # importance-weighted placement of SDs (see sd_alloc option, the seed alone keeps the default placement);
+  # tabulated distributions are always placed by parcel (midpoint placement without weights by default),
+  # as libcloudph++ would call the interpolation of the table in Python for each of its samples
+  alloc = json.loads(opts["sd_alloc"])
+  if alloc.get("seed") is not None:
+    opts_init.rng_seed = alloc["seed"]
+  tab = any("file" in dct for dct in aerosol.values()) and not opts["large_tail"]
+  if set(alloc) - set(["seed"]) or tab:
+    opts_init.dry_sizes = _dry_sizes(aerosol, opts, alloc, opts["T_0"], info)
+    opts_init.dry_distros = {}
+    opts_init.sd_conc = 0
+    opts_init.n_sd_max = sum(len(sizes) for sizes in opts_init.dry_sizes.values()) * max(1, nx)
+
   # better resolution for the SD tail
+  # (space for the tail SDs estimated from the aerosol spectrum, see _n_sd_tail)
   if opts["large_tail"]:
       opts_init.sd_conc_large_tail = 1
-      opts_init.n_sd_max = int(1e6)  # some more space for the tail SDs
+      opts_init.n_sd_max = (opts_init.sd_conc + _n_sd_tail(dry_distros, opts_init.sd_conc)) * max(1, nx)
+
+  # timestep set in each step_sync call (see dt_adapt and sstp_auto options)
+  if json.loads(opts["dt_adapt"]) or json.loads(opts["sstp_auto"]):
+    if not hasattr(opts_init, "variable_dt_switch"):
+      raise Exception("dt_adapt and sstp_auto require libcloudph++ with variable timestep support (variable_dt_switch)")
+    opts_init.variable_dt_switch = True
 
   # switch off sedimentation and collisions
   opts_init.sedi_switch = False
@@ -94,90 +519,355 @@ def _micro_init(aerosol, opts, state, info):
     opts_init.sstp_chem = opts["sstp_chem"]
 
   # initialisation
-  micro = lgrngn.factory(lgrngn.backend_t.serial, opts_init)
+  # (with large_tail, n_sd_max is doubled and the model recreated if the estimate was too low,
+  # i.e. only if libcloudph++ reports that the SDs exceed n_sd_max, up to _n_sd_tail_max per cell)
   ambient_chem = {}
-  if micro.opts_init.chem_switch:
+  if opts_init.chem_switch:
     ambient_chem = dict((v, state[k]) for k,v in _Chem_g_id.items())
-  micro.init(state["th_d"], state["r_v"], state["rhod"], ambient_chem=ambient_chem)
+  while True:
+    micro = _micro_factory(opts_init, opts, info)
+    try:
+      micro.init(state["th_d"], state["r_v"], state["rhod"], ambient_chem=ambient_chem)
+      break
+    except RuntimeError as err:
+      if not opts["large_tail"] or "n_sd_max" not in str(err) or opts_init.n_sd_max >= _n_sd_tail_max * max(1, nx): raise
+      opts_init.n_sd_max = min(2 * opts_init.n_sd_max, _n_sd_tail_max * max(1, nx))
+
+  # number of SDs actually used (constant during the simulation: no coalescence and no sources)
+  if opts["large_tail"]:
+    micro.diag_sd_conc()
+    info["n_sd_max"] = opts_init.n_sd_max
+    info["sd_peak"] = max(info.get("sd_peak", 0), int(round(np.sum(_outbuf(micro)))))
 
   # sanity check
   _stats(state, info)
-  if (state["RH"] > 1): raise Exception("Please supply initial T,p,r_v below supersaturation")
+  if (np.any(state["RH"] > 1)): raise Exception("Please supply initial T,p,r_v below supersaturation")
 
   return micro
 
-def _micro_step(micro, state, info, opts, it, fout):
-  libopts = lgrngn.opts_t()
-  libopts.cond = True
-  libopts.coal = False
-  libopts.adve = False
-  libopts.sedi = False
-
-  # chemical options
-  if micro.opts_init.chem_switch:
-    # chem processes: dissolving, dissociation, reactions
-    libopts.chem_dsl = opts["chem_dsl"]
-    libopts.chem_dsc = opts["chem_dsc"]
-    libopts.chem_rct = opts["chem_rct"]
-
-  # get trace gases
-  ambient_chem = {}
-  if micro.opts_init.chem_switch:
-    ambient_chem = dict((v, state[k]) for k,v in _Chem_g_id.items())
+class _step_plan(object):
+  # libcloudph++ options and trace gases built once and reused in each timestep
+  # (has to be rebuilt if the trace gas arrays in state are replaced)
+  def __init__(self, micro, state, opts):
+    chem_switch = micro.opts_init.chem_switch
+
+    # options for condensation with chemistry, condensation only and chemistry only
+    self.libopts = {}
+    for cond, chem in [(True, True), (True, False), (False, True)]:
+      libopts = lgrngn.opts_t()
+      libopts.cond = cond
+      libopts.coal = False
+      libopts.adve = False
+      libopts.sedi = False
+
+      # chemical options
+      if chem and chem_switch:
+        # chem processes: dissolving, dissociation, reactions
+        libopts.chem_dsl = opts["chem_dsl"]
+        libopts.chem_dsc = opts["chem_dsc"]
+        libopts.chem_rct = opts["chem_rct"]
+      self.libopts[cond, chem] = libopts
+
+    # trace gases (arrays updated in place by libcloudph++)
+    self.ambient_chem = {}
+    if chem_switch:
+      self.ambient_chem = dict((v, state[k]) for k,v in _Chem_g_id.items())
+
+    # chemistry called since the last update of the aqueous chem state (see _chem_diag)
+    self.chem_due = False
+
+    # thresholds for switching chemistry on (see chem_gate option)
+    self.gate = json.loads(opts["chem_gate"]) if chem_switch else {}
+
+def _micro_step(micro, state, info, opts, it, fout, plan, dt=None, cond=True, chem=True, steps=1):
+  # returns True if chemistry was called (False if switched off or skipped, see chem_gate option)
+  # (steps - number of timesteps whose chemistry is done in this call, more than one with sstp_auto)
+  chem = chem and micro.opts_init.chem_switch
+  # wall time of calls with chemistry requested, with and without it (see _chem_gate_report)
+  timing = info.setdefault("_chem_gate_wall", [0., 0, 0., 0]) if chem and plan.gate else None
+  if chem and plan.gate and "chem_gate_t" not in info:
+    chem = _chem_gate(micro, state, info, plan.gate, it, steps)
+  if not (cond or chem):
+    if timing is not None:
+      timing[1] += 1
+    return False
+  libopts = plan.libopts[cond, chem]
+
+  # variable timestep (see dt_adapt and sstp_auto options)
+  if dt is not None:
+    libopts.dt = dt
 
   # call libcloudphxx microphysics
-  micro.step_sync(libopts, state["th_d"], state["r_v"], state["rhod"], ambient_chem=ambient_chem)
+  if timing is not None:
+    wall = time.time()
+  micro.step_sync(libopts, state["th_d"], state["r_v"], state["rhod"], ambient_chem=plan.ambient_chem)
   micro.step_async(libopts)
+  if timing is not None:
+    timing[2 * chem] += time.time() - wall
+    timing[2 * chem + 1] += 1
 
   # update state after microphysics (needed for below update for chemistry)
   _stats(state, info)
 
+  # aqueous chem in state is updated only when needed (see _chem_diag)
+  if chem:
+    plan.chem_due = True
+  return chem
+
+def _chem_gate(micro, state, info, gate, it, steps=1):
+  # chemistry is switched on (for the rest of the run) when RH or the liquid water
+  # content of activated droplets reaches its threshold in any of the parcels
+  # (RH is checked in each timestep, the liquid water content has to be diagnosed so only every few timesteps;
+  # with sstp_auto both are checked only in the chemistry calls, each for steps timesteps)
+  lwc_due = "LWC" in gate and it % gate.get("every", _chem_gate_every) == 0
+  if ("RH" in gate and np.any(state["RH"] >= gate["RH"])) or (lwc_due and np.any(_lwc(micro) >= gate["LWC"])):
+    info["chem_gate_t"] = state["t"]
+    return True
+  info["chem_gate_steps"] = info.get("chem_gate_steps", 0) + steps
+  return False
+
+def _chem_gate_report(info):
+  # wall time saved by the calls without chemistry estimated from the mean wall time of calls
+  # with and without chemistry (if there were both; with sstp_auto the skipped calls take no time)
+  wall_off, n_off, wall_on, n_on = info.pop("_chem_gate_wall", [0., 0, 0., 0])
+  if "chem_gate_steps" in info or "chem_gate_t" in info:
+    info.setdefault("chem_gate_steps", 0)
+    info.setdefault("chem_gate_t", -1.)
+    info["chem_gate_time_saved"] = max(wall_on / n_on - wall_off / n_off, 0) * n_off if n_on and n_off else 0.
+
+def _chem_gate_save(fout, info):
+  # chem_gate attributes, saved at the end of the run (the gate may open in the wait phase)
+  _chem_gate_report(info)
+  _save_attrs(fout, dict((k, info[k]) for k in ["chem_gate_t", "chem_gate_steps", "chem_gate_time_saved"] if k in info))
+
+def _chem_diag(micro, state, plan):
   # update in state for aqueous chem (TODO do we still want to have aq chem in state?)
+  # all species in one pass, only if chemistry was called since the last update
+  if not plan.chem_due:
+    return
+  micro.diag_all() # selecting all particles
+  for id_str, id_int in _Chem_g_id.items():
+    # save changes due to chemistry
+    micro.diag_chem(id_int)
+    state[id_str.replace('_g', '_a')] = _outbuf(micro)
+  plan.chem_due = False
+
+def _forcing(state, forcing, opts, it):
+  # diagnostics
+  # the reasons to use analytic solution:
+  # - independent of dt
+  # - same as in 2D kinematic model
+  state["z"] = forcing["z"][it]
+  state["t"] = it * opts["dt"]
+
+  # pressure and dry air density
+  state["p"], state["rhod"][0] = forcing["prof"](it, opts["w"] * opts["dt"],
+    state["p"], state["th_d"][0], state["r_v"][0], state["rhod"][0]
+  )
+
+def _advance(micro, state, info, opts, it, k, forcing, plan):
+  # timesteps it+1 ... it+k with nothing checked in between (e.g. up to the next output record), returns it+k
+  # for a single parcel, T, RH and RH_max are computed with Python floats and written to state and info
+  # after the last timestep (the result is the same as of k calls of _forcing and _micro_step)
+  if micro.opts_init.nx > 0 or plan.gate:
+    for it in range(it + 1, it + k + 1):
+      _forcing(state, forcing, opts, it)
+      _micro_step(micro, state, info, opts, it, None, plan=plan)
+    return it
+  if k == 0:
+    return it
+
+  th_d, r_v, rhod = state["th_d"], state["r_v"], state["rhod"]
+  z, prof, dz = forcing["z"], forcing["prof"], opts["w"] * opts["dt"]
+  libopts, ambient_chem = plan.libopts[True, micro.opts_init.chem_switch], plan.ambient_chem
+  step_sync, step_async = micro.step_sync, micro.step_async
+  p, RH_max = state["p"], float(np.max(info["RH_max"]))
+  for it in range(it + 1, it + k + 1):
+    # forcing (as in _forcing)
+    p, rhod[0] = prof(it, dz, p, th_d.item(0), r_v.item(0), rhod.item(0))
+
+    # microphysics and thermodynamic state (as in _micro_step and _stats)
+    step_sync(libopts, th_d, r_v, rhod, ambient_chem=ambient_chem)
+    step_async(libopts)
+    T = common.T(th_d.item(0), rhod.item(0))
+    RH = p * r_v.item(0) / (r_v.item(0) + common.eps) / common.p_vs(T)
+    RH_max = max(RH_max, RH)
+
+  state["z"], state["t"], state["p"] = z[it], it * opts["dt"], p
+  if state["T"] is None:
+    state["T"], state["RH"] = np.empty(1), np.empty(1)
+  state["T"][0], state["RH"][0] = T, RH
+  info["RH_max"] = np.maximum(info["RH_max"], np.array([RH_max]))
+  if micro.opts_init.chem_switch:
+    plan.chem_due = True
+  return it
+
+def _micro_step_auto(micro, state, info, opts, it, auto, plan):
+  # condensation in auto["k"] calls with dt/k and chemistry in separate calls every auto["m"] timesteps
+  # with m*dt, both chosen from the changes in the previous timesteps (see sstp_auto option)
+  dt, k = opts["dt"], auto["k"]
+  RH_old = state["RH"][0]
+  for _ in range(k):
+    _micro_step(micro, state, info, opts, it, None, dt=dt/k, chem=False, plan=plan)
+  auto["cond_calls"] += k
+  state["cond_substeps"] = k * micro.opts_init.sstp_cond
+
+  # error estimate from the change of the RH tendency between timesteps
+  dRH, auto["dRH"] = auto["dRH"], state["RH"][0] - RH_old
+  err = abs(auto["dRH"] - dRH) / auto["RH_tol"] if dRH is not None else 0
+  if err > 1:
+    auto["k"] = min(2 * k, auto["cond_max"])
+  elif err < .25:
+    auto["k"] = max(k // 2, 1)
+
   if micro.opts_init.chem_switch:
-    micro.diag_all() # selecting all particles
-    for id_str, id_int in _Chem_g_id.items():
-      # save changes due to chemistry
-      micro.diag_chem(id_int)
-      state[id_str.replace('_g', '_a')] = np.frombuffer(micro.outbuf())[0]
+    auto["n"] += 1
+    if auto["n"] >= auto["m"]:
+      # error estimate from the relative change of dissolved S(IV)
+      # (timesteps skipped by chem_gate are not made up for and do not change m)
+      S4_old = state["SO2_a"]
+      n, auto["n"] = auto["n"], 0
+      if _micro_step(micro, state, info, opts, it, None, dt=n*dt, cond=False, plan=plan, steps=n):
+        _chem_diag(micro, state, plan)
+        auto["chem_calls"] += 1
+        err = abs(state["SO2_a"] - S4_old) / max(abs(state["SO2_a"]), abs(S4_old), 1e-30) / auto["chem_tol"]
+        if err > 1:
+          auto["m"] = max(auto["m"] // 2, 1)
+        elif err < .25:
+          auto["m"] = min(2 * auto["m"], auto["chem_max"])
+    state["chem_every"] = auto["m"]
+
+def _chem_flush(micro, state, info, opts, it, auto, plan):
+  # chemistry of the timesteps since the last chemistry call of _micro_step_auto
+  # (before output records and checkpoints, and at the end of the run)
+  if not auto or not micro.opts_init.chem_switch or auto["n"] == 0:
+    return
+  n, auto["n"] = auto["n"], 0
+  if _micro_step(micro, state, info, opts, it, None, dt=n*opts["dt"], cond=False, plan=plan, steps=n):
+    _chem_diag(micro, state, plan)
+    auto["chem_calls"] += 1
+
+def _outbuf(micro):
+  # scalar for a single parcel, copy of the per-parcel values for batched runs
+  buf = np.frombuffer(micro.outbuf())
+  return buf[0] if buf.size == 1 else buf.copy()
 
 def _stats(state, info):
-  state["T"] = np.array([common.T(state["th_d"][0], state["rhod"][0])])
-  state["RH"] = state["p"] * state["r_v"] / (state["r_v"] + common.eps) / common.p_vs(state["T"][0])
-  info["RH_max"] = max(info["RH_max"], state["RH"])
+  th_d, r_v, rhod, p = state["th_d"], state["r_v"], state["rhod"], state["p"]
+  if state["T"] is None or state["T"].size != th_d.size:
+    state["T"], state["RH"] = np.empty(th_d.size), np.empty(th_d.size)
+
+  # T and RH updated in place (per cell, as libcloudphxx.common functions take scalars)
+  T, RH = state["T"], state["RH"]
+  for i in range(th_d.size):
+    T[i] = common.T(th_d[i], rhod[i])
+    RH[i] = (p[i] if np.ndim(p) else p) * r_v[i] / (r_v[i] + common.eps) / common.p_vs(T[i])
+  if isinstance(info["RH_max"], np.ndarray):
+    np.maximum(info["RH_max"], RH, out=info["RH_max"])
+  else:
+    info["RH_max"] = np.maximum(info["RH_max"], RH)
+
+def _bin_edges(dct):
+  # left bin edges and bin widths of a spectrum (see out_bin option)
+  if dct["lnli"] == 'log':
+    dlnr = (log(dct["rght"]) - log(dct["left"])) / dct["nbin"]
+    allbins = np.exp(log(dct["left"]) + np.arange(dct["nbin"]+1) * dlnr)
+    return allbins[0:-1], allbins[1:] - allbins[0:-1]
+  elif dct["lnli"] == 'lin':
+    dr = (dct["rght"] - dct["left"]) / dct["nbin"]
+    return dct["left"] + np.arange(dct["nbin"]) * dr, np.full(dct["nbin"], dr)
+  else: raise Exception("lnli should be log or lin")
+
+def _edge_key(r):
+  # bin edges equal up to round-off are treated as the same edge
+  return float("%.10e" % r)
+
+@functools.lru_cache(maxsize=64)
+def _spectra_plan(key):
+  # libcloudph++ diagnostics of the spectra given as json (computed once per set of spectra):
+  # identical ranges are selected once with the moments of all spectra using them, and moments in
+  # ranges made of consecutive bins of a finer spectrum (with the same edges) are sums of their moments
+  spectra = json.loads(key)
+  sels, index, bins, edges, calls = [], {}, {}, {}, 0
+  for dim, dct in spectra.items():
+    if dct["drwt"] not in ['wet', 'dry']: raise Exception("drwt should be wet or dry")
+    left, width = _bin_edges(dct)
+    rght = (left + width).tolist()
+    left = left.tolist()
+    bins[dim] = []
+    for lo, hi in zip(left, rght):
+      sel = (dct["drwt"], _edge_key(lo), _edge_key(hi))
+      if sel not in index:
+        index[sel] = len(sels)
+        sels.append({"drwt" : dct["drwt"], "lo" : lo, "hi" : hi, "moms" : []})
+      bins[dim].append(index[sel])
+      sels[index[sel]]["moms"] += [vm for vm in dct["moms"] if vm not in sels[index[sel]]["moms"]]
+    edges[dim] = dict((_edge_key(r), i) for i, r in enumerate(left + rght[-1:]))
+    calls += dct["nbin"] * (1 + len(dct["moms"]))
+
+  # sums of the moments of finer bins (finer bins first, so that they may be sums themselves)
+  derived = []
+  for s in sorted(range(len(sels)), key=lambda s: sels[s]["hi"] - sels[s]["lo"]):
+    lo, hi = _edge_key(sels[s]["lo"]), _edge_key(sels[s]["hi"])
+    for vm in list(sels[s]["moms"]):
+      for dim, dct in spectra.items():
+        i, j = edges[dim].get(lo), edges[dim].get(hi)
+        if dct["drwt"] != sels[s]["drwt"] or i is None or j is None or j - i < 2:
+          continue
+        src = bins[dim][i:j]
+        if all(vm in sels[b]["moms"] or (b, vm) in [d[:2] for d in derived] for b in src):
+          sels[s]["moms"].remove(vm)
+          derived.append((s, vm, src))
+          break
+
+  direct = [(s, sel) for s, sel in enumerate(sels) if sel["moms"]]
+  calls_plan = sum(1 + len(sel["moms"]) for s, sel in direct)
+  return {"direct" : direct, "derived" : derived, "bins" : bins, "calls" : calls_plan, "calls_saved" : calls - calls_plan}
 
 def _output_bins(fout, t, micro, opts, spectra):
-  for dim, dct in spectra.items():
-    for bin in range(dct["nbin"]):
-      if dct["drwt"] == 'wet':
-        micro.diag_wet_rng(
-          fout.variables[dim+"_r_wet"][bin],
-          fout.variables[dim+"_r_wet"][bin] + fout.variables[dim+"_dr_wet"][bin]
-        )
-      elif dct["drwt"] == 'dry':
-        micro.diag_dry_rng(
-          fout.variables[dim+"_r_dry"][bin],
-          fout.variables[dim+"_r_dry"][bin] + fout.variables[dim+"_dr_dry"][bin]
-        )
-      else: raise Exception("drwt should be wet or dry")
-
-      for vm in dct["moms"]:
-        if type(vm) == int:
-          # calculating moments
-          if dct["drwt"] == 'wet':
-            micro.diag_wet_mom(vm)
-          elif dct["drwt"] == 'dry':
-            micro.diag_dry_mom(vm)
-          else: raise Exception("drwt should be wet or dry")
-          fout.variables[dim+'_m'+str(vm)][int(t), int(bin)] = np.frombuffer(micro.outbuf())
+  # libcloudph++ diagnoses one range at a time (the super-droplet arrays are not available): the ranges
+  # and moments are diagnosed as given by _spectra_plan and all bins of each moment are written at once
+  plan = _spectra_plan(json.dumps(spectra))
+  res = {}
+  for s, sel in plan["direct"]:
+    if sel["drwt"] == 'wet':
+      micro.diag_wet_rng(sel["lo"], sel["hi"])
+    else:
+      micro.diag_dry_rng(sel["lo"], sel["hi"])
+    for vm in sel["moms"]:
+      if type(vm) == int:
+        # calculating moments
+        if sel["drwt"] == 'wet':
+          micro.diag_wet_mom(vm)
         else:
-          # calculate chemistry
-          micro.diag_chem(_Chem_a_id[vm])
-          fout.variables[dim+'_'+vm][int(t), int(bin)] = np.frombuffer(micro.outbuf())
+          micro.diag_dry_mom(vm)
+      else:
+        # calculate chemistry
+        micro.diag_chem(_Chem_a_id[vm])
+      res[(s, vm)] = np.frombuffer(micro.outbuf()).copy()
+  for s, vm, src in plan["derived"]:
+    res[(s, vm)] = np.add.reduce([res[(b, vm)] for b in src])
+
+  for dim, dct in spectra.items():
+    for vm in dct["moms"]:
+      var = fout.variables[dim+'_m'+str(vm) if type(vm) == int else dim+'_'+vm]
+      out = np.empty(var.shape[1:])
+      for bin, s in enumerate(plan["bins"][dim]):
+        out[..., bin] = res[(s, vm)]
+      var[int(t)] = out
 
-def _output_init(micro, opts, spectra):
+def _output_init(micro, opts, spectra, n_parcel=None):
   # file & dimensions
   fout = netcdf.netcdf_file(opts["outfile"], 'w')
   fout.createDimension('t', None)
+
+  # batched runs: one grid cell per parcel
+  # (n_parcel for output of several libcloudph++ instances with nx cells each)
+  cells = ()
+  if micro is not None and micro.opts_init.nx > 0:
+    cells = ('parcel',)
+    fout.createDimension('parcel', micro.opts_init.nx if n_parcel is None else n_parcel)
+
   for name, dct in spectra.items():
     fout.createDimension(name, dct["nbin"])
 
@@ -191,38 +881,43 @@ def _output_init(micro, opts, spectra):
     fout.variables[tmp].unit = "m"
     fout.variables[tmp].description = "bin width"
 
-    if dct["lnli"] == 'log':
-      from math import exp, log
-      dlnr = (log(dct["rght"]) - log(dct["left"])) / dct["nbin"]
-      allbins = np.exp(log(dct["left"]) + np.arange(dct["nbin"]+1) * dlnr)
-      fout.variables[name+'_r_'+dct["drwt"]][:] = allbins[0:-1]
-      fout.variables[name+'_dr_'+dct["drwt"]][:] = allbins[1:] - allbins[0:-1]
-    elif dct["lnli"] == 'lin':
-      dr = (dct["rght"] - dct["left"]) / dct["nbin"]
-      fout.variables[name+'_r_'+dct["drwt"]][:] = dct["left"] + np.arange(dct["nbin"]) * dr
-      fout.variables[name+'_dr_'+dct["drwt"]][:] = dr
-    else: raise Exception("lnli should be log or lin")
+    fout.variables[name+'_r_'+dct["drwt"]][:], fout.variables[name+'_dr_'+dct["drwt"]][:] = _bin_edges(dct)
 
     for vm in dct["moms"]:
       if (vm in _Chem_a_id):
-      	fout.createVariable(name+'_'+vm, 'd', ('t',name))
+      	fout.createVariable(name+'_'+vm, 'd', ('t',)+cells+(name,))
       	fout.variables[name+'_'+vm].unit = 'kg of chem species dissolved in cloud droplets (kg of dry air)^-1'
       else:
         assert(type(vm)==int)
-        fout.createVariable(name+'_m'+str(vm), 'd', ('t',name))
+        fout.createVariable(name+'_m'+str(vm), 'd', ('t',)+cells+(name,))
         fout.variables[name+'_m'+str(vm)].unit = 'm^'+str(vm)+' (kg of dry air)^-1'
 
+  # libcloudph++ diagnostic calls per output record (see _spectra_plan)
+  if spectra:
+    plan = _spectra_plan(json.dumps(spectra))
+    fout.spectra_diag_calls = plan["calls"]
+    fout.spectra_diag_calls_saved = plan["calls_saved"]
+
   units = {"z"  : "m",     "t"   : "s",     "r_v"  : "kg/kg", "th_d" : "K", "rhod" : "kg/m3",
            "p"  : "Pa",    "T"   : "K",     "RH"   : "1"
   }
 
-  if micro.opts_init.chem_switch:
+  if micro is None:
+    # bulk scheme (see scheme option)
+    units.update({"rc" : "kg/kg", "nc" : "1/kg", "rr" : "kg/kg", "nr" : "1/kg"})
+
+  elif micro.opts_init.chem_switch:
     for id_str in _Chem_g_id.keys():
       units[id_str] = "gas mixing ratio [kg / kg dry air]"
       units[id_str.replace('_g', '_a')] = "kg of chem species (both undissociated and ions) dissolved in cloud droplets (kg of dry air)^-1"
 
+  if micro is not None and json.loads(opts["sstp_auto"]):
+    units["cond_substeps"] = "number of condensation substeps in the last timestep"
+    if micro.opts_init.chem_switch:
+      units["chem_every"] = "number of timesteps between chemistry steps"
+
   for var_name, unit in units.items():
-    fout.createVariable(var_name, 'd', ('t',))
+    fout.createVariable(var_name, 'd', ('t',) + (cells if var_name != "t" else ()))
     fout.variables[var_name].unit = unit
 
   return fout
@@ -231,11 +926,159 @@ def _output_save(fout, state, rec):
   for var, val in state.items():
     fout.variables[var][int(rec)] = val
 
+def _n_act(micro):
+  # concentration of activated droplets (r_wet >= r_crit)
+  micro.diag_rw_ge_rc()
+  micro.diag_wet_mom(0)
+  return np.frombuffer(micro.outbuf())[0]
+
+def _lwc(micro):
+  # liquid water mixing ratio of activated droplets [kg/kg]
+  micro.diag_rw_ge_rc()
+  micro.diag_wet_mom(3)
+  return 4./3 * np.pi * common.rho_w * _outbuf(micro)
+
+def _stop_check(micro, state, info, stop, track, outstep, wait=False, n_act=None):
+  # returns the name of the first stop criterion that is met (or None)
+  # track keeps values from previous calls (time of RH_max, activated concentration, r_v)
+  # (n_act - activated droplet concentration if already known in this step)
+  if not stop:
+    return None
+  if state["RH"][0] == info["RH_max"]:
+    track["t_RH_max"] = state["t"]
+  past_RH_max = info["RH_max"] > 1 and state["RH"][0] < info["RH_max"]
+
+  if wait:
+    r_v_old, track["r_v"] = track.get("r_v"), state["r_v"][0]
+    if "wait_tol" in stop and r_v_old is not None and abs(state["r_v"][0] - r_v_old) <= stop["wait_tol"] * r_v_old:
+      return "wait_tol"
+    return None
+
+  if "z" in stop and state["z"] >= stop["z"] * (1 - 1e-9): # (z accumulated in floating point)
+    return "z"
+  if "t_after_RH_max" in stop and past_RH_max and state["t"] - track["t_RH_max"] >= stop["t_after_RH_max"]:
+    return "t_after_RH_max"
+  if "LWC" in stop and _lwc(micro) >= stop["LWC"]:
+    return "LWC"
+  if "N_tol" in stop and outstep:
+    # steady state of activated droplet concentration checked at output steps only
+    n_old, track["N_act"] = track.get("N_act"), _n_act(micro) if n_act is None else n_act
+    if past_RH_max and n_old is not None and abs(track["N_act"] - n_old) <= stop["N_tol"] * track["N_act"]:
+      return "N_tol"
+  return None
+
+def _stop_save(fout, opts, micro, state, spectra, info, criterion, rec, outstep, plan=None):
+  # saving the state at stop (if not saved already) and the stop criterion
+  if not outstep:
+    _output(fout, opts, micro, state, rec, spectra, plan)
+  info["stop_criterion"] = criterion
+  info["stop_t"] = state["t"]
+
+def _timestepping_adaptive(micro, state, info, opts, adapt, nt, fout, spectra, th_0, r_0, stop, track):
+  # timestepping with dt chosen from the change of RH and of the activated droplet
+  # concentration in the previous step; steps are shortened to hit the output times
+  dt, w, outfreq = opts["dt"], opts["w"], opts["outfreq"]
+  t_end = nt * dt
+  t_out = outfreq * dt
+  dt_cur = min(max(dt, adapt["dt_min"]), adapt["dt_max"])
+  # activated droplet concentration only if its change limits the timestep (N_tol = 0 switches it off)
+  n_act = _n_act(micro) if adapt["N_tol"] > 0 else 0.
+  rec, it = 0, 0
+  plan = _step_plan(micro, state, opts)
+  # pressure profile evaluated at the height reached in each step (heights are not known in advance)
+  prof = pprofs[opts["pprof"]](state["z"], opts["p_0"], th_0, r_0)
+  info["dt_adapt_min"], info["dt_adapt_max"] = adapt["dt_max"], 0.
+  while state["t"] < t_end:
+    # the step before an output (or the end of ascent) is adjusted to hit it exactly
+    t_next = min((rec + 1) * t_out, t_end)
+    hit = t_next - state["t"] <= dt_cur * (1 + 1e-6)
+    dt_step = t_next - state["t"] if hit else dt_cur
+    RH_old, n_act_old = state["RH"][0], n_act
+    it += 1
+
+    # diagnostics (analytic solution as in the fixed-timestep case)
+    state["t"] = t_next if hit else state["t"] + dt_step
+    state["z"] = w * state["t"]
+    prof.levels(state["z"])
+    state["p"], state["rhod"][0] = prof((), w*dt_step,
+      state["p"], state["th_d"][0], state["r_v"][0], state["rhod"][0]
+    )
+
+    # microphysics
+    _micro_step(micro, state, info, opts, it, fout, dt=dt_step, plan=plan)
+    if adapt["N_tol"] > 0:
+      n_act = _n_act(micro)
+    info["dt_adapt_min"] = min(info["dt_adapt_min"], dt_step)
+    info["dt_adapt_max"] = max(info["dt_adapt_max"], dt_step)
+
+    # error estimate and the next timestep
+    # (change of RH relative to the distance from saturation, limited close to RH=1)
+    err = max(
+      abs(state["RH"][0] - RH_old) / adapt["RH_tol"] / max(abs(RH_old - 1), 1e-3),
+      abs(n_act - n_act_old) / max(n_act, n_act_old, 1.) / adapt["N_tol"] if adapt["N_tol"] > 0 else 0.
+    )
+    if not hit or err > 1:
+      dt_cur = dt_step * min(2., max(.5, .9 / err)) if err > 0 else 2 * dt_step
+      dt_cur = min(max(dt_cur, adapt["dt_min"]), adapt["dt_max"])
+
+    # output at fixed times
+    outstep = hit and t_next == (rec + 1) * t_out
+    if outstep:
+      rec += 1
+      print(str(round(state["t"] / t_end * 100, 2)) + " %")
+      _output(fout, opts, micro, state, rec, spectra, plan)
+
+    # stop criteria
+    criterion = _stop_check(micro, state, info, stop, track, outstep, n_act=(n_act if adapt["N_tol"] > 0 else None))
+    if criterion is not None:
+      _stop_save(fout, opts, micro, state, spectra, info, criterion, rec + 1, outstep, plan)
+      break
+
+  info["dt_adapt_steps"] = it
+
+def _checkpoint_save(fout, opts, state, info, track, it, flushes):
+  # the output written so far has to be on disk before the checkpoint
+  # (flushes - timesteps other than the output records with the pending chemistry applied, see sstp_auto option,
+  # of this run and of the runs it was restarted from, to be replayed in the same way)
+  fout.flush()
+  tmp = opts["checkpoint_file"] + ".tmp"
+  with open(tmp, "wb") as f:
+    pickle.dump({"opts" : opts, "state" : state, "info" : info, "track" : track,
+                 "it" : it, "rec" : it // opts["outfreq"], "flushes" : flushes}, f)
+  os.replace(tmp, opts["checkpoint_file"])
+
+def _checkpoint_load(opts):
+  # checkpoint of a run with the same trajectory (checked before the initialisation, as the replay
+  # up to the checkpoint would diverge from the saved output otherwise)
+  with open(opts["checkpoint_file"], "rb") as f:
+    ckpt = pickle.load(f)
+  for k in set(ckpt["opts"]) | set(opts):
+    if k not in _restart_opts and opts.get(k) != ckpt["opts"].get(k):
+      raise Exception("option >>" + k + "<< differs from the one of the checkpointed run")
+  if ckpt["info"]["libcloud_Git_revision"] != libcloud_version:
+    raise Exception("checkpoint was saved with another libcloudph++ revision, the replay would not be the same")
+  if ckpt["it"] > int(opts["z_max"] / (opts["w"] * opts["dt"])):
+    raise Exception("checkpoint is above z_max")
+  ckpt["flushes"] = set(ckpt["flushes"])
+  return ckpt
+
+def _checkpoint_restore(ckpt, state, info, track):
+  # libcloudph++ does not allow setting the super-droplet state, it is recovered by replaying
+  # the steps before the checkpoint (deterministic for a given rng seed) and verified against the checkpoint
+  for var in ["th_d", "r_v", "rhod"] + [k for k in ckpt["state"] if k in _Chem_g_id or k.replace("_a", "_g") in _Chem_g_id]:
+    if not np.allclose(state[var], ckpt["state"][var], atol=0, rtol=1e-10):
+      raise Exception("replay up to the checkpoint diverged (" + var + "), cannot restart")
+  state.update(ckpt["state"])
+  info.update(ckpt["info"])
+  track.update(ckpt["track"])
+
 def _save_attrs(fout, dictnr):
   for var, val in dictnr.items():
     setattr(fout, var, val)
 
-def _output(fout, opts, micro, state, rec, spectra):
+def _output(fout, opts, micro, state, rec, spectra, plan=None):
+  if plan is not None:
+    _chem_diag(micro, state, plan)
   _output_bins(fout, rec, micro, opts, spectra)
   _output_save(fout, state, rec)
 
@@ -247,6 +1090,165 @@ def _p_hydro_const_th_rv(z_lev, p_0, th_std, r_v, z_0=0.):
   # hydrostatic pressure assuming constatnt theta and r_v
   return common.p_hydro(z_lev, th_std, r_v, z_0, p_0)
 
+def _cellwise(fun, *args):
+  # libcloudphxx.common function (taking numbers) applied to numbers, or cell by cell if any of args is an array
+  if any(isinstance(arg, np.ndarray) for arg in args):
+    return np.vectorize(fun, otypes=[float])(*args)
+  return fun(*args)
+
+class pprof_const_th_rv(object):
+  # as in icicle model
+  def __init__(self, z, p_0, th_0, r_0):
+    self.p_0, self.th_0, self.r_0 = p_0, th_0, r_0
+    self.levels(z)
+
+  def levels(self, z):
+    # hydrostatic pressure and dry air density at all heights z (with p_0, th_0, r_0 broadcast against z)
+    p_hydro = _cellwise(_p_hydro_const_th_rv, z, self.p_0, self.th_0, self.r_0)
+    self.rhod = np.asarray(_cellwise(common.rhod, p_hydro, self.th_0, self.r_0))
+
+  def __call__(self, it, dz, p, th_d, r_v, rhod):
+    rhod = self.rhod[it]
+    return _cellwise(common.p, rhod, r_v, _cellwise(common.T, th_d, rhod)), rhod
+
+class pprof_const_rhod(object):
+  # as in Grabowski and Wang 2009
+  rho = 1.13 # kg/m3  1.13
+
+  def __init__(self, z, p_0, th_0, r_0):
+    self.p_0 = p_0
+    self.levels(z)
+
+  def levels(self, z):
+    # hydrostatic pressure at all heights z
+    self.p = np.asarray(_p_hydro_const_rho(z, self.p_0, self.rho))
+
+  def __call__(self, it, dz, p, th_d, r_v, rhod):
+    p = self.p[it]
+    return p, _cellwise(common.rhod, p, _cellwise(common.th_dry2std, th_d, r_v), r_v)
+
+class pprof_piecewise_const_rhod(object):
+  # as in Grabowski and Wang 2009 but calculating pressure
+  # for rho piecewise constant per each time step (nothing to precompute)
+  def __init__(self, z, p_0, th_0, r_0):
+    pass
+
+  def levels(self, z):
+    pass
+
+  def __call__(self, it, dz, p, th_d, r_v, rhod):
+    p = _p_hydro_const_rho(dz, p, rhod)
+    return p, _cellwise(common.rhod, p, _cellwise(common.th_dry2std, th_d, r_v), r_v)
+
+# pressure profiles available as the pprof option: classes constructed with the heights
+# of all timesteps (and p_0, th_0, r_0) returning p and rhod for a given timestep index
+# (for the heights of many parcels, of all parcels or of the ones indexed by it with arrays
+# of their dz, p, th_d, r_v and rhod); levels(z) replaces the heights of the profile
+# (e.g. with a single height not known in advance, then indexed by it = ())
+pprofs = {
+  "pprof_const_th_rv"          : pprof_const_th_rv,
+  "pprof_const_rhod"           : pprof_const_rhod,
+  "pprof_piecewise_const_rhod" : pprof_piecewise_const_rhod
+}
+
+def _heights(nt, w, dt):
+  # heights after each of nt timesteps accumulated as in the timestepping loop
+  # (for an array of w the parcels are kept at their height after nt timesteps if nt is an array too)
+  dz = np.full((np.max(nt),) + np.shape(w), w * dt)
+  if np.ndim(nt) > 0:
+    dz[np.arange(1, np.max(nt) + 1)[:, None] > nt] = 0.
+  return np.concatenate([np.zeros((1,) + np.shape(w)), np.cumsum(dz, axis=0)])
+
+def _blk_2m_init(aerosol):
+  # bulk scheme options (lognormal modes of all aerosol types, kappa is not used)
+  blkopts = blk_2m.opts_t()
+  blkopts.acti = True
+  blkopts.cond = True
+  blkopts.acnv = True
+  blkopts.accr = True
+  blkopts.sedi = False
+  blkopts.dry_distros = [
+    {"mean_rd" : dct["mean_r"][i], "sdev_rd" : dct["gstdev"][i], "N_stp" : dct["n_tot"][i], "chem_b" : _blk_2m_chem_b}
+    for dct in aerosol.values() for i in range(len(dct["mean_r"]))
+  ]
+  return blkopts
+
+def _blk_2m_run(aerosol, opts, state, info, nt, th_0, r_0):
+  # the ascent (and the wait phase) with the two-moment bulk scheme
+  dt, w, outfreq = opts["dt"], opts["w"], opts["outfreq"]
+  blkopts = _blk_2m_init(aerosol)
+  for key in ["rc", "nc", "rr", "nr"]:
+    state[key] = np.zeros(1)
+  dot = dict((key, np.zeros(1)) for key in ["th_d", "r_v", "rc", "nc", "rr", "nr"])
+  _stats(state, info)
+  if (np.any(state["RH"] > 1)): raise Exception("Please supply initial T,p,r_v below supersaturation")
+
+  z = _heights(nt, w, dt)
+  forcing = {"z" : z, "prof" : pprofs[opts["pprof"]](z, opts["p_0"], th_0, r_0)}
+  # attributes saved at the end of the ascent (also with no timesteps of the ascent), as in parcel()
+  info_asc = dict(info, RH_max=np.copy(info["RH_max"]))
+  with _output_init(None, opts, {}) as fout:
+    _output_save(fout, state, 0)
+    for it in range(1, nt + max(opts["wait"], 1)):
+      if it <= nt:
+        _forcing(state, forcing, opts, it)
+      else:
+        state["t"] = it * dt
+
+      # tendencies from the bulk scheme integrated with forward Euler
+      for val in dot.values():
+        val[:] = 0
+      blk_2m.rhs_cellwise(blkopts, dot["th_d"], dot["r_v"], dot["rc"], dot["nc"], dot["rr"], dot["nr"],
+        state["rhod"], state["th_d"], state["r_v"], state["rc"], state["nc"], state["rr"], state["nr"], dt
+      )
+      for key, val in dot.items():
+        state[key] += dt * val
+      _stats(state, info)
+
+      if (it % outfreq == 0):
+        if it <= nt:
+          print(str(round(it / (nt * 1.) * 100, 2)) + " %")
+        _output_save(fout, state, it / outfreq)
+      if it == nt:
+        info_asc = dict(info, RH_max=np.copy(info["RH_max"]))
+
+    _save_attrs(fout, info_asc)
+    _save_attrs(fout, opts)
+
+def _default_opts():
+  # default parcel() options
+  name, _, _, dflt = inspect.getfullargspec(parcel)[0:4]
+  return dict(list(zip(name[-len(dflt):], dflt)))
+
+def _r_0(opts):
+  # initial water vapour mixing ratio from either r_0 or RH_0
+  # (RH_0, T_0 and p_0 may be arrays with the values of many parcels, see parcel_traj.py)
+  if (np.all(opts["r_0"] < 0) and np.all(opts["RH_0"] < 0)):
+    print("both r_0 and RH_0 negative, using default r_0 = 0.022")
+    return .022
+  # water coontent specified with RH
+  if (np.all(opts["r_0"] < 0) and np.all(opts["RH_0"] >= 0)):
+    p_vs = _cellwise(common.p_vs, opts["T_0"])
+    return common.eps * opts["RH_0"] * p_vs / (opts["p_0"] - opts["RH_0"] * p_vs)
+  return opts["r_0"]
+
+def _state_init(opts, n=0):
+  # initial state of one parcel (n=0) or of n parcels (see parcel_batch.py) and the initial potential temperature,
+  # T_0, p_0, r_0 (water vapour mixing ratio) and the gas mixing ratios in opts are numbers or arrays with n values
+  T_0, p_0, r_0 = [np.zeros(max(n, 1)) + opts[k] for k in ["T_0", "p_0", "r_0"]]
+  th_0 = T_0 * (common.p_1000 / p_0)**(common.R_d / common.c_pd)
+  state = {
+    "t" : 0, "z" : np.zeros(n) if n > 0 else 0,
+    "r_v" : r_0, "p" : p_0 if n > 0 else opts["p_0"],
+    "th_d" : np.array([common.th_std2dry(th, r) for th, r in zip(th_0, r_0)]),
+    "rhod" : np.array([common.rhod(p, th, r) for p, th, r in zip(p_0, th_0, r_0)]),
+    "T" : None, "RH" : None
+  }
+  if opts["chem_dsl"] or opts["chem_dsc"] or opts["chem_rct"]:
+    for key in _Chem_g_id.keys():
+      state.update({ key : np.zeros(max(n, 1)) + opts[key]})
+  return state, th_0 if n > 0 else th_0[0]
+
 def parcel(dt=.1, z_max=200., w=1., T_0=300., p_0=101300.,
   r_0=-1., RH_0=-1., #if none specified, the default will be r_0=.022,
   outfile="test.nc",
@@ -260,7 +1262,20 @@ def parcel(dt=.1, z_max=200., w=1., T_0=300., p_0=101300.,
   sstp_cond = 1,
   sstp_chem = 1,
   wait = 0,
-  large_tail = False
+  large_tail = False,
+  backend = "serial",
+  dt_adapt = '{}',
+  stop = '{}',
+  checkpoint = 0,
+  checkpoint_file = "checkpoint.pkl",
+  restart = False,
+  ff_RH = 0.,
+  sstp_auto = '{}',
+  chem_gate = '{}',
+  scheme = "lgrngn",
+  sd_alloc = '{}',
+  sd_adapt = '{}',
+  init_cache = '{}'
 ):
   """
   Args:
@@ -276,6 +1291,7 @@ def parcel(dt=.1, z_max=200., w=1., T_0=300., p_0=101300.,
     pprof   (Optional[string]):   method to calculate pressure profile used to calculate
                                   dry air density that is used by the super-droplet scheme
                                   valid options are: pprof_const_th_rv, pprof_const_rhod, pprof_piecewise_const_rhod
+                                  (or any other profile added to the pprofs dict)
     wait (Optional[float]):       number of timesteps to run parcel model with vertical velocity=0 at the end of simulation
                                   (added for testing)
     sd_conc (Optional[int]):      number of moving bins (super-droplets)
@@ -291,7 +1307,176 @@ def parcel(dt=.1, z_max=200., w=1., T_0=300., p_0=101300.,
                                         n_tot  - lognormal distribution total concentration under standard
                                                  conditions (T=20C, p=1013.25 hPa, rv=0) [m^-3]            (list if multimodal distribution)
 
+                                  or tabulated (e.g. measured) distributions read from CSV or NetCDF files, e.g.:
+
+                                  {"ammonium_sulfate": {"kappa": 0.61, "file": "smps.nc", "dist": "flight_12"}}
+
+                                  where file   - CSV file (.csv) with the radii [m] in the first column and dN/dlnr under
+                                                 standard conditions [m^-3] of each distribution in the other columns
+                                                 (names in the header), or NetCDF file with dN/dlnr variables with
+                                                 the radii as their coordinate variable
+                                        dist   - name of the column or variable
+                                  the monotone (PCHIP) interpolant of dN/dlnr in ln(r) is tabulated once and each file
+                                  is parsed once per process, so that many distributions can be taken from one file
+                                  (zero outside the tabulated radii, not available with the blk_2m scheme); the SDs of all
+                                  aerosol types are then placed by parcel as with sd_alloc (midpoint placement without
+                                  weights if sd_alloc is not given), except with large_tail (libcloudph++ samples the
+                                  table, calling its interpolation in Python for each sample)
+
     large_tail (Optional[bool]) : use more SD to better represent the large tail of the initial aerosol distribution
+                                  (space for the tail SDs is estimated from the aerosol spectrum and sd_conc and
+                                  increased if needed; n_sd_max and the number of SDs used, sd_peak, are saved as attributes)
+
+    backend (Optional[string]):   libcloudph++ backend used for the super-droplet scheme
+                                  valid options are: serial, multicore (OpenMP), auto
+                                  (auto chooses multicore for large number of super-droplets if more than one core is available)
+                                  the backend used and the number of threads are saved as backend_used and backend_threads attributes
+
+    dt_adapt (Optional[json str]): adaptive timestepping settings, e.g.:
+
+                                  {"dt_min": 1e-3, "dt_max": 1, "RH_tol": 1e-2, "N_tol": 1e-2}
+
+                                  where dt_min, dt_max - range of allowed timesteps [s]
+                                        RH_tol         - allowed change of RH in one timestep relative to |RH - 1| (but not less than 1e-3)
+                                        N_tol          - allowed relative change of activated droplet concentration in one timestep
+                                                         (0 - not checked, saves two libcloudph++ diagnostics per timestep)
+                                  (missing keys take the values above, an empty dict switches adaptive timestepping off)
+                                  dt and outfreq still define the output interval (outfreq * dt seconds) and the wait phase timestep,
+                                  the number of timesteps and the range of timesteps used are saved as
+                                  dt_adapt_steps, dt_adapt_min and dt_adapt_max attributes
+
+    stop (Optional[json str]):    criteria for stopping the simulation before z_max (and skipping the wait phase), e.g.:
+
+                                  {"t_after_RH_max": 10, "N_tol": 1e-3, "LWC": 1e-3, "z": 150, "wait_tol": 1e-8}
+
+                                  where t_after_RH_max - time after RH_max (when RH > 1) [s]
+                                        N_tol          - relative change of activated droplet concentration between outputs
+                                                         (after RH_max)
+                                        LWC            - liquid water mixing ratio of activated droplets [kg/kg]
+                                        z              - height [m]
+                                        wait_tol       - relative change of r_v in one timestep in the wait phase
+                                  the simulation stops when any of the given criteria is met, the state at stop is saved
+                                  as the last output record and the criterion and the time are saved as
+                                  stop_criterion and stop_t attributes
+
+    checkpoint (Optional[int]):   checkpoint interval (in number of time steps, 0 switches checkpointing off),
+                                  checkpoint is also saved at the end of the ascent
+                                  (not available with dt_adapt)
+    checkpoint_file (Optional[string]): checkpoint file name
+    restart (Optional[bool]):     continue the run saved in checkpoint_file writing into the same output file
+                                  (all options except z_max, wait, stop and checkpoint options and the libcloudph++
+                                  revision have to be the same as in the checkpointed run, which is checked before
+                                  the initialisation); this is a replay-and-verify mode, not a fast recovery:
+                                  libcloudph++ does not allow setting the super-droplet state, so all timesteps before
+                                  the checkpoint are run again without output (as in the checkpointed run and the runs
+                                  it was restarted from) and the state reached is verified against the checkpoint;
+                                  a restart keeps the output already written, but costs as much computation as
+                                  running from the start without a checkpoint
+
+    ff_RH (Optional[float]):      RH threshold below which the ascent is fast-forwarded analytically (0 switches it off):
+                                  th_d and r_v are kept constant, p and rhod follow pprof and libcloudph++ is not called;
+                                  the super-droplets are re-initialised with wet radii in equilibrium with the current RH
+                                  when RH reaches ff_RH (the spectra in the output records below it are the initial ones;
+                                  if RH crosses saturation within that timestep, they are re-initialised at the last
+                                  timestep below ff_RH and the timestep is done with libcloudph++)
+                                  the number of fast-forwarded timesteps and the time of resuming are saved as
+                                  ff_steps and ff_t attributes (not available with chemistry and dt_adapt)
+
+    sstp_auto (Optional[json str]): automatic choice of condensation substeps and chemistry cadence, e.g.:
+
+                                  {"cond_max": 16, "RH_tol": 1e-5, "chem_max": 16, "chem_tol": 1e-2}
+
+                                  where cond_max - maximal number of condensation substeps (libcloudph++ calls with dt/k,
+                                                   each with sstp_cond substeps), k is doubled/halved when the change
+                                                   of the RH tendency between timesteps is above RH_tol/below RH_tol/4
+                                        chem_max - maximal number of timesteps between chemistry calls (with m*dt,
+                                                   each with sstp_chem substeps), m is halved/doubled when the relative
+                                                   change of dissolved S(IV) in one chemistry call is above chem_tol/below chem_tol/4
+                                                   (chemistry of the timesteps since the last call is applied before each
+                                                   output record and checkpoint and at the end of the run)
+                                  (missing keys take the values above, an empty dict switches it off)
+                                  the numbers chosen are saved as cond_substeps and chem_every variables and the
+                                  total numbers of calls as cond_calls and chem_calls attributes (not available with dt_adapt)
+
+    chem_gate (Optional[json str]): thresholds for switching chemistry (chem_dsl, chem_dsc, chem_rct) on, e.g.:
+
+                                  {"RH": 0.99, "LWC": 1e-6, "every": 10}
+
+                                  where RH    - relative humidity
+                                        LWC   - liquid water mixing ratio of activated droplets [kg/kg]
+                                        every - number of timesteps between the checks of LWC (default 10)
+                                  chemistry is skipped until any of the given thresholds is reached and then stays on
+                                  (an empty dict runs chemistry in all timesteps)
+                                  the number of timesteps without chemistry (with sstp_auto the gate is checked only
+                                  in the chemistry calls, each covering several timesteps), the time when it was switched on (-1 if never)
+                                  and the estimated wall time saved [s] are saved as chem_gate_steps, chem_gate_t
+                                  and chem_gate_time_saved attributes
+
+    scheme (Optional[string]):    microphysics scheme: lgrngn (super-droplets) or blk_2m (two-moment bulk scheme
+                                  for cheap screening, with the aerosol modes of all aerosol types and the same
+                                  chemical composition parameter for all of them, kappa is not used); with blk_2m
+                                  the output has only the state variables and the cloud and rain water mixing ratios
+                                  and concentrations (rc, nc, rr, nr): spectra and their moments (out_bin option) and
+                                  chemistry are not available, nor are the other options specific to super-droplets
+                                  (large_tail, backend, dt_adapt, stop, checkpoint, restart, ff_RH, sstp_auto, chem_gate,
+                                  sd_alloc, sd_adapt, init_cache)
+
+    sd_alloc (Optional[json str]): importance-weighted placement of the sd_conc SDs of each aerosol type, e.g.:
+
+                                  {"modes": {"ammonium_sulfate": [1, 2]}, "act": 1, "S_act": 0.003, "tail": 0.5}
+
+                                  where modes - weights of the aerosol modes (1 for modes not given)
+                                        act   - weight of the radii around the dry radius activating at S_act
+                                                supersaturation (default 0)
+                                        S_act - supersaturation defining the activation radius (default 0.003)
+                                        tail  - weight of the large tail of the spectrum, from two geometric standard
+                                                deviations above the largest mode up to the largest radius with
+                                                at least one particle in 1 m^3 per unit ln(r) (default 0)
+                                        sampling - midpoint (default), stratified or quasi (see below)
+                                        seed  - seed of the random numbers used in sampling and in libcloudph++
+                                                (default: the default seed of libcloudph++)
+                                  sd_conc equal-probability bins of the weighted sum of the normalised densities are
+                                  used: with midpoint, each SD gets the aerosol concentration of its bin and the radius
+                                  of the mean dry mass in the bin (number and dry mass of each bin are preserved); with
+                                  stratified (one random radius in each bin) and quasi (randomly shifted van der Corput
+                                  sequence), SDs get the importance sampling weights
+                                  (passed to libcloudph++ as dry_sizes; an empty dict or a dict with the seed only uses
+                                  the default placement of libcloudph++, not available with large_tail; the parcels of
+                                  parcel_batch() share the placement, with the activation radii at all their T_0)
+
+    sd_adapt (Optional[json str]): re-allocation of the SDs within an SD budget before activation, e.g.:
+
+                                  {"RH": 0.99, "sd_conc": 256, "act": 1, "tail": 0.5}
+
+                                  where RH      - relative humidity (below 1) at which the SDs are re-allocated
+                                                  (default 0.99)
+                                        sd_conc - number of SDs of each aerosol type after the re-allocation
+                                                  (default: sd_conc)
+                                        other keys as in sd_alloc (act weight 1 if no weights are given)
+                                  the run starts with sd_conc SDs (placed as given by sd_alloc) and, when RH is reached,
+                                  the SDs are re-initialised once with the ones placed as given by sd_adapt, e.g. fewer SDs
+                                  for the haze and more around the activation radius (this is not a merge/split of SDs
+                                  during the run: the dry spectrum is conserved and the wet radii of the new SDs are
+                                  in equilibrium with RH); the difference of the liquid water of the haze before and
+                                  after is taken from the water vapour (with the latent heat added to th_d), so that
+                                  the total water is conserved; the time of the re-allocation, the number of SDs
+                                  after it and the liquid water mixing ratios before and after [kg/kg] are saved
+                                  as sd_adapt_t, sd_adapt_n_sd, sd_adapt_water_before and sd_adapt_water_after attributes
+                                  (not available with chemistry, dt_adapt, ff_RH, checkpoint, restart and large_tail)
+
+    init_cache (Optional[json str]): cache of the SD placements computed for sd_alloc (and sd_adapt), e.g.:
+
+                                  {"dir": "init_cache", "max_mb": 64}
+
+                                  where dir    - directory of the cache on disk (default: none, cached in memory only)
+                                        max_mb - size limit of the cache in memory and of the one on disk [MB]
+                                                 (least recently used placements are removed first, default 64)
+                                  placements are looked up by a hash of aerosol (and the modification times of its
+                                  files), sd_conc, sd_alloc, T_0 and the libcloudph++ revision (only deterministic ones:
+                                  midpoint sampling or a given seed), the lookup is saved as the init_cache attribute
+                                  (memory, disk or miss); libcloudph++ does not allow reading or setting the state
+                                  of the super-droplets, so the initialisation in libcloudph++ (including the
+                                  equilibration of the wet radii) is still done in each run; an empty dict switches it off
 
     out_bin (Optional[json str]): dict of dicts defining spectrum diagnostics, e.g.:
 
@@ -312,6 +1497,11 @@ def parcel(dt=.1, z_max=200., w=1., T_0=300., p_0=101300.,
                                     "CO2_a",
                                     "NH3_a", "HNO3_a",
 
+                                  Spectra may overlap: identical bins are diagnosed once and moments of bins made of
+                                  consecutive bins of a finer spectrum are computed as sums over these bins. The number
+                                  of libcloudph++ diagnostic calls per output record and the number of calls saved
+                                  this way are saved as spectra_diag_calls and spectra_diag_calls_saved attributes.
+
     SO2_g    (Optional[float]):   initial SO2  gas mixing ratio [kg / kg dry air]
     O3_g     (Optional[float]):   initial O3   gas mixing ratio [kg / kg dry air]
     H2O2_g   (Optional[float]):   initial H2O2 gas mixing ratio [kg / kg dry air]
@@ -338,37 +1528,59 @@ def parcel(dt=.1, z_max=200., w=1., T_0=300., p_0=101300.,
   # parsing json specification of init aerosol spectra
   aerosol = json.loads(opts["aerosol"])
 
-  # default water content
-  if ((opts["r_0"] < 0) and (opts["RH_0"] < 0)):
-    print("both r_0 and RH_0 negative, using default r_0 = 0.022")
-    r_0 = .022
-  # water coontent specified with RH
-  if ((opts["r_0"] < 0) and (opts["RH_0"] >= 0)):
-    r_0 = common.eps * opts["RH_0"] * common.p_vs(T_0) / (p_0 - opts["RH_0"] * common.p_vs(T_0))
+  # parsing json specification of adaptive timestepping
+  adapt = json.loads(opts["dt_adapt"])
+
+  # parsing json specification of stop criteria
+  stop = json.loads(opts["stop"])
+
+  # parsing json specification of automatic substepping
+  auto = json.loads(opts["sstp_auto"])
+
+  # parsing json specification of re-allocating the SDs
+  resmpl = json.loads(opts["sd_adapt"])
+
+  # initial water content
+  r_0 = _r_0(opts)
 
   # sanity checks for arguments
-  _arguments_checking(opts, spectra, aerosol)
+  _arguments_checking(opts, spectra, aerosol, adapt, stop, auto)
+  if adapt:
+    adapt = dict(_dt_adapt_dflt, **adapt)
+  if auto:
+    auto = dict(_sstp_auto_dflt, k=1, m=1, n=0, dRH=None, cond_calls=0, chem_calls=0, **auto)
+  if resmpl:
+    resmpl = dict(_sd_adapt_dflt, **resmpl)
 
-  th_0 = T_0 * (common.p_1000 / p_0)**(common.R_d / common.c_pd)
   nt = int(z_max / (w * dt))
-  state = {
-    "t" : 0, "z" : 0,
-    "r_v" : np.array([r_0]), "p" : p_0,
-    "th_d" : np.array([common.th_std2dry(th_0, r_0)]),
-    "rhod" : np.array([common.rhod(p_0, th_0, r_0)]),
-    "T" : None, "RH" : None
-  }
+  state, th_0 = _state_init(dict(opts, r_0=r_0))
 
-  if opts["chem_dsl"] or opts["chem_dsc"] or opts["chem_rct"]:
-    for key in _Chem_g_id.keys():
-      state.update({ key : np.array([opts[key]])})
+  # substeps chosen in the last timestep (see sstp_auto option)
+  if auto:
+    state.update({"cond_substeps" : sstp_cond})
+    if opts["chem_dsl"] or opts["chem_dsc"] or opts["chem_rct"]:
+      state.update({"chem_every" : 1})
 
   info = { "RH_max" : 0, "libcloud_Git_revision" : libcloud_version,
            "parcel_Git_revision" : parcel_version }
 
+  # screening with the bulk scheme
+  if scheme == "blk_2m":
+    _blk_2m_run(aerosol, opts, state, info, nt, th_0, r_0)
+    return
+
+  # restart from checkpoint
+  ckpt = _checkpoint_load(opts) if restart else None
+  flushes = sorted(ckpt["flushes"]) if ckpt is not None else []
+
   micro = _micro_init(aerosol, opts, state, info)
 
-  with _output_init(micro, opts, spectra) as fout:
+  if ckpt is None:
+    fout = _output_init(micro, opts, spectra)
+  else:
+    fout = netcdf.netcdf_file(opts["outfile"], 'a')
+
+  with fout:
     # adding chem state vars
     if micro.opts_init.chem_switch:
       state.update({ "SO2_a" : 0.,"O3_a" : 0.,"H2O2_a" : 0.,})
@@ -376,87 +1588,287 @@ def parcel(dt=.1, z_max=200., w=1., T_0=300., p_0=101300.,
 
       micro.diag_all() # selecting all particles
       micro.diag_chem(_Chem_a_id["NH3_a"])
-      state.update({"NH3_a": np.frombuffer(micro.outbuf())[0]})
+      state.update({"NH3_a": _outbuf(micro)})
 
     # t=0 : init & save
-    _output(fout, opts, micro, state, 0, spectra)
+    if ckpt is None:
+      _output(fout, opts, micro, state, 0, spectra)
 
     # timestepping
-    for it in range(1,nt+1):
-      # diagnostics
-      # the reasons to use analytic solution:
-      # - independent of dt
-      # - same as in 2D kinematic model
-      state["z"] += w * dt
-      state["t"] = it * dt
-
-      # pressure
-      if pprof == "pprof_const_th_rv":
-        # as in icicle model
-        p_hydro = _p_hydro_const_th_rv(state["z"], p_0, th_0, r_0)
-      elif pprof == "pprof_const_rhod":
-        # as in Grabowski and Wang 2009
-        rho = 1.13 # kg/m3  1.13
-        state["p"] = _p_hydro_const_rho(state["z"], p_0, rho)
-
-      elif pprof == "pprof_piecewise_const_rhod":
-        # as in Grabowski and Wang 2009 but calculating pressure
-        # for rho piecewise constant per each time step
-        state["p"] = _p_hydro_const_rho(w*dt, state["p"], state["rhod"][0])
-
-      else: raise Exception("pprof should be pprof_const_th_rv, pprof_const_rhod, or pprof_piecewise_const_rhod")
-
-      # dry air density
-      if pprof == "pprof_const_th_rv":
-        state["rhod"][0] = common.rhod(p_hydro, th_0, r_0)
-        state["p"] = common.p(
-          state["rhod"][0],
-          state["r_v"][0],
-          common.T(state["th_d"][0], state["rhod"][0])
-        )
-
-      else:
-        state["rhod"][0] = common.rhod(
-          state["p"],
-          common.th_dry2std(state["th_d"][0], state["r_v"][0]),
-          state["r_v"][0]
-        )
-
-      # microphysics
-      _micro_step(micro, state, info, opts, it, fout)
-
-      # TODO: only if user wants to stop @ RH_max
-      #if (state["RH"] < info["RH_max"]): break
-
-      # output
-      if (it % outfreq == 0):
-        print(str(round(it / (nt * 1.) * 100, 2)) + " %")
-        rec = it/outfreq
-        _output(fout, opts, micro, state, rec, spectra)
-
-    _save_attrs(fout, info)
+    # (it and plan are kept for the chemistry pending at the end of the run, see sstp_auto option)
+    track = {}
+    it, plan = 0, None
+    ff = ff_RH > 0 and state["RH"][0] < ff_RH
+    if ff:
+      info["ff_steps"], info["ff_t"] = 0, 0.
+    if adapt:
+      _timestepping_adaptive(micro, state, info, opts, adapt, nt, fout, spectra, th_0, r_0, stop, track)
+    else:
+      z = _heights(nt, w, dt)
+      forcing = {"z" : z, "prof" : pprofs[pprof](z, p_0, th_0, r_0)}
+      plan = _step_plan(micro, state, opts)
+      while it < nt:
+        # microphysics
+        if not (ff or auto or resmpl or stop):
+          # nothing is checked after each timestep: advancing to the next output record, checkpoint
+          # or the end of the replay before a restart in one call (see _advance)
+          ends = [nt, (it // outfreq + 1) * outfreq]
+          if checkpoint > 0:
+            ends.append((it // checkpoint + 1) * checkpoint)
+          if ckpt is not None and it < ckpt["it"]:
+            ends.append(ckpt["it"])
+          it = _advance(micro, state, info, opts, it, min(ends) - it, forcing, plan)
+        elif ff:
+          last = dict((k, state[k].copy() if isinstance(state[k], np.ndarray) else state[k]) for k in ["t", "z", "p", "rhod"])
+          RH_max = info["RH_max"]
+          it += 1
+          _forcing(state, forcing, opts, it)
+          # analytic fast-forward with constant th_d and r_v while RH < ff_RH
+          _stats(state, info)
+          ff = state["RH"][0] < ff_RH
+          if ff:
+            info["ff_steps"] += 1
+          else:
+            # wet radii in equilibrium with current RH (output records before keep the initial super-droplets);
+            # if RH crossed saturation within this timestep, the SDs are initialised at the previous timestep
+            # (still below saturation) and this one is done with libcloudph++
+            crossed = state["RH"][0] > 1
+            if crossed:
+              state.update(last)
+              info["RH_max"] = RH_max
+              _stats(state, info)
+            info["ff_t"] = state["t"]
+            micro = _micro_init(aerosol, opts, state, info)
+            plan = _step_plan(micro, state, opts)
+            if crossed:
+              _forcing(state, forcing, opts, it)
+              if auto:
+                _micro_step_auto(micro, state, info, opts, it, auto, plan)
+              else:
+                _micro_step(micro, state, info, opts, it, fout, plan=plan)
+        else:
+          it += 1
+          _forcing(state, forcing, opts, it)
+          if auto:
+            _micro_step_auto(micro, state, info, opts, it, auto, plan)
+          else:
+            _micro_step(micro, state, info, opts, it, fout, plan=plan)
+
+        # re-allocating the SDs (once, when RH is reached)
+        if resmpl and state["RH"][0] >= resmpl["RH"]:
+          micro = _sd_adapt(micro, aerosol, opts, state, info, resmpl)
+          plan = _step_plan(micro, state, opts)
+          resmpl = {}
+
+        # replaying the timesteps before the checkpoint
+        # (with chemistry pending in sstp_auto applied at the output records and checkpoints of the checkpointed run)
+        if ckpt is not None and it <= ckpt["it"]:
+          if it % outfreq == 0 or it in ckpt["flushes"]:
+            _chem_flush(micro, state, info, opts, it, auto, plan)
+          if it == ckpt["it"]:
+            _chem_diag(micro, state, plan)
+            _checkpoint_restore(ckpt, state, info, track)
+            plan = _step_plan(micro, state, opts)
+          continue
+
+        # output
+        if (it % outfreq == 0):
+          print(str(round(it / (nt * 1.) * 100, 2)) + " %")
+          rec = it/outfreq
+          _chem_flush(micro, state, info, opts, it, auto, plan)
+          _output(fout, opts, micro, state, rec, spectra, plan)
+
+        # stop criteria
+        criterion = _stop_check(micro, state, info, stop, track, it % outfreq == 0)
+        if criterion is not None:
+          _chem_flush(micro, state, info, opts, it, auto, plan)
+          _stop_save(fout, opts, micro, state, spectra, info, criterion, it // outfreq + 1, it % outfreq == 0, plan)
+          break
+
+        # checkpoint
+        if checkpoint > 0 and (it % checkpoint == 0 or it == nt):
+          _chem_flush(micro, state, info, opts, it, auto, plan)
+          _chem_diag(micro, state, plan)
+          flushes.append(it)
+          _checkpoint_save(fout, opts, state, info, track, it, flushes)
+
+    stopped = "stop_criterion" in info
+    # (chem_gate attributes saved at the end, see _chem_gate_save)
+    _save_attrs(fout, dict((k, v) for k, v in info.items() if k != "_chem_gate_wall"))
     _save_attrs(fout, opts)
 
-    if wait != 0:
+    if wait != 0 and not stopped:
+      plan = _step_plan(micro, state, opts)
       for it in range (nt+1, nt+wait):
         state["t"] = it * dt
-        _micro_step(micro, state, info, opts, it, fout)
+        if auto:
+          _micro_step_auto(micro, state, info, opts, it, auto, plan)
+        else:
+          _micro_step(micro, state, info, opts, it, fout, dt=(dt if adapt else None), plan=plan)
 
         if (it % outfreq == 0):
           rec = it/outfreq
-          _output(fout, opts, micro, state, rec, spectra)
-
-def _arguments_checking(opts, spectra, aerosol):
+          _chem_flush(micro, state, info, opts, it, auto, plan)
+          _output(fout, opts, micro, state, rec, spectra, plan)
+
+        criterion = _stop_check(micro, state, info, stop, track, it % outfreq == 0, wait=True)
+        if criterion is not None:
+          _chem_flush(micro, state, info, opts, it, auto, plan)
+          _stop_save(fout, opts, micro, state, spectra, info, criterion, it // outfreq + 1, it % outfreq == 0, plan)
+          _save_attrs(fout, {"stop_criterion" : criterion, "stop_t" : state["t"]})
+          break
+
+    # numbers of libcloudph++ calls (see sstp_auto option)
+    if auto:
+      _chem_flush(micro, state, info, opts, it, auto, plan)
+      _save_attrs(fout, {"cond_calls" : auto["cond_calls"], "chem_calls" : auto["chem_calls"]})
+
+    _chem_gate_save(fout, info)
+
+    if stop and "stop_criterion" not in info:
+      _save_attrs(fout, {"stop_criterion" : "none", "stop_t" : state["t"]})
+
+def _init_cache_checking(cache):
+  # checking the init_cache option
+  for key, val in cache.items():
+    if key not in _init_cache_dflt:
+      raise Exception("invalid key >>" + key + "<< in init_cache, valid keys are: " + str(list(_init_cache_dflt.keys())))
+    if key == "dir" and type(val) != str:
+      raise Exception(">>dir<< in init_cache must be a string")
+    if key == "max_mb" and (type(val) not in [int, float] or val <= 0):
+      raise Exception(">>max_mb<< in init_cache must be a number larger than 0")
+
+def _sd_alloc_checking(alloc, aerosol, opt):
+  # checking the placement of SDs given in the sd_alloc or sd_adapt option
+  for key, val in alloc.items():
+    if key not in list(_sd_alloc_dflt.keys()) + ["modes"]:
+      raise Exception("invalid key >>" + key + "<< in " + opt + ", valid keys are: " + str(list(_sd_alloc_dflt.keys()) + ["modes"]))
+    if key == "sampling" and val not in _sd_alloc_sampling:
+      raise Exception(">>sampling<< in " + opt + " should be one of: " + str(_sd_alloc_sampling))
+    if key == "seed" and (type(val) != int or val < 0):
+      raise Exception(">>seed<< in " + opt + " must be a non-negative integer number")
+    if key not in ["modes", "sampling", "seed"] and (type(val) not in [int, float] or val < 0 or (key == "S_act" and val == 0)):
+      raise Exception(">>" + key + "<< in " + opt + " must be a " + ("positive" if key == "S_act" else "non-negative") + " number")
+  for name, weights in alloc.get("modes", {}).items():
+    if name not in aerosol or "file" in aerosol[name]:
+      raise Exception("invalid aerosol >>" + name + "<< in " + opt + " (lognormal modes needed)")
+    if type(weights) != list or len(weights) != len(aerosol[name]["mean_r"]):
+      raise Exception(opt + " weights of aerosol[" + name + "] should be a list with one weight per mode")
+    if any(type(w) not in [int, float] or w < 0 for w in weights) or not any(w > 0 for w in weights):
+      raise Exception(opt + " weights of aerosol[" + name + "] should be non-negative numbers (not all zero)")
+
+def _aerosol_checking(name, dct, opts):
+  # checking a tabulated aerosol distribution (see aerosol option)
+  keys = ["kappa", "file", "dist"]
+  for key in keys:
+    if key not in dct:
+      raise Exception(">>" + key + "<< is missing in aerosol[" + name + "]")
+  for key in dct:
+    if key not in keys:
+      raise Exception("invalid key >>" + key + "<< in aerosol[" + name + "]")
+  if dct["kappa"] <= 0:
+    raise Exception("kappa hygroscopicity parameter should be larger than 0 for aerosol[" + name + "]")
+  if not os.path.isfile(dct["file"]):
+    raise Exception("file " + str(dct["file"]) + " of aerosol[" + name + "] does not exist")
+  try:
+    r, n = _aerosol_table(dct["file"], dct["dist"])
+  except (KeyError, ValueError):
+    raise Exception("distribution >>" + str(dct["dist"]) + "<< not found in " + dct["file"] + " for aerosol[" + name + "]")
+  if r.size < 2 or np.any(r <= 0) or np.any(np.diff(r) <= 0):
+    raise Exception("radii of aerosol[" + name + "] should be positive and distinct (at least two)")
+  if np.any(n < 0) or not np.any(n > 0):
+    raise Exception("dN/dlnr of aerosol[" + name + "] should be non-negative (not all zero)")
+  if opts["scheme"] != "lgrngn":
+    raise Exception("tabulated aerosol distributions are available only with the lgrngn scheme")
+
+def _arguments_checking(opts, spectra, aerosol, adapt={}, stop={}, auto={}):
   if opts["T_0"] < 273.15:
     raise Exception("temperature should be larger than 0C - microphysics works only for warm clouds")
   elif ((opts["r_0"] >= 0) and (opts["RH_0"] >= 0)):
     raise Exception("both r_0 and RH_0 specified, please use only one")
   if opts["w"] < 0:
     raise Exception("vertical velocity should be larger than 0")
+  if opts["pprof"] not in pprofs:
+    raise Exception("pprof should be pprof_const_th_rv, pprof_const_rhod, or pprof_piecewise_const_rhod")
+  if opts["backend"] not in ["serial", "multicore", "auto"]:
+    raise Exception("backend should be serial, multicore or auto")
+
+  for key in adapt:
+    if key not in _dt_adapt_dflt:
+      raise Exception("invalid key >>" + key + "<< in dt_adapt")
+    if type(adapt[key]) not in [int, float] or adapt[key] < 0 or (adapt[key] == 0 and key != "N_tol"):
+      raise Exception(">>" + key + "<< in dt_adapt must be a number larger than 0" + (" (or 0)" if key == "N_tol" else ""))
+  if adapt.get("dt_min", _dt_adapt_dflt["dt_min"]) > adapt.get("dt_max", _dt_adapt_dflt["dt_max"]):
+    raise Exception(">>dt_min<< is greater than >>dt_max<< in dt_adapt")
+
+  for key in stop:
+    if key not in _stop_keys:
+      raise Exception("invalid key >>" + key + "<< in stop, valid keys are: " + str(_stop_keys))
+    if type(stop[key]) not in [int, float] or stop[key] < 0:
+      raise Exception(">>" + key + "<< in stop must be a non-negative number")
+
+  if opts["checkpoint"] < 0:
+    raise Exception("checkpoint interval should be larger or equal 0")
+  if adapt and (opts["checkpoint"] > 0 or opts["restart"]):
+    raise Exception("checkpoint and restart are not available with dt_adapt")
+
+  for key in auto:
+    if key not in _sstp_auto_dflt:
+      raise Exception("invalid key >>" + key + "<< in sstp_auto")
+    if type(auto[key]) not in [int, float] or auto[key] <= 0:
+      raise Exception(">>" + key + "<< in sstp_auto must be a number larger than 0")
+    if key in ["cond_max", "chem_max"] and type(auto[key]) != int:
+      raise Exception(">>" + key + "<< in sstp_auto must be an integer number")
+  if adapt and auto:
+    raise Exception("sstp_auto is not available with dt_adapt")
+
+  gate = json.loads(opts["chem_gate"])
+  for key, val in gate.items():
+    if key not in _chem_gate_keys:
+      raise Exception("invalid key >>" + key + "<< in chem_gate, valid keys are: " + str(_chem_gate_keys))
+    if type(val) not in [int, float] or val < 0:
+      raise Exception(">>" + key + "<< in chem_gate must be a non-negative number")
+    if key == "every" and (type(val) != int or val == 0):
+      raise Exception(">>every<< in chem_gate must be an integer number larger than 0")
+  if "every" in gate and "LWC" not in gate:
+    raise Exception(">>every<< in chem_gate requires the LWC threshold")
+
+  alloc = json.loads(opts["sd_alloc"])
+  _sd_alloc_checking(alloc, aerosol, "sd_alloc")
+  _init_cache_checking(json.loads(opts["init_cache"]))
+  if set(alloc) - set(["seed"]) and opts["large_tail"]:
+    raise Exception("sd_alloc is not available with large_tail (see the tail key of sd_alloc)")
+
+  resmpl = json.loads(opts["sd_adapt"])
+  for key, val in resmpl.items():
+    if key == "RH" and (type(val) not in [int, float] or val <= 0 or val >= 1):
+      raise Exception(">>RH<< in sd_adapt should be in the range (0, 1)")
+    if key == "sd_conc" and (type(val) != int or val <= 0):
+      raise Exception(">>sd_conc<< in sd_adapt must be an integer number larger than 0")
+  _sd_alloc_checking(dict((k, v) for k, v in resmpl.items() if k not in _sd_adapt_dflt), aerosol, "sd_adapt")
+  if resmpl and (adapt or opts["ff_RH"] > 0 or opts["checkpoint"] > 0 or opts["restart"] or opts["large_tail"]
+    or opts["chem_dsl"] or opts["chem_dsc"] or opts["chem_rct"]):
+    raise Exception("sd_adapt is not available with chemistry, dt_adapt, ff_RH, checkpoint, restart and large_tail")
+
+  if opts["ff_RH"] < 0 or opts["ff_RH"] >= 1:
+    raise Exception("ff_RH should be in the range [0, 1)")
+  if opts["ff_RH"] > 0 and (adapt or opts["chem_dsl"] or opts["chem_dsc"] or opts["chem_rct"]):
+    raise Exception("ff_RH is not available with chemistry and dt_adapt")
+
+  if opts["scheme"] not in ["lgrngn", "blk_2m"]:
+    raise Exception("scheme should be lgrngn or blk_2m")
+  if opts["scheme"] != "lgrngn":
+    dflt = _default_opts()
+    for key in _lgrngn_opts:
+      if key in opts and opts[key] != dflt[key]:
+        raise Exception(">>" + key + "<< option is available only with the lgrngn scheme")
 
   for name, dct in aerosol.items():
     # TODO: check if name is valid netCDF identifier
     # (http://www.unidata.ucar.edu/software/thredds/current/netcdf-java/CDM/Identifiers.html)
+    if "file" in dct:
+      _aerosol_checking(name, dct, opts)
+      continue
     keys = ["kappa", "mean_r", "n_tot", "gstdev"]
     for key in keys:
       if key not in dct:
@@ -520,8 +1932,7 @@ def _arguments_checking(opts, spectra, aerosol):
 if __name__ == '__main__':
 
   # getting list of argument names and their default values
-  name, _, _, dflt = inspect.getfullargspec(parcel)[0:4]
-  opts = dict(list(zip(name[-len(dflt):], dflt)))
+  opts = _default_opts()
 
   # handling all parcel() arguments as command-line arguments
   prsr = ArgumentParser(add_help=True, description=parcel.__doc__, formatter_class=RawTextHelpFormatter)
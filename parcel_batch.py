@@ -0,0 +1,130 @@
+import json, numpy as np
+
+import parcel as pc
+
+# parcel() options that may differ between the members of a batch
+_member_opts = ["w", "z_max", "T_0", "p_0", "r_0", "RH_0"] + list(pc._Chem_g_id.keys())
+
+# parcel() options not supported in batched runs
+_single_opts = ["dt_adapt", "stop", "checkpoint", "restart", "ff_RH", "sstp_auto", "scheme", "sd_adapt"]
+
+def parcel_batch(members = '[{}]', **kwargs):
+  """
+  Runs several independent parcels as grid cells of one libcloudph++ instance,
+  so that all of them are advanced with one step_sync/step_async call per timestep.
+
+  Args:
+    members (Optional[json str]): list of dicts with options specific to each parcel, e.g.:
+
+                                  [{"w": 0.5, "RH_0": 0.95}, {"w": 1.0, "RH_0": 0.95}, {"w": 2.0, "T_0": 290.}]
+
+                                  valid keys are: w, z_max, T_0, p_0, r_0, RH_0 and the initial gas mixing ratios
+                                  (SO2_g, O3_g, H2O2_g, CO2_g, HNO3_g, NH3_g)
+
+    all other arguments are the same as in parcel() and are common to all parcels
+
+  Parcels share the time axis: a parcel that reached its z_max is kept at constant height
+  (as in the wait phase) until all other parcels reach theirs. All output variables have an
+  additional "parcel" dimension, and the initial conditions of each parcel are saved as
+  variables with the "parcel" dimension only. RH_max is saved as a per-parcel attribute
+  (the maximum during the ascent of each parcel) and, as in parcel(), all attributes are
+  saved at the end of the ascent of all parcels, before the wait phase.
+  """
+  # default parcel() options overwritten by the ones common to all parcels
+  opts = pc._default_opts()
+  for k in kwargs:
+    if k not in opts:
+      raise Exception("invalid parcel_batch() argument >>" + k + "<<")
+  for k in _single_opts:
+    if k in kwargs and kwargs[k] != opts[k]:
+      raise Exception(">>" + k + "<< option is not supported in parcel_batch()")
+  opts.update(kwargs)
+  opts["members"] = members
+
+  spectra = json.loads(opts["out_bin"])
+  aerosol = json.loads(opts["aerosol"])
+
+  # options of each parcel
+  mbrs = []
+  for mbr in json.loads(members):
+    for k in mbr:
+      if k not in _member_opts:
+        raise Exception("invalid key >>" + k + "<< in members, valid keys are: " + str(_member_opts))
+    mbr_opts = dict(opts)
+    mbr_opts.update(mbr)
+    pc._arguments_checking(mbr_opts, spectra, aerosol)
+    mbr_opts["r_0"] = pc._r_0(mbr_opts)
+    mbrs.append(mbr_opts)
+  n = len(mbrs)
+  if n == 0:
+    raise Exception("members should define at least one parcel")
+
+  dt, pprof, outfreq = opts["dt"], opts["pprof"], opts["outfreq"]
+  ini = dict((k, np.array([mbr[k] for mbr in mbrs], dtype=float)) for k in ["w", "z_max", "T_0", "p_0", "r_0"])
+  nt = np.array([int(z_max / (w * dt)) for z_max, w in zip(ini["z_max"], ini["w"])])
+  gas = dict((k, np.array([mbr[k] for mbr in mbrs], dtype=float)) for k in pc._Chem_g_id.keys())
+  state, th_0 = pc._state_init(dict(opts, **dict(ini, **gas)), n)
+
+  info = { "RH_max" : np.zeros(n), "libcloud_Git_revision" : pc.libcloud_version,
+           "parcel_Git_revision" : pc.parcel_version }
+
+  # (SD placement with sd_alloc shared by all parcels, with the activation radii at the T_0 of each of them)
+  micro = pc._micro_init(aerosol, dict(opts, T_0=ini["T_0"]), state, info, nx=n)
+
+  with pc._output_init(micro, opts, spectra) as fout:
+    # initial conditions of each parcel
+    for k, val in ini.items():
+      fout.createVariable(k + "_ini", 'd', ('parcel',))
+      fout.variables[k + "_ini"][:] = val
+
+    # adding chem state vars
+    if micro.opts_init.chem_switch:
+      for id_str in ["SO2_a", "O3_a", "H2O2_a", "CO2_a", "HNO3_a"]:
+        state[id_str] = np.zeros(n)
+
+      micro.diag_all() # selecting all particles
+      micro.diag_chem(pc._Chem_a_id["NH3_a"])
+      state.update({"NH3_a": np.frombuffer(micro.outbuf()).copy()})
+
+    # t=0 : init & save
+    pc._output(fout, opts, micro, state, 0, spectra)
+
+    # timestepping (parcels above their z_max are kept at constant height)
+    nt_max = nt.max()
+    prof = pc.pprofs[pprof](pc._heights(nt, ini["w"], dt), ini["p_0"], th_0, ini["r_0"])
+    plan = pc._step_plan(micro, state, opts)
+    # RH_max of each parcel at the end of its ascent (as in parcel(), without the wait phase)
+    RH_max = info["RH_max"].copy()
+    if nt_max == 0:
+      _save_ascent_attrs(fout, info, opts, RH_max)
+    # (wait - 1 timesteps of the wait phase, as in parcel())
+    for it in range(1, nt_max + max(opts["wait"] - 1, 0) + 1):
+      state["t"] = it * dt
+      asc = it <= nt
+      if asc.any():
+        state["z"][asc] += ini["w"][asc] * dt
+        p, rhod = prof(it, ini["w"] * dt, state["p"], state["th_d"], state["r_v"], state["rhod"])
+        state["p"][asc], state["rhod"][asc] = p[asc], rhod[asc]
+
+      # microphysics of all parcels at once
+      pc._micro_step(micro, state, info, opts, it, fout, plan=plan)
+      RH_max[asc] = info["RH_max"][asc]
+
+      # output
+      if (it % outfreq == 0):
+        print(str(round(it / (nt_max * 1.) * 100, 2)) + " %")
+        rec = it/outfreq
+        pc._output(fout, opts, micro, state, rec, spectra, plan)
+
+      if it == nt_max:
+        _save_ascent_attrs(fout, info, opts, RH_max)
+
+    pc._chem_gate_save(fout, info)
+
+def _save_ascent_attrs(fout, info, opts, RH_max):
+  # attributes saved once all parcels reached their z_max (before the wait phase, as in parcel();
+  # chem_gate attributes are saved at the end, see _chem_gate_save)
+  info = dict(info, RH_max = RH_max)
+  info.pop("_chem_gate_wall", None)
+  pc._save_attrs(fout, info)
+  pc._save_attrs(fout, opts)
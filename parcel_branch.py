@@ -0,0 +1,246 @@
+import copy, json, os, shutil, sys, tempfile, time, traceback
+
+from scipy.io import netcdf
+
+import parcel as pc
+
+# parcel() options that affect the simulation only with chemistry (see _chem_differs)
+_step_opts = ["chem_dsl", "chem_dsc", "chem_rct", "chem_gate"] + list(pc._Chem_g_id.keys())
+
+# parcel() options that affect only the length of the simulation
+_length_opts = ["z_max", "wait"]
+
+# parcel() options not supported by the branching runner
+_single_opts = ["dt_adapt", "stop", "checkpoint", "restart", "ff_RH", "sstp_auto", "scheme", "sd_adapt"]
+
+def _chem_switch(opts):
+  return bool(opts["chem_dsl"] or opts["chem_dsc"] or opts["chem_rct"])
+
+def _group_key(opts):
+  # variants with the same key share the initialisation (and the prefix of the run)
+  return json.dumps(dict(
+    [(k, v) for k, v in opts.items() if k not in _step_opts + _length_opts + ["outfile"]] +
+    [("chem_switch", _chem_switch(opts))]
+  ), sort_keys=True)
+
+def _schedule(opts):
+  # last timestep of the ascent and last timestep of the simulation (as in parcel())
+  nt = int(opts["z_max"] / (opts["w"] * opts["dt"]))
+  return nt, nt + max(opts["wait"] - 1, 0)
+
+def _chem_differs(group):
+  # True if chemistry is on and the variants differ in chemistry options or gas mixing ratios
+  # (these take effect only with chemistry, so the variants are identical until the chem_gate opens)
+  if not _chem_switch(group[0]) or all(len(set(opts[k] for opts in group)) == 1 for k in _step_opts):
+    return False
+  if len(set(opts["chem_gate"] for opts in group)) > 1 or not json.loads(group[0]["chem_gate"]):
+    raise Exception("variants differing in chemistry options or gas mixing ratios have nothing to share without "
+                    "a chem_gate common to all of them (chemistry would differ from the first timestep)")
+  return True
+
+def _branch_step(group):
+  # number of timesteps for which all variants in the group are identical
+  # (the prefix ends earlier if the chem_gate opens, see _group)
+  nt, end = list(zip(*[_schedule(opts) for opts in group]))
+  return min(end) if len(set(nt)) == 1 else min(nt)
+
+def _step(micro, state, info, opts, it, nt, forcing, plan, chem=True):
+  # one timestep of the ascent (it <= nt) or of the wait phase
+  if it <= nt:
+    pc._forcing(state, forcing, opts, it)
+  else:
+    state["t"] = it * opts["dt"]
+  pc._micro_step(micro, state, info, opts, it, None, plan=plan, chem=chem)
+
+def _run(micro, state, info, opts, spectra, fout, it_from, it_to, nt, forcing, info_asc, gate=False):
+  # timesteps it_from ... it_to with output, info at the end of the ascent is kept in info_asc
+  # with gate, stops before the timestep in which the chem_gate opens and returns the last timestep done
+  # (the wall time of its timesteps, all without chemistry, is counted for _chem_gate_report as in _micro_step)
+  plan = pc._step_plan(micro, state, opts)
+  for it in range(it_from, it_to + 1):
+    if gate:
+      # (the gate is checked with the state after the previous timestep, as in _micro_step)
+      if pc._chem_gate(micro, dict(state, t=it * opts["dt"]), info, plan.gate, it):
+        return it - 1
+      timing, wall = info.setdefault("_chem_gate_wall", [0., 0, 0., 0]), time.time()
+    _step(micro, state, info, opts, it, nt, forcing, plan, chem=not gate)
+    if gate:
+      timing[0] += time.time() - wall
+      timing[1] += 1
+    if it % opts["outfreq"] == 0:
+      pc._output(fout, opts, micro, state, it / opts["outfreq"], spectra, plan)
+    if it == nt:
+      info_asc.update((k, copy.copy(v)) for k, v in info.items())
+  return it_to
+
+def _variant(micro, state, info, opts, spectra, prefix, step, forcing, info_asc, report):
+  # continuation of the simulation in a forked process (writing into a copy of the prefix output)
+  # (gas mixing ratios are constant before chemistry is switched on, also in the records of the prefix)
+  for k in pc._Chem_g_id.keys():
+    if k in state:
+      state[k][0] = opts[k]
+  shutil.copy(prefix, opts["outfile"])
+  with netcdf.netcdf_file(opts["outfile"], 'a') as fout:
+    for k in pc._Chem_g_id.keys():
+      if k in state:
+        fout.variables[k][:step // opts["outfreq"] + 1] = opts[k]
+    nt, end = _schedule(opts)
+    _run(micro, state, info, opts, spectra, fout, step + 1, end, nt, forcing, info_asc)
+    info_asc.pop("_chem_gate_wall", None)
+    pc._save_attrs(fout, info_asc)
+    pc._save_attrs(fout, opts)
+    pc._save_attrs(fout, report)
+    pc._chem_gate_save(fout, info)
+
+def _wait(pids, failed):
+  # waits for one of the forked variants (outfiles of the failed ones are added to failed)
+  pid, status = os.wait()
+  if status != 0:
+    failed.append(pids[pid])
+  del pids[pid]
+
+def _group(group, processes):
+  # runs the common prefix of a group of variants once and forks a process for each variant
+  opts = dict(group[0])
+  gate = _chem_differs(group)
+  # end of the shortest ascent (info at the end of the ascent of the shortest variants is taken from the prefix)
+  nt = min(_schedule(v)[0] for v in group)
+  steps = [_schedule(v)[1] for v in group]
+
+  spectra = json.loads(opts["out_bin"])
+  aerosol = json.loads(opts["aerosol"])
+  r_0 = pc._r_0(opts)
+  state, th_0 = pc._state_init(dict(opts, r_0=r_0))
+
+  # pressure profile up to the highest z_max in the group (variants differ only in the number of timesteps)
+  nt_max = max(_schedule(v)[0] for v in group)
+  z = pc._heights(nt_max, opts["w"], opts["dt"])
+  forcing = {"z" : z, "prof" : pc.pprofs[opts["pprof"]](z, opts["p_0"], th_0, r_0)}
+
+  info = { "RH_max" : 0, "libcloud_Git_revision" : pc.libcloud_version,
+           "parcel_Git_revision" : pc.parcel_version }
+  info_asc = {}
+
+  fd, prefix = tempfile.mkstemp(suffix=".nc")
+  os.close(fd)
+  try:
+    micro = pc._micro_init(aerosol, opts, state, info)
+    with pc._output_init(micro, dict(opts, outfile=prefix), spectra) as fout:
+      if micro.opts_init.chem_switch:
+        state.update({ "SO2_a" : 0.,"O3_a" : 0.,"H2O2_a" : 0.,})
+        state.update({ "CO2_a" : 0.,"HNO3_a" : 0.})
+
+        micro.diag_all() # selecting all particles
+        micro.diag_chem(pc._Chem_a_id["NH3_a"])
+        state.update({"NH3_a": pc._outbuf(micro)})
+      pc._output(fout, opts, micro, state, 0, spectra)
+
+      # common prefix
+      step = _run(micro, state, info, opts, spectra, fout, 1, _branch_step(group), nt, forcing, info_asc, gate)
+      report = {"branch_step" : step, "branch_steps_saved" : step * (len(group) - 1)}
+      fout.flush()
+
+      # variants (at most processes at a time, no more variants are started after a failure
+      # and all started ones are waited for before raising)
+      pids, failed = {}, []
+      try:
+        for variant in group:
+          while len(pids) >= processes:
+            _wait(pids, failed)
+          if failed:
+            break
+          pid = os.fork()
+          if pid == 0:
+            try:
+              _variant(micro, state, info, variant, spectra, prefix, step, forcing, info_asc, report)
+            except BaseException:
+              traceback.print_exc()
+              sys.stdout.flush()
+              os._exit(1)
+            os._exit(0)
+          pids[pid] = variant["outfile"]
+      finally:
+        while pids:
+          _wait(pids, failed)
+      if failed:
+        raise Exception("variants " + str(failed) + " failed")
+  finally:
+    os.remove(prefix)
+
+  report["steps_total"] = sum(steps)
+  report["steps_run"] = sum(steps) - report["branch_steps_saved"]
+  return report
+
+def parcel_branches(variants = '[{}]', processes = 0, **kwargs):
+  """
+  Runs variants of a parcel simulation that share a common prefix: the prefix is simulated
+  once and then the process is forked (copy-on-write) for each variant, so that each variant
+  computes only its own suffix. The output of each variant is the same as of a parcel() run.
+
+  Args:
+    variants (Optional[json str]): list of dicts with parcel() options specific to each variant, e.g.:
+
+                                   [{"outfile": "dsl.nc", "chem_dsl": true},
+                                    {"outfile": "dsl_dsc.nc", "chem_dsl": true, "chem_dsc": true}]
+
+                                   each variant needs its own outfile (the variants above differ in chemistry,
+                                   so they need a common chem_gate, e.g. chem_gate='{"RH": 0.99}')
+    processes (Optional[int]):     maximal number of variants run at the same time (0 means number of cores)
+
+    all other arguments are the same as in parcel() and are common to all variants
+
+  Variants are grouped by the options that define the initialisation. Within a group, the branch
+  point is the last timestep at which all variants are identical: the end of the shortest run if
+  variants differ only in z_max and wait. Chemistry options and gas mixing ratios take effect only
+  with chemistry, so variants differing in them need a chem_gate common to all of them and branch
+  before the timestep in which it opens (such variants without a common chem_gate are rejected).
+  The branch point and the number of timesteps saved are saved as branch_step and branch_steps_saved
+  attributes (chem_gate_steps and chem_gate_time_saved of each variant include the prefix).
+  Variants differing in sstp_chem do not share a prefix even though it takes effect only with chemistry:
+  it is set when libcloudph++ is initialised and cannot be changed in the forked processes.
+
+  Returns:
+    dict with the total number of timesteps of all variants (steps_total), the number of timesteps
+    actually computed (steps_run) and the number of groups (groups)
+  """
+  if not hasattr(os, "fork"):
+    raise Exception("parcel_branches() requires os.fork")
+
+  opts = pc._default_opts()
+  for k in kwargs:
+    if k not in opts:
+      raise Exception("invalid parcel_branches() argument >>" + k + "<<")
+  for k in _single_opts:
+    if k in kwargs and kwargs[k] != opts[k]:
+      raise Exception(">>" + k + "<< option is not supported in parcel_branches()")
+  opts.update(kwargs)
+  if opts["backend"] != "serial":
+    raise Exception("parcel_branches() supports only the serial backend (OpenMP is not fork-safe)")
+  if processes <= 0:
+    processes = os.cpu_count() or 1
+
+  # options of each variant grouped by the initialisation
+  groups = {}
+  outfiles = set()
+  for variant in json.loads(variants):
+    for k in variant:
+      if k not in opts or k in _single_opts:
+        raise Exception("invalid key >>" + k + "<< in variants")
+    v_opts = dict(opts)
+    v_opts.update(variant)
+    if v_opts["outfile"] in outfiles:
+      raise Exception("each variant needs its own outfile")
+    outfiles.add(v_opts["outfile"])
+    pc._arguments_checking(v_opts, json.loads(v_opts["out_bin"]), json.loads(v_opts["aerosol"]))
+    groups.setdefault(_group_key(v_opts), []).append(v_opts)
+
+  for group in groups.values():
+    _chem_differs(group)
+
+  report = {"steps_total" : 0, "steps_run" : 0, "groups" : len(groups)}
+  for group in groups.values():
+    grp = _group(group, processes)
+    report["steps_total"] += grp["steps_total"]
+    report["steps_run"] += grp["steps_run"]
+  print("branching: " + str(report["steps_run"]) + " of " + str(report["steps_total"]) + " timesteps computed")
+  return report
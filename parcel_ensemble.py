@@ -0,0 +1,88 @@
+import json, multiprocessing, os, sys, time, traceback
+
+from concurrent.futures import ProcessPoolExecutor
+
+import parcel as pc
+
+def _member(opts):
+  # one parcel() run, the exception (if any) is returned as text
+  try:
+    pc.parcel(**opts)
+  except Exception:
+    return traceback.format_exc()
+  return None
+
+def parcel_ensemble(members = '[{}]', processes = 0, **kwargs):
+  """
+  Runs several parcel() simulations in parallel in processes forked from the calling one, so that
+  the libraries (scipy, libcloudphxx) are imported and the parcel Git revision is read only once, and
+  the size distribution files (see aerosol option) are parsed once for all members before the fork.
+  The output of each member is the same as of a parcel() run, and a failing member does not stop the others.
+
+  Args:
+    members (Optional[json str]): list of dicts with parcel() options specific to each member, e.g.:
+
+                                  [{"outfile": "w05.nc", "w": 0.5}, {"outfile": "w10.nc", "w": 1.0}]
+
+                                  each member needs its own outfile (and checkpoint_file if checkpointing)
+    processes (Optional[int]):    maximal number of members run at the same time (0 means number of cores)
+
+    all other arguments are the same as in parcel() and are common to all members
+
+  Members with the multicore backend use several threads each, so processes should be reduced accordingly.
+  For many parcels differing only in the options of parcel_batch() members, parcel_batch() is cheaper.
+
+  Returns:
+    dict with the number of members (members), the number of processes (processes) and the wall time [s] (wall_time)
+  """
+  opts = pc._default_opts()
+  for k in kwargs:
+    if k not in opts:
+      raise Exception("invalid parcel_ensemble() argument >>" + k + "<<")
+  opts.update(kwargs)
+  if processes <= 0:
+    processes = os.cpu_count() or 1
+
+  # options of each member
+  mbrs = []
+  outfiles, ckpt_files = set(), set()
+  for mbr in json.loads(members):
+    for k in mbr:
+      if k not in opts:
+        raise Exception("invalid key >>" + k + "<< in members")
+    mbr_opts = dict(opts)
+    mbr_opts.update(mbr)
+    if mbr_opts["outfile"] in outfiles:
+      raise Exception("each member needs its own outfile")
+    outfiles.add(mbr_opts["outfile"])
+    if mbr_opts["checkpoint"] > 0 or mbr_opts["restart"]:
+      if mbr_opts["checkpoint_file"] in ckpt_files:
+        raise Exception("each checkpointed member needs its own checkpoint_file")
+      ckpt_files.add(mbr_opts["checkpoint_file"])
+    mbrs.append(mbr_opts)
+  if len(mbrs) == 0:
+    raise Exception("members should define at least one simulation")
+
+  # size distribution files parsed before the fork (the forked processes inherit the parsed tables)
+  for mbr in mbrs:
+    for dct in json.loads(mbr["aerosol"]).values():
+      if "file" in dct:
+        try:
+          pc._aerosol_tabulated(dct)
+        except Exception:
+          pass # (reported by the member)
+
+  t0 = time.time()
+  with ProcessPoolExecutor(max_workers=min(processes, len(mbrs)), mp_context=multiprocessing.get_context("fork")) as pool:
+    errors = list(pool.map(_member, mbrs))
+  wall_time = time.time() - t0
+
+  failed = [mbr["outfile"] for mbr, err in zip(mbrs, errors) if err is not None]
+  for err in errors:
+    if err is not None:
+      sys.stderr.write(err)
+  if failed:
+    raise Exception("members " + str(failed) + " failed")
+
+  print("ensemble: " + str(len(mbrs)) + " members in " + str(round(wall_time, 2)) + " s")
+  return {"members" : len(mbrs), "processes" : processes, "wall_time" : wall_time}
@@ -0,0 +1,259 @@
+import json, zipfile, numpy as np
+
+from scipy.io import netcdf
+
+import parcel as pc
+from parcel_batch import _single_opts
+
+# parcel() options defined by the trajectories
+_traj_opts = ["dt", "w", "z_max", "T_0", "p_0", "r_0", "RH_0"]
+
+class pprof_prescribed(pc.pprof_const_rhod):
+  # pressure prescribed in each timestep (dry air density from the current th_d and r_v)
+  def __init__(self, p):
+    self.p = p
+
+class _npz_rows(object):
+  # consecutive rows of a C-ordered array from an npz file (read without loading the whole array)
+  def __init__(self, zf, key):
+    self.f = zf.open(key + ".npy")
+    version = np.lib.format.read_magic(self.f)
+    if version == (1, 0):
+      self.shape, fortran, self.dtype = np.lib.format.read_array_header_1_0(self.f)
+    else:
+      self.shape, fortran, self.dtype = np.lib.format.read_array_header_2_0(self.f)
+    if fortran and len(self.shape) > 1:
+      raise Exception(">>" + key + "<< in trajectory file should be stored in C order")
+    self.row = 0
+
+  def read(self, i0, i1):
+    if i0 != self.row:
+      raise Exception("rows of npz trajectory files have to be read in order")
+    count = (i1 - i0) * int(np.prod(self.shape[1:]))
+    self.row = i1
+    return np.frombuffer(self.f.read(count * self.dtype.itemsize), dtype=self.dtype).reshape((i1 - i0,) + self.shape[1:])
+
+class _traj_file(object):
+  # trajectories stored in a NetCDF (dimensions traj and t) or npz file read in chunks of trajectories
+  def __init__(self, path):
+    if path.endswith(".npz"):
+      self.zf = zipfile.ZipFile(path)
+      keys = [name[:-len(".npy")] for name in self.zf.namelist()]
+      self.nc = None
+    else:
+      self.nc = netcdf.netcdf_file(path, "r")
+      keys = list(self.nc.variables.keys())
+    self.keys = [k for k in keys if k != "t"]
+    self.rows = {}
+    for k in self.keys:
+      if k not in ["w", "p", "T_0", "p_0", "r_0", "RH_0"]:
+        raise Exception("invalid variable >>" + k + "<< in trajectory file")
+    if "T_0" not in self.keys or not ("r_0" in self.keys or "RH_0" in self.keys):
+      raise Exception("trajectory file should define T_0 and r_0 or RH_0")
+    if "p" not in self.keys and not ("w" in self.keys and "p_0" in self.keys):
+      raise Exception("trajectory file should define p or w and p_0")
+
+    self.t = self.read_all("t")
+    self.n = self.shape("T_0")[0]
+
+  def shape(self, key):
+    if self.nc is not None:
+      return self.nc.variables[key].shape
+    return self.rows.setdefault(key, _npz_rows(self.zf, key)).shape
+
+  def read_all(self, key):
+    if self.nc is not None:
+      return self.nc.variables[key][:].copy()
+    rows = _npz_rows(self.zf, key)
+    return rows.read(0, rows.shape[0])
+
+  def read(self, i0, i1):
+    # all variables of trajectories i0 ... i1-1
+    if self.nc is not None:
+      return dict((k, self.nc.variables[k][i0:i1].astype(float)) for k in self.keys)
+    return dict((k, self.rows.setdefault(k, _npz_rows(self.zf, k)).read(i0, i1).astype(float)) for k in self.keys)
+
+  def close(self):
+    if self.nc is not None:
+      self.nc.close()
+    else:
+      self.zf.close()
+
+class _chunk_output(object):
+  # output records of a chunk of trajectories, written into its columns of the consolidated output
+  # when the chunk is done
+  def __init__(self, fout, i0, i1, n_rec):
+    self.fout, self.cols, self.variables = fout, {}, {}
+    for k, v in fout.variables.items():
+      if v.dimensions[:1] == ('t',):
+        self.cols[k] = tuple(slice(i0, i1) if d == 'parcel' else slice(None) for d in v.dimensions[1:])
+        self.variables[k] = np.zeros((n_rec,) + tuple(i1 - i0 if d == 'parcel' else n for d, n in zip(v.dimensions[1:], v.shape[1:])))
+
+  def write(self):
+    for k, val in self.variables.items():
+      self.fout.variables[k][(slice(None),) + self.cols[k]] = val
+
+def _chunk(fout, traj, i0, i1, opts, spectra, aerosol, n_rec):
+  # runs trajectories i0 ... i1-1 as grid cells of one libcloudph++ instance
+  n, dt, outfreq = i1 - i0, opts["dt"], opts["outfreq"]
+  nt = traj.t.size
+  frc = traj.read(i0, i1)
+  for k in ["T_0", "p_0", "r_0", "RH_0"]:
+    if k in frc and frc[k].shape != (n,):
+      raise Exception(">>" + k + "<< in trajectory file should have only the traj dimension")
+  for k in ["w", "p"]:
+    if k in frc and frc[k].shape != (n, nt):
+      raise Exception(">>" + k + "<< in trajectory file should have traj and t dimensions")
+
+  # initial conditions
+  T_0 = frc["T_0"]
+  p_0 = frc["p"][:, 0] if "p" in frc else frc["p_0"]
+  if np.any(T_0 < 273.15):
+    raise Exception("temperature should be larger than 0C - microphysics works only for warm clouds")
+  r_0 = frc["r_0"] if "r_0" in frc else pc._r_0({"r_0" : -1., "RH_0" : frc["RH_0"], "T_0" : T_0, "p_0" : p_0})
+  state, th_0 = pc._state_init(dict(opts, T_0=T_0, p_0=p_0, r_0=r_0), n)
+
+  # heights from w (if given, otherwise from the prescribed pressure in the timestepping below)
+  # and pressure either prescribed or from pprof
+  z = np.zeros((nt, n))
+  dz = np.zeros((nt, n))
+  if "w" in frc:
+    dz[1:] = frc["w"][:, :-1].T * dt
+    z = np.cumsum(dz, axis=0)
+  if "p" in frc:
+    prof = pprof_prescribed(frc["p"].T)
+  else:
+    prof = pc.pprofs[opts["pprof"]](z, p_0, th_0, r_0)
+
+  state["z"] = z[0]
+  info = { "RH_max" : np.zeros(n) }
+
+  # (SD placement with sd_alloc shared by the trajectories of the chunk, see parcel_batch.py)
+  micro = pc._micro_init(aerosol, dict(opts, T_0=T_0), state, info, nx=n)
+  if fout is None:
+    fout = pc._output_init(micro, opts, spectra, n_parcel=traj.n)
+    for k in ["T_0", "p_0", "r_0", "RH_max"]:
+      fout.createVariable(k + ("_ini" if k != "RH_max" else ""), 'd', ('parcel',))
+  out = _chunk_output(fout, i0, i1, n_rec)
+
+  # adding chem state vars
+  if micro.opts_init.chem_switch:
+    for id_str in ["SO2_a", "O3_a", "H2O2_a", "CO2_a", "HNO3_a"]:
+      state[id_str] = np.zeros(n)
+    micro.diag_all() # selecting all particles
+    micro.diag_chem(pc._Chem_a_id["NH3_a"])
+    state.update({"NH3_a": np.frombuffer(micro.outbuf()).copy()})
+
+  # t=0 : init & save
+  pc._output(out, opts, micro, state, 0, spectra)
+
+  # timestepping
+  plan = pc._step_plan(micro, state, opts)
+  for it in range(1, nt):
+    state["t"] = it * dt
+    if "w" not in frc:
+      # hydrostatic, with dry air density constant within the timestep (as in pprof_piecewise_const_rhod)
+      z[it] = z[it-1] + (state["p"] - prof.p[it]) / (state["rhod"] * pc.common.g)
+    state["z"] = z[it]
+    state["p"][:], state["rhod"][:] = prof(it, dz[it], state["p"], state["th_d"], state["r_v"], state["rhod"])
+    pc._micro_step(micro, state, info, opts, it, None, plan=plan)
+
+    if (it % outfreq == 0):
+      pc._output(out, opts, micro, state, it // outfreq, spectra, plan)
+
+  out.write()
+  for k, val in [("T_0_ini", T_0), ("p_0_ini", p_0), ("r_0_ini", r_0), ("RH_max", info.pop("RH_max"))]:
+    fout.variables[k][i0:i1] = val
+  pc._chem_gate_report(info)
+  return fout, info
+
+def _info_merge(total, info):
+  # attributes of all chunks (as saved by parcel_batch() for one chunk): counters summed, chemistry switched
+  # on at the earliest time of all chunks, largest numbers of SDs and threads and all backends used
+  for k, val in info.items():
+    if k not in total:
+      total[k] = val
+    elif k in ["chem_gate_steps", "chem_gate_time_saved"]:
+      total[k] += val
+    elif k == "chem_gate_t":
+      total[k] = min(t for t in [total[k], val] if t >= 0) if max(total[k], val) >= 0 else -1.
+    elif k in ["n_sd_max", "sd_peak", "backend_threads"]:
+      total[k] = max(total[k], val)
+    elif k == "backend_used" and val not in total[k].split(","):
+      total[k] += "," + val
+
+def parcel_trajectories(trajfile, batch = 100, **kwargs):
+  """
+  Runs parcels along prescribed trajectories (e.g. Lagrangian trajectories from LES output)
+  read from a NetCDF or npz file, in chunks of trajectories run as grid cells of one
+  libcloudph++ instance. The results of all trajectories are saved in one output file.
+
+  Args:
+    trajfile (string):         NetCDF (dimensions traj and t) or npz file with variables:
+
+                               t          - time [s] (t dimension, equally spaced, defines dt)
+                               w          - vertical velocity [m/s] (traj and t dimensions, may be negative)
+                               p          - pressure [Pa] (traj and t dimensions)
+                               T_0        - initial temperature [K] (traj dimension)
+                               p_0        - initial pressure [Pa] (traj dimension, needed if p is not given)
+                               r_0, RH_0  - initial water vapour mixing ratio [kg/kg] or relative humidity (traj dimension)
+
+                               if p is given it is used for each timestep, otherwise it is calculated
+                               from the heights reached with w using pprof (if w is not given, the heights
+                               are calculated from p assuming hydrostatic balance)
+    batch (Optional[int]):     number of trajectories run at the same time (in one libcloudph++ instance),
+                               only the trajectories of one batch are read into memory at a time
+
+    all other arguments are the same as in parcel() (except dt, w, z_max, T_0, p_0, r_0 and RH_0
+    defined by the trajectories) and are common to all trajectories
+
+  The output has the same variables as the output of parcel_batch(): all variables have
+  an additional "parcel" dimension (index of the trajectory), the initial conditions
+  and RH_max of each trajectory are saved as variables with the "parcel" dimension only.
+  The attributes saved by parcel_batch() (e.g. backend_used, chem_gate_steps) are merged over
+  the batches: numbers of timesteps and wall time saved are summed, chem_gate_t is the earliest
+  time chemistry was switched on, n_sd_max, sd_peak and backend_threads are the largest
+  and backend_used lists all backends used.
+  Parallel runs are available through the backend option. As in parcel_batch(), the output
+  of all trajectories is kept in memory until the output file is closed.
+  """
+  opts = pc._default_opts()
+  for k in kwargs:
+    if k not in opts or k in _traj_opts:
+      raise Exception("invalid parcel_trajectories() argument >>" + k + "<<")
+  for k in _single_opts:
+    if k in kwargs and kwargs[k] != opts[k]:
+      raise Exception(">>" + k + "<< option is not supported in parcel_trajectories()")
+  opts.update(kwargs)
+  if batch < 1:
+    raise Exception("batch should be larger than 0")
+
+  spectra = json.loads(opts["out_bin"])
+  aerosol = json.loads(opts["aerosol"])
+
+  traj = _traj_file(trajfile)
+  try:
+    if traj.t.size < 2 or not np.allclose(np.diff(traj.t), traj.t[1] - traj.t[0], atol=0, rtol=1e-6):
+      raise Exception("t in trajectory file should have at least two equally spaced values")
+    opts["dt"] = float(traj.t[1] - traj.t[0])
+    pc._arguments_checking(opts, spectra, aerosol)
+    for k in _traj_opts[1:]:
+      del opts[k]
+    opts["trajfile"] = trajfile
+    n_rec = (traj.t.size - 1) // opts["outfreq"] + 1
+
+    fout = None
+    info = { "libcloud_Git_revision" : pc.libcloud_version, "parcel_Git_revision" : pc.parcel_version }
+    try:
+      for i0 in range(0, traj.n, batch):
+        fout, chunk_info = _chunk(fout, traj, i0, min(i0 + batch, traj.n), opts, spectra, aerosol, n_rec)
+        _info_merge(info, chunk_info)
+        print(str(round(min(i0 + batch, traj.n) / (traj.n * 1.) * 100, 2)) + " % of trajectories")
+      pc._save_attrs(fout, info)
+      # (bool options saved as integers, as scipy does in parcel())
+      pc._save_attrs(fout, dict((k, int(v) if type(v) == bool else v) for k, v in opts.items()))
+    finally:
+      if fout is not None:
+        fout.close()
+  finally:
+    traj.close()
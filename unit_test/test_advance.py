@@ -0,0 +1,56 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+import parcel as pc
+from parcel import parcel
+import json
+
+"""
+checking if advancing the model by all timesteps between output records in one call
+gives the same output as advancing it timestep by timestep (forced by a stop criterion
+that is checked after each timestep and never met)
+"""
+
+@pytest.mark.parametrize("pprof", ["pprof_const_th_rv", "pprof_const_rhod", "pprof_piecewise_const_rhod"])
+def test_advance(tmpdir, pprof):
+    opts = {"z_max" : 30., "outfreq" : 7, "RH_0" : .99, "T_0" : 280., "pprof" : pprof}
+    str_k = str(tmpdir.join("test_k.nc"))
+    parcel(outfile=str_k, **opts)
+    str_1 = str(tmpdir.join("test_1.nc"))
+    parcel(outfile=str_1, stop='{"z": 1e6}', **opts)
+
+    with netcdf.netcdf_file(str_k, "r", mmap=False) as f_k, netcdf.netcdf_file(str_1, "r", mmap=False) as f_1:
+        assert f_k.RH_max == f_1.RH_max
+        for var in f_1.variables:
+            assert np.array_equal(f_k.variables[var][:], f_1.variables[var][:]), var
+
+def test_advance_vs_loop():
+    """ checking if _advance gives the same state as _forcing and _micro_step in each timestep """
+    opts = dict(pc._default_opts(), RH_0 = .99, T_0 = 280., z_max = 20.)
+    r_0 = pc._r_0(opts)
+    nt = int(opts["z_max"] / (opts["w"] * opts["dt"]))
+
+    states = []
+    for advance in [False, True]:
+        state, th_0 = pc._state_init(dict(opts, r_0 = r_0))
+        info = {"RH_max" : 0}
+        z = pc._heights(nt, opts["w"], opts["dt"])
+        forcing = {"z" : z, "prof" : pc.pprofs[opts["pprof"]](z, opts["p_0"], th_0, r_0)}
+        micro = pc._micro_init(json.loads(opts["aerosol"]), opts, state, info)
+        plan = pc._step_plan(micro, state, opts)
+        if advance:
+            assert pc._advance(micro, state, info, opts, 0, nt, forcing, plan) == nt
+        else:
+            for it in range(1, nt+1):
+                pc._forcing(state, forcing, opts, it)
+                pc._micro_step(micro, state, info, opts, it, None, plan=plan)
+        states.append((state, info))
+
+    (s_l, i_l), (s_a, i_a) = states
+    assert i_l["RH_max"] == i_a["RH_max"]
+    for var in ["t", "z", "p", "th_d", "r_v", "rhod", "T", "RH"]:
+        assert np.array_equal(s_l[var], s_a[var]), var
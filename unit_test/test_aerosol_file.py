@@ -0,0 +1,104 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from scipy.io import netcdf as nc
+import numpy as np
+import json
+import os
+import pytest
+
+import parcel as pc
+
+out_bin = '{"dry": {"rght": 1, "left": 0, "drwt": "dry", "lnli": "lin", "nbin": 1, "moms": [0, 3]}}'
+
+# lognormal distributions tabulated as by an instrument (dN/dlnr in bins)
+r = np.exp(np.linspace(np.log(5e-9), np.log(5e-7), 120))
+dists = {"a" : pc.lognormal(2e-8, 1.4, 60e6)(np.log(r)), "b" : pc.lognormal(3e-8, 1.5, 30e6)(np.log(r))}
+
+@pytest.fixture(params=["csv", "nc"])
+def aerosol_file(request, tmpdir):
+  path = str(tmpdir.join("spectra." + request.param))
+  if request.param == "csv":
+    np.savetxt(path, np.column_stack([r, dists["a"], dists["b"]]), delimiter=",", header="r,a,b", comments="")
+  else:
+    with nc.netcdf_file(path, "w") as f:
+      f.createDimension("r", r.size)
+      f.createVariable("r", "d", ("r",))[:] = r
+      for k, v in dists.items():
+        f.createVariable(k, "d", ("r",))[:] = v
+  return path
+
+def run(tmpdir, aerosol):
+  outfile = str(tmpdir.join("test_aerosol_file.nc"))
+  pc.parcel(outfile = outfile, z_max = 20., outfreq = 10, sd_conc = 256, aerosol = json.dumps(aerosol), out_bin = out_bin)
+  f = nc.netcdf_file(outfile)
+  mom = [f.variables["dry_m0"][0, 0], f.variables["dry_m3"][0, 0]]
+  f.close()
+  return np.array(mom)
+
+def test_aerosol_file(tmpdir, aerosol_file):
+  """ checking if a tabulated distribution gives the same initial aerosol as the lognormal one """
+  lgn = run(tmpdir, {"ammonium_sulfate": {"kappa": 0.61, "mean_r": [2e-8], "gstdev": [1.4], "n_tot": [60e6]}})
+  tab = run(tmpdir, {"ammonium_sulfate": {"kappa": 0.61, "file": aerosol_file, "dist": "a"}})
+  assert np.allclose(tab, lgn, rtol=2e-2)
+
+@pytest.fixture
+def calls(monkeypatch):
+  # number of interpolants built from the tables
+  calls = {"interp" : 0}
+  pchip = pc.interpolate.PchipInterpolator
+  def counting(*args, **kwargs):
+    calls["interp"] += 1
+    return pchip(*args, **kwargs)
+  monkeypatch.setattr(pc.interpolate, "PchipInterpolator", counting)
+  return calls
+
+def test_aerosol_file_parsed_once(tmpdir, aerosol_file, calls):
+  """ checking if the file is parsed and each distribution interpolated only once """
+  for dist in ["a", "b", "a", "b"]:
+    run(tmpdir, {"ammonium_sulfate": {"kappa": 0.61, "file": aerosol_file, "dist": dist}})
+  assert calls["interp"] == 2
+  assert os.path.abspath(aerosol_file) in pc._aerosol_files
+
+def test_aerosol_file_modified(tmpdir, aerosol_file, calls):
+  """ checking if a modified file is parsed again and replaces the entry of the previous version """
+  n_files = len(pc._aerosol_files)
+  for i in range(3):
+    mtime = os.path.getmtime(aerosol_file) + 10
+    os.utime(aerosol_file, (mtime, mtime))
+    run(tmpdir, {"ammonium_sulfate": {"kappa": 0.61, "file": aerosol_file, "dist": "a"}})
+  assert calls["interp"] == 3
+  assert len(pc._aerosol_files) <= n_files + 1
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc/self/fd")
+def test_aerosol_file_closed(tmpdir, aerosol_file):
+  """ checking if the file is not kept open after reading the distributions """
+  for dist in ["a", "b"]:
+    pc._dry_distro({"kappa": 0.61, "file": aerosol_file, "dist": dist})
+  fds = [os.path.join("/proc/self/fd", fd) for fd in os.listdir("/proc/self/fd")]
+  assert os.path.realpath(aerosol_file) not in [os.path.realpath(fd) for fd in fds]
+
+def test_aerosol_file_monotone(aerosol_file):
+  """ checking if the interpolant does not overshoot between the tabulated values """
+  distro = pc._dry_distro({"kappa": 0.61, "file": aerosol_file, "dist": "a"})
+  lnr = np.linspace(np.log(r[0]), np.log(r[-1]), 5000)[:-1]
+  n = distro(lnr)
+  i = np.searchsorted(np.log(r), lnr, side="right")
+  lo = np.minimum(dists["a"][i - 1], dists["a"][i])
+  hi = np.maximum(dists["a"][i - 1], dists["a"][i])
+  assert np.all(n >= lo * (1 - 1e-6)) and np.all(n <= hi * (1 + 1e-6))
+
+def test_aerosol_file_header(tmpdir):
+  """ checking if the CSV columns are found by their names as written in the header """
+  path = str(tmpdir.join("spectra_header.csv"))
+  np.savetxt(path, np.column_stack([r, dists["a"], dists["b"]]), delimiter=",", header="r [m],flight 1.a,flight-2", comments="")
+  for dist, ref in [("flight 1.a", "a"), ("flight-2", "b")]:
+    tab, lnr = pc._aerosol_table(path, dist)
+    assert np.array_equal(tab, r) and np.array_equal(lnr, dists[ref])
+
+def test_aerosol_file_dry_sizes(aerosol_file):
+  """ checking if tabulated distributions are passed to libcloudph++ as dry_sizes (not sampled in Python by libcloudph++) """
+  opts = dict(pc._default_opts(), sd_conc = 64, aerosol = json.dumps({"ammonium_sulfate": {"kappa": 0.61, "file": aerosol_file, "dist": "a"}}))
+  state, _ = pc._state_init(dict(opts, r_0 = pc._r_0(opts)))
+  micro = pc._micro_init(json.loads(opts["aerosol"]), opts, state, {"RH_max" : 0})
+  assert micro.opts_init.dry_distros == {} and 0 < len(micro.opts_init.dry_sizes[0.61]) <= 64
@@ -0,0 +1,41 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+import parcel as pc
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+@pytest.mark.parametrize("backend", ["serial", "auto"])
+def test_backend_attrs(tmpdir, backend):
+    """ checking if the backend actually used and the number of threads are saved in the output """
+    str_f = str(tmpdir.join("test_pcl.nc"))
+    pc.parcel(outfile=str_f, backend=backend)
+    f_out = netcdf.netcdf_file(str_f, "r")
+
+    assert f_out.backend == backend.encode()
+    assert f_out.backend_used in [b"serial", b"multicore"]
+    assert f_out.backend_threads >= 1
+    if f_out.backend_used == b"serial":
+        assert f_out.backend_threads == 1
+
+def test_backend_auto_small(tmpdir):
+    """ checking if auto backend chooses serial for small number of super-droplets """
+    str_f = str(tmpdir.join("test_pcl.nc"))
+    pc.parcel(outfile=str_f, backend="auto", sd_conc=8)
+    f_out = netcdf.netcdf_file(str_f, "r")
+    assert f_out.backend_used == b"serial"
+
+def test_backend_multicore(tmpdir):
+    """ checking if the multicore backend gives the same thermodynamics as the serial one """
+    str_s = str(tmpdir.join("test_serial.nc"))
+    str_m = str(tmpdir.join("test_multicore.nc"))
+    pc.parcel(outfile=str_s, backend="serial")
+    try:
+        pc.parcel(outfile=str_m, backend="multicore")
+    except Exception:
+        pytest.skip("libcloudph++ compiled without OpenMP backend")
+    f_s = netcdf.netcdf_file(str_s, "r")
+    f_m = netcdf.netcdf_file(str_m, "r")
+    for var in ["t", "z", "th_d", "T", "p", "r_v", "rhod", "RH"]:
+        assert np.isclose(f_s.variables[var][:], f_m.variables[var][:], atol=0, rtol=1e-4).all()
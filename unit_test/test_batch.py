@@ -0,0 +1,84 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import parcel
+from parcel_batch import parcel_batch
+import parcel as pc
+from scipy.io import netcdf
+import numpy as np
+import json
+import pytest
+
+"""
+checking if parcels run as grid cells of one libcloudph++ instance
+give the same results as parcels run one by one
+"""
+
+members = [{"w" : .5, "RH_0" : .99}, {"w" : 1., "RH_0" : .99}, {"w" : 1., "T_0" : 290., "RH_0" : .95}]
+common_opts = {"dt" : .1, "z_max" : 100., "outfreq" : 10, "sd_conc" : 64}
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("batch")
+    data = {}
+
+    str_b = str(tmp.join("test_batch.nc"))
+    parcel_batch(members=json.dumps(members), outfile=str_b, **common_opts)
+    data["batch"] = netcdf.netcdf_file(str_b, "r")
+
+    data["single"] = []
+    for i, mbr in enumerate(members):
+        str_s = str(tmp.join("test_single_" + str(i) + ".nc"))
+        opts = dict(common_opts)
+        opts.update(mbr)
+        parcel(outfile=str_s, **opts)
+        data["single"].append(netcdf.netcdf_file(str_s, "r"))
+    return data
+
+def test_batch_dims(data):
+    """ checking if each parcel has its own column in the output """
+    assert data["batch"].dimensions["parcel"] == len(members)
+    assert np.isclose(data["batch"].variables["w_ini"][:], [mbr["w"] for mbr in members]).all()
+    assert data["batch"].variables["radii_m0"].shape[1:] == (len(members), 1)
+
+@pytest.mark.parametrize("idx", range(len(members)))
+def test_batch_vs_single(data, idx, eps=1e-3):
+    """ checking if a parcel in a batch behaves as the same parcel run alone """
+    f_b = data["batch"]
+    f_s = data["single"][idx]
+    n_rec = f_s.variables["t"].shape[0]
+    assert np.isclose(f_b.variables["z"][:n_rec, idx], f_s.variables["z"][:]).all()
+    for var in ["th_d", "T", "p", "r_v", "rhod"]:
+        assert np.isclose(f_b.variables[var][:n_rec, idx], f_s.variables[var][:], atol=0, rtol=eps).all(), var
+    assert np.isclose(f_b.RH_max[idx], f_s.RH_max, atol=0, rtol=eps)
+
+def test_batch_wait(tmpdir):
+    """ checking if the wait phase has as many timesteps as in parcel() """
+    opts = dict(common_opts, z_max = 20., outfreq = 10, wait = 20)
+    str_b = str(tmpdir.join("test_batch_wait.nc"))
+    parcel_batch(members=json.dumps(members[1:2]), outfile=str_b, **opts)
+    str_s = str(tmpdir.join("test_single_wait.nc"))
+    parcel(outfile=str_s, **dict(opts, **members[1]))
+    with netcdf.netcdf_file(str_b, "r", mmap=False) as f_b, netcdf.netcdf_file(str_s, "r", mmap=False) as f_s:
+        assert np.array_equal(f_b.variables["t"][:], f_s.variables["t"][:])
+
+def test_batch_wait_attrs(tmpdir, eps=1e-3):
+    """ checking if RH_max of each parcel is taken at the end of its ascent as in parcel() (without the wait phase) """
+    opts = dict(common_opts, z_max = 20., wait = 200)
+    str_b = str(tmpdir.join("test_batch_wait_attrs.nc"))
+    parcel_batch(members=json.dumps(members), outfile=str_b, **opts)
+    with netcdf.netcdf_file(str_b, "r", mmap=False) as f_b:
+        for idx, mbr in enumerate(members):
+            str_s = str(tmpdir.join("test_single_wait_attrs_" + str(idx) + ".nc"))
+            parcel(outfile=str_s, **dict(opts, **mbr))
+            with netcdf.netcdf_file(str_s, "r", mmap=False) as f_s:
+                assert np.isclose(f_b.RH_max[idx], f_s.RH_max, atol=0, rtol=eps)
+
+def test_batch_sd_alloc_T(tmpdir, monkeypatch):
+    """ checking if the SD placement uses the T_0 of each parcel """
+    temps = []
+    sd_alloc = pc._sd_alloc
+    monkeypatch.setattr(pc, "_sd_alloc", lambda name, dct, alloc, sd_conc, T: temps.append(T) or sd_alloc(name, dct, alloc, sd_conc, T))
+    parcel_batch(members=json.dumps(members), outfile=str(tmpdir.join("test_sd_alloc.nc")), sd_alloc='{"act": 1}', **common_opts)
+    assert len(temps) == 1
+    assert np.array_equal(temps[0], [mbr.get("T_0", 300.) for mbr in members])
@@ -0,0 +1,62 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import parcel
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+"""
+checking if the bulk scheme screening mode saves the same state variables
+as the lagrangian scheme and conserves the total water
+"""
+
+opts = {"dt" : .1, "z_max" : 200., "outfreq" : 20, "RH_0" : .99, "T_0" : 285.}
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("blk_2m")
+    data = {}
+    for scheme in ["lgrngn", "blk_2m"]:
+        str_f = str(tmp.join("test_" + scheme + ".nc"))
+        parcel(scheme=scheme, outfile=str_f, **opts)
+        data[scheme] = netcdf.netcdf_file(str_f, "r")
+    return data
+
+def test_blk_2m_vars(data):
+    """ checking if the state variables of both schemes are saved in the same way """
+    for var in ["t", "z", "th_d", "r_v", "rhod", "p", "T", "RH"]:
+        assert data["blk_2m"].variables[var].shape == data["lgrngn"].variables[var].shape, var
+    for var in ["rc", "nc", "rr", "nr"]:
+        assert var in data["blk_2m"].variables
+
+def test_blk_2m_RH_max(data, eps=.3):
+    """
+    checking if the maximum supersaturation of the bulk scheme is close to the lagrangian one
+    (the bulk scheme activates all droplets at once and grows them with one relaxation time,
+    so its supersaturation maximum is expected to differ by up to about 30 %)
+    """
+    assert data["lgrngn"].RH_max > 1
+    assert np.isclose(data["blk_2m"].RH_max - 1, data["lgrngn"].RH_max - 1, atol=0, rtol=eps)
+
+def test_blk_2m_water(data, eps=1e-10):
+    """ checking if the sum of water vapour, cloud and rain water is constant """
+    f = data["blk_2m"]
+    r_t = f.variables["r_v"][:] + f.variables["rc"][:] + f.variables["rr"][:]
+    assert np.isclose(r_t, r_t[0], atol=0, rtol=eps).all()
+    assert f.variables["rc"][-1] > 0
+    assert f.variables["nc"][-1] > 0
+
+def test_blk_2m_attrs(tmpdir):
+    """ checking if the attributes are saved also without timesteps of the ascent """
+    str_f = str(tmpdir.join("test_nt0.nc"))
+    parcel(scheme="blk_2m", outfile=str_f, **dict(opts, z_max=0., wait=50))
+    f = netcdf.netcdf_file(str_f, "r")
+    assert f.scheme == b"blk_2m"
+    assert f.RH_max == f.variables["RH"][0]
+
+def test_blk_2m_out_bin(tmpdir):
+    """ checking if spectra output is rejected with the bulk scheme """
+    out_bin = '{"radii": {"rght": 1e-4, "moms": [0], "drwt": "wet", "nbin": 10, "lnli": "log", "left": 1e-9}}'
+    with pytest.raises(Exception, match="out_bin"):
+        parcel(scheme="blk_2m", outfile=str(tmpdir.join("test_out_bin.nc")), out_bin=out_bin, **opts)
@@ -0,0 +1,92 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import parcel
+from parcel_branch import parcel_branches
+from scipy.io import netcdf
+import numpy as np
+import json
+import pytest
+
+"""
+checking if variants run by the branching runner give the same results
+as the same simulations run with parcel()
+"""
+
+chem_opts = {"SO2_g" : 2e-10, "O3_g" : 5e-8, "H2O2_g" : 5e-10, "CO2_g" : 3.6e-4, "NH3_g" : 1e-10, "HNO3_g" : 1e-10}
+
+gate = '{"RH": 0.999}'
+
+variants = [
+  {"z_max" : 100.},
+  {"z_max" : 150.},
+  {"z_max" : 150., "wait" : 100},
+  {"chem_dsl" : True, "chem_gate" : gate},
+  {"chem_dsl" : True, "chem_dsc" : True, "chem_gate" : gate},
+  {"chem_dsl" : True, "chem_dsc" : True, "chem_rct" : True, "SO2_g" : 4e-10, "chem_gate" : gate}
+]
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("branch")
+    for i, variant in enumerate(variants):
+        variant["outfile"] = str(tmp.join("test_branch_" + str(i) + ".nc"))
+    common_opts = dict(chem_opts, RH_0 = .99, outfreq = 50, z_max = 200.)
+
+    report = parcel_branches(variants = json.dumps(variants), **common_opts)
+
+    data = {"report" : report, "branch" : [], "single" : []}
+    for i, variant in enumerate(variants):
+        opts = dict(common_opts)
+        opts.update(variant)
+        opts["outfile"] = str(tmp.join("test_single_" + str(i) + ".nc"))
+        parcel(**opts)
+        data["single"].append(netcdf.netcdf_file(opts["outfile"], "r"))
+        data["branch"].append(netcdf.netcdf_file(variant["outfile"], "r"))
+    return data
+
+def test_branch_report(data):
+    """ checking if the prefix of variants differing only in length was computed once """
+    assert data["report"]["groups"] == 2
+    assert data["report"]["steps_run"] < data["report"]["steps_total"]
+    assert data["branch"][0].branch_step == 1000
+
+def test_branch_chem_gate(data):
+    """ checking if variants differing in chemistry share the timesteps before the chem_gate opens """
+    for idx in [3, 4, 5]:
+        f_b, f_s = data["branch"][idx], data["single"][idx]
+        assert f_b.chem_gate_t == f_s.chem_gate_t > 0
+        assert f_b.chem_gate_steps == f_s.chem_gate_steps
+        assert f_b.chem_gate_time_saved > 0
+        assert f_b.branch_step == int(round(f_s.chem_gate_t / .1)) - 1 > 0
+
+def test_branch_chem_no_gate(tmpdir):
+    """ checking if variants differing in chemistry without a common chem_gate are rejected """
+    chem = [{"chem_dsl" : True, "outfile" : str(tmpdir.join("a.nc"))},
+            {"chem_dsl" : True, "chem_dsc" : True, "outfile" : str(tmpdir.join("b.nc"))}]
+    with pytest.raises(Exception, match="chem_gate"):
+        parcel_branches(variants = json.dumps(chem), **chem_opts)
+
+@pytest.mark.parametrize("idx", range(len(variants)))
+def test_branch_vs_single(data, idx):
+    """ checking if the output of each variant is the same as of parcel() """
+    f_b = data["branch"][idx]
+    f_s = data["single"][idx]
+    assert f_b.RH_max == f_s.RH_max
+    assert set(f_b.variables.keys()) == set(f_s.variables.keys())
+    for var in f_s.variables:
+        assert f_b.variables[var].shape == f_s.variables[var].shape, var
+        assert np.isclose(f_b.variables[var][:], f_s.variables[var][:], atol=0, rtol=1e-10).all(), var
+
+def test_branch_order(data, tmpdir):
+    """ checking if the output does not depend on the order of variants (shortest ascent listed last) """
+    length = [dict(variants[i], outfile = str(tmpdir.join("test_order_" + str(i) + ".nc"))) for i in [2, 1, 0]]
+    parcel_branches(variants = json.dumps(length), **dict(chem_opts, RH_0 = .99, outfreq = 50, z_max = 200.))
+    for variant, idx in zip(length, [2, 1, 0]):
+        f_b = netcdf.netcdf_file(variant["outfile"], "r")
+        f_s = data["single"][idx]
+        assert f_b.RH_max == f_s.RH_max
+        assert f_b.parcel_Git_revision == f_s.parcel_Git_revision
+        for var in f_s.variables:
+            assert np.isclose(f_b.variables[var][:], f_s.variables[var][:], atol=0, rtol=1e-10).all(), var
+        f_b.close()
@@ -0,0 +1,101 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+import parcel as pc
+from scipy.io import netcdf
+import numpy as np
+import shutil
+import pytest
+
+"""
+checking if a run restarted from a checkpoint gives the same output
+as the run done in one go
+"""
+
+chem_opts = {"chem_dsl" : True, "chem_dsc" : True, "chem_rct" : True,
+             "SO2_g" : 2e-10, "O3_g" : 5e-8, "H2O2_g" : 5e-10, "CO2_g" : 3.6e-4, "NH3_g" : 1e-10, "HNO3_g" : 1e-10}
+
+@pytest.mark.parametrize("chem", [False, True])
+def test_restart_extend(tmpdir, chem):
+    """ checking if a finished run can be continued to a larger z_max """
+    str_r = str(tmpdir.join("test_ref.nc"))
+    str_c = str(tmpdir.join("test_ckpt.nc"))
+    str_k = str(tmpdir.join("test_ckpt.pkl"))
+    opts = {"RH_0" : .99, "outfreq" : 50, "z_max" : 200.}
+    if chem:
+        opts.update(chem_opts)
+
+    pc.parcel(outfile=str_r, **opts)
+
+    opts["z_max"] = 100.
+    pc.parcel(outfile=str_c, checkpoint=300, checkpoint_file=str_k, **opts)
+    opts["z_max"] = 200.
+    pc.parcel(outfile=str_c, checkpoint_file=str_k, restart=True, **opts)
+
+    f_ref  = netcdf.netcdf_file(str_r, "r")
+    f_ckpt = netcdf.netcdf_file(str_c, "r")
+    assert f_ckpt.z_max == 200.
+    assert f_ckpt.RH_max == f_ref.RH_max
+    for var in f_ref.variables:
+        assert f_ref.variables[var].shape == f_ckpt.variables[var].shape, var
+        assert np.isclose(f_ref.variables[var][:], f_ckpt.variables[var][:], atol=0, rtol=1e-10).all(), var
+
+@pytest.mark.parametrize("opt", [{"w" : 2.}, {"dt" : .05}, {"sd_conc" : 32}, {"sd_alloc" : '{"seed": 2}'},
+    {"aerosol" : '{"ammonium_sulfate": {"kappa": 0.61, "mean_r": [0.03e-6], "gstdev": [1.4], "n_tot": [60.0e6]}}'},
+    {"sstp_auto" : '{"cond_max": 4}'}])
+def test_restart_opts(tmpdir, opt):
+    """ checking if restart with options changing the trajectory is refused before the replay """
+    str_c = str(tmpdir.join("test_ckpt.nc"))
+    str_k = str(tmpdir.join("test_ckpt.pkl"))
+    pc.parcel(outfile=str_c, z_max=50., checkpoint=100, checkpoint_file=str_k)
+    with pytest.raises(Exception, match="differs from the one of the checkpointed run"):
+        pc.parcel(outfile=str_c, z_max=100., checkpoint_file=str_k, restart=True, **opt)
+
+def test_restart_sstp_auto(tmpdir):
+    """ checking if a restarted run with sstp_auto and chemistry gives the same output as the run done in one go """
+    str_r = str(tmpdir.join("test_ref.nc"))
+    str_c = str(tmpdir.join("test_ckpt.nc"))
+    str_k = str(tmpdir.join("test_ckpt.pkl"))
+    opts = dict(chem_opts, RH_0 = .99, outfreq = 100, z_max = 200., checkpoint = 250,
+                sstp_auto = '{"chem_max": 8, "chem_tol": 0.1}',
+                out_bin = '{"chem": {"rght": 1, "left": 0, "drwt": "dry", "lnli": "lin", "nbin": 1, "moms": ["S_VI"]}}')
+
+    pc.parcel(outfile=str_r, checkpoint_file=str(tmpdir.join("test_ref.pkl")), **opts)
+
+    opts["z_max"] = 100.
+    pc.parcel(outfile=str_c, checkpoint_file=str_k, **opts)
+    opts["z_max"] = 200.
+    pc.parcel(outfile=str_c, checkpoint_file=str_k, restart=True, **opts)
+
+    f_ref  = netcdf.netcdf_file(str_r, "r")
+    f_ckpt = netcdf.netcdf_file(str_c, "r")
+    assert f_ckpt.chem_calls == f_ref.chem_calls
+    assert f_ckpt.cond_calls == f_ref.cond_calls
+    for var in f_ref.variables:
+        assert f_ref.variables[var].shape == f_ckpt.variables[var].shape, var
+        assert np.isclose(f_ref.variables[var][:], f_ckpt.variables[var][:], atol=0, rtol=1e-10).all(), var
+
+def test_restart_twice_sstp_auto(tmpdir):
+    """ checking if a run restarted twice with sstp_auto and chemistry replays the chemistry of all the runs before """
+    str_c, str_k = str(tmpdir.join("test_ckpt.nc")), str(tmpdir.join("test_ckpt.pkl"))
+    str_1, str_1k = str(tmpdir.join("test_once.nc")), str(tmpdir.join("test_once.pkl"))
+    opts = dict(chem_opts, RH_0 = .99, outfreq = 500, sstp_auto = '{"chem_max": 8, "chem_tol": 0.1}',
+                out_bin = '{"chem": {"rght": 1, "left": 0, "drwt": "dry", "lnli": "lin", "nbin": 1, "moms": ["S_VI"]}}')
+
+    # checkpoints (and the pending chemistry applied) at 300 and 600 timesteps in the first run,
+    # at 800, 1000 and 1200 timesteps in the second one
+    pc.parcel(outfile=str_c, checkpoint_file=str_k, z_max=60., checkpoint=300, **opts)
+    shutil.copy(str_c, str_1)
+    shutil.copy(str_k, str_1k)
+    pc.parcel(outfile=str_c, checkpoint_file=str_k, restart=True, z_max=120., checkpoint=200, **opts)
+    pc.parcel(outfile=str_c, checkpoint_file=str_k, restart=True, z_max=200., checkpoint=200, **opts)
+
+    # the same checkpoints with one restart
+    pc.parcel(outfile=str_1, checkpoint_file=str_1k, restart=True, z_max=200., checkpoint=200, **opts)
+
+    f_once  = netcdf.netcdf_file(str_1, "r")
+    f_twice = netcdf.netcdf_file(str_c, "r")
+    assert f_twice.chem_calls == f_once.chem_calls
+    for var in f_once.variables:
+        assert f_once.variables[var].shape == f_twice.variables[var].shape, var
+        assert np.isclose(f_once.variables[var][:], f_twice.variables[var][:], atol=0, rtol=1e-10).all(), var
@@ -0,0 +1,95 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from scipy.io import netcdf
+import numpy as np
+import pytest
+import copy
+
+import parcel as pc
+from parcel import parcel
+from chem_conditions import parcel_dict
+
+"""
+checking if switching chemistry on only close to saturation gives the same
+sulfate production as running chemistry in all timesteps
+"""
+
+def chem_dict():
+    p_dict = copy.deepcopy(parcel_dict)
+    p_dict['chem_dsl'] = True
+    p_dict['chem_dsc'] = True
+    p_dict['chem_rct'] = True
+    p_dict['z_max'] = 400
+    p_dict['outfreq'] = 400
+    p_dict['out_bin'] = '{"chem": {"rght": 1, "left": 0, "drwt": "dry", "lnli": "lin", "nbin": 1, "moms": ["S_VI"]}}'
+    return p_dict
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("chem_gate")
+    p_dict = chem_dict()
+    data = {}
+    for name, gate, auto in [("all", '{}', '{}'), ("gate", '{"RH": 0.99}', '{}'), ("gate_auto", '{"RH": 0.99}', '{"chem_max": 8}')]:
+        p_dict['outfile'] = str(tmp.join("test_" + name + ".nc"))
+        parcel(chem_gate=gate, sstp_auto=auto, **p_dict)
+        data[name] = netcdf.netcdf_file(p_dict['outfile'], "r")
+    return data
+
+@pytest.mark.parametrize("name", ["gate", "gate_auto"])
+def test_chem_gate_S6(data, name, eps=1e-2):
+    """ checking if the production of S6 differs by less than eps """
+    dS6 = dict((name, f.variables["chem_S_VI"][-1, 0] - f.variables["chem_S_VI"][0, 0]) for name, f in data.items())
+    assert np.isclose(dS6[name], dS6["all"], atol=0, rtol=eps)
+
+def test_chem_gate_attrs(data):
+    """ checking if the timesteps without chemistry are reported """
+    assert data["gate"].chem_gate_steps > 0
+    assert data["gate"].chem_gate_t > 0
+    assert data["gate"].chem_gate_time_saved >= 0
+    assert "chem_gate_steps" not in data["all"]._attributes
+
+def test_chem_gate_sstp_auto(data):
+    """ checking if chemistry calls skipped by the gate are not counted with sstp_auto """
+    p_dict = chem_dict()
+    f = data["gate_auto"]
+    n_on = int(round((p_dict['z_max'] / p_dict['w'] - f.chem_gate_t) / p_dict['dt'])) + 1
+    assert f.chem_gate_t > 0
+    assert 0 < f.chem_calls <= n_on
+
+def test_chem_gate_steps_sstp_auto(data, chem_max=8):
+    """ checking if chem_gate_steps counts timesteps (not chemistry calls) skipped by the gate with sstp_auto """
+    p_dict = chem_dict()
+    f = data["gate_auto"]
+    n_t = int(round(f.chem_gate_t / p_dict['dt']))
+    assert n_t - chem_max <= f.chem_gate_steps < n_t
+
+def test_chem_gate_LWC_every(tmpdir, monkeypatch, every=5):
+    """ checking if LWC is diagnosed only every few timesteps and not after chemistry is switched on """
+    calls = []
+    lwc = pc._lwc
+    monkeypatch.setattr(pc, "_lwc", lambda micro: calls.append(micro) or lwc(micro))
+    p_dict = chem_dict()
+    p_dict['outfile'] = str(tmpdir.join("test_LWC.nc"))
+    parcel(chem_gate='{"LWC": 1e-10, "every": ' + str(every) + '}', **p_dict)
+
+    f = netcdf.netcdf_file(p_dict['outfile'], "r")
+    n_off = f.chem_gate_steps
+    assert f.chem_gate_t > 0
+    assert (n_off + 1) % every == 0
+    assert np.isclose(f.chem_gate_t, (n_off + 1) * p_dict['dt'])
+    assert len(calls) == (n_off + 1) // every
+
+def test_chem_gate_wait(tmpdir, monkeypatch, wait=50, after=10):
+    """ checking if the chem_gate opening in the wait phase is reported """
+    p_dict = chem_dict()
+    nt = int(p_dict['z_max'] / (p_dict['w'] * p_dict['dt']))
+    calls = []
+    monkeypatch.setattr(pc, "_lwc", lambda micro: calls.append(micro) or (1. if len(calls) >= nt + after else 0.))
+    p_dict['outfile'] = str(tmpdir.join("test_wait.nc"))
+    parcel(chem_gate='{"LWC": 1e-10, "every": 1}', wait=wait, **p_dict)
+
+    f = netcdf.netcdf_file(p_dict['outfile'], "r")
+    assert np.isclose(f.chem_gate_t, (nt + after) * p_dict['dt'])
+    assert f.chem_gate_steps == nt + after - 1
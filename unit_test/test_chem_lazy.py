@@ -0,0 +1,27 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+from parcel import parcel
+
+"""
+checking if the aqueous chemistry state computed only at output timesteps
+is the same as the one computed every timestep
+"""
+
+opts = {"z_max" : 20, "chem_dsl" : True, "chem_dsc" : True, "chem_rct" : True,
+        "SO2_g" : 200e-12, "O3_g" : 50e-9, "H2O2_g" : 500e-12, "CO2_g" : 360e-6, "NH3_g" : 100e-12, "HNO3_g" : 100e-12}
+
+@pytest.mark.parametrize("outfreq", [10, 50])
+def test_chem_lazy(tmpdir, outfreq):
+    str_1 = str(tmpdir.join("test_every.nc"))
+    parcel(outfreq=1, outfile=str_1, **opts)
+    str_n = str(tmpdir.join("test_lazy.nc"))
+    parcel(outfreq=outfreq, outfile=str_n, **opts)
+
+    with netcdf.netcdf_file(str_1, "r", mmap=False) as f_1, netcdf.netcdf_file(str_n, "r", mmap=False) as f_n:
+        for var in ["SO2_a", "O3_a", "H2O2_a", "CO2_a", "HNO3_a", "NH3_a"]:
+            assert np.array_equal(f_n.variables[var][:], f_1.variables[var][::outfreq])
@@ -0,0 +1,20 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+import numpy as np
+
+import parcel as pc
+
+distro = pc.sum_of_lognormals([pc.lognormal(2e-8, 1.4, 60e6), pc.lognormal(7.5e-8, 1.6, 40e6)])
+lnr = np.linspace(np.log(1e-9), np.log(1e-6), 101)
+
+def test_lognormal_array():
+  """ checking if the size distribution gives the same values for floats and arrays """
+  assert np.allclose(distro(lnr), [distro(float(x)) for x in lnr], rtol=1e-12)
+
+def test_tabulated():
+  """ checking if the tabulated size distribution is close to the exact one and zero outside the table """
+  tab = pc.tabulated(distro)
+  assert np.allclose([tab(float(x)) for x in lnr], distro(lnr), rtol=1e-4, atol=1e-6 * distro(lnr).max())
+  assert np.allclose(tab(lnr), [tab(float(x)) for x in lnr], rtol=1e-10, atol=1e-12 * distro(lnr).max())
+  assert tab(np.log(1e-11)) == 0 and tab(np.log(1e-2)) == 0
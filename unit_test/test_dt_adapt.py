@@ -0,0 +1,51 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import parcel
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+"""
+checking the behaviour of adaptive timestepping in a short run
+(the comparison with a run with a small constant timestep is in long_test/test_dt_adapt.py)
+"""
+
+opts = {"dt" : .1, "outfreq" : 20, "z_max" : 20., "RH_0" : .99, "T_0" : 280., "sd_conc" : 64}
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("dt_adapt")
+    data = {}
+    for name, adapt in [("const", None),
+                        ("tight", '{"dt_min": 1e-2, "dt_max": 1, "RH_tol": 1e-4, "N_tol": 1e-4}'),
+                        ("loose", '{"dt_min": 1e-2, "dt_max": 1, "RH_tol": 1e3, "N_tol": 1e3}'),
+                        ("no_N", '{"dt_min": 1e-2, "dt_max": 1, "RH_tol": 1e-4, "N_tol": 0}')]:
+        outfile = str(tmp.join("test_" + name + ".nc"))
+        if adapt is None:
+            parcel(outfile=outfile, **opts)
+        else:
+            parcel(outfile=outfile, dt_adapt=adapt, **opts)
+        data[name] = netcdf.netcdf_file(outfile, "r")
+    return data
+
+@pytest.mark.parametrize("name", ["tight", "loose", "no_N"])
+def test_dt_adapt_output_times(data, name):
+    """ checking if the output is saved at the same times and heights as without adaptive timestepping """
+    assert np.isclose(data[name].variables["t"][:], data["const"].variables["t"][:], atol=1e-9, rtol=0).all()
+    assert np.isclose(data[name].variables["z"][:], data["const"].variables["z"][:], atol=1e-6, rtol=0).all()
+
+@pytest.mark.parametrize("name", ["tight", "loose"])
+def test_dt_adapt_limits(data, name):
+    """ checking if the timesteps are not longer than dt_max (the steps shortened to hit the output times may be shorter than dt_min) """
+    assert 0 < data[name].dt_adapt_min <= data[name].dt_adapt_max <= 1 * (1 + 1e-6)
+
+def test_dt_adapt_steps(data):
+    """ checking if the number of timesteps goes down with the tolerances """
+    n_steps = int(opts["z_max"] / opts["dt"])
+    assert data["loose"].dt_adapt_steps < data["tight"].dt_adapt_steps
+    assert data["loose"].dt_adapt_steps < n_steps / 5
+
+def test_dt_adapt_no_N(data):
+    """ checking if the timesteps are limited by RH only with N_tol = 0 """
+    assert data["no_N"].dt_adapt_steps <= data["tight"].dt_adapt_steps
@@ -0,0 +1,60 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import parcel
+from parcel_ensemble import parcel_ensemble
+from scipy.io import netcdf
+import numpy as np
+import json
+import pytest
+
+"""
+checking if members run in processes by the ensemble runner give the same results
+as the same simulations run one after another with parcel()
+"""
+
+members = [
+  {"w" : .5},
+  {"w" : 1., "pprof" : "pprof_const_th_rv"},
+  {"w" : 2., "chem_dsl" : True, "SO2_g" : 2e-10},
+  {"w" : 1., "sd_alloc" : '{"act": 1}'}
+]
+
+def test_ensemble(tmpdir):
+    for i, member in enumerate(members):
+        member["outfile"] = str(tmpdir.join("test_ensemble_" + str(i) + ".nc"))
+    common_opts = dict(RH_0 = .99, outfreq = 50, z_max = 100.)
+
+    report = parcel_ensemble(members = json.dumps(members), processes = 3, **common_opts)
+    assert report["members"] == len(members)
+
+    for i, member in enumerate(members):
+        opts = dict(common_opts)
+        opts.update(member)
+        opts["outfile"] = str(tmpdir.join("test_single_" + str(i) + ".nc"))
+        parcel(**opts)
+        single = netcdf.netcdf_file(opts["outfile"], "r")
+        ens = netcdf.netcdf_file(member["outfile"], "r")
+        for var in single.variables:
+            assert np.array_equal(single.variables[var][:], ens.variables[var][:])
+        single.close()
+        ens.close()
+
+@pytest.mark.parametrize("arg", [
+    {"members" : '[{"outfile" : "a.nc"}, {"outfile" : "a.nc"}]'},
+    {"members" : '[{"aqq" : 1}]'},
+    {"members" : '[]'}
+])
+def test_ensemble_args(arg):
+    """ checking if the ensemble runner rises exceptions when arguments don't make sense """
+    with pytest.raises(Exception):
+        parcel_ensemble(**arg)
+
+def test_ensemble_error(tmpdir):
+    """ checking if a failing member is reported without stopping the others """
+    ok = str(tmpdir.join("ok.nc"))
+    with pytest.raises(Exception) as excinfo:
+        parcel_ensemble(members = json.dumps([{"outfile" : ok}, {"outfile" : str(tmpdir.join("bad.nc")), "T_0" : 200.}]),
+                        z_max = 20.)
+    assert "bad.nc" in str(excinfo.value) and "ok.nc" not in str(excinfo.value)
+    netcdf.netcdf_file(ok, "r").close()
@@ -0,0 +1,70 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+import parcel as pc
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+"""
+checking if the analytic fast-forward through the sub-saturated part of the ascent
+gives the same results as the simulation with libcloudph++ called every timestep
+"""
+
+opts = {"RH_0" : .8, "T_0" : 290., "p_0" : 100000., "z_max" : 600., "dt" : .1, "outfreq" : 200, "sd_conc" : 256,
+        "out_bin" : '{"radii": {"rght": 1, "moms": [0, 3], "drwt": "wet", "nbin": 1, "lnli": "lin", "left": 1e-06},\
+                      "dry": {"rght": 1, "moms": [0], "drwt": "dry", "nbin": 1, "lnli": "lin", "left": 0}}'}
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("fast_forward")
+    data = {}
+    for name, ff_RH in [("ref", 0.), ("ff", .97)]:
+        str_f = str(tmp.join("test_" + name + ".nc"))
+        pc.parcel(outfile=str_f, ff_RH=ff_RH, **opts)
+        data[name] = netcdf.netcdf_file(str_f, "r")
+    return data
+
+def test_ff_steps(data):
+    """ checking if the sub-saturated part of the ascent was fast-forwarded """
+    assert data["ff"].ff_steps > 0
+    assert np.isclose(data["ff"].ff_t, data["ff"].dt * (data["ff"].ff_steps + 1))
+
+def test_ff_output(data, eps=1e-3):
+    """ checking if the output (also for fast-forwarded records) agrees with the reference """
+    f_ff, f_ref = data["ff"], data["ref"]
+    assert np.isclose(f_ff.RH_max, f_ref.RH_max, atol=0, rtol=eps)
+    for var in ["t", "z", "th_d", "T", "p", "r_v", "rhod", "RH", "dry_m0"]:
+        assert np.isclose(f_ff.variables[var][:], f_ref.variables[var][:], atol=0, rtol=eps).all(), var
+    for var in ["radii_m0", "radii_m3"]:
+        assert np.isclose(f_ff.variables[var][-1], f_ref.variables[var][-1], atol=0, rtol=1e-2).all(), var
+
+def test_ff_init(tmpdir, monkeypatch):
+    """ checking if the super-droplets are re-initialised only once, at the end of the fast-forward """
+    calls = []
+    micro_init = pc._micro_init
+    monkeypatch.setattr(pc, "_micro_init", lambda *args, **kwargs: calls.append(args[2]["t"]) or micro_init(*args, **kwargs))
+    str_f = str(tmpdir.join("test_init.nc"))
+    pc.parcel(outfile=str_f, ff_RH=.97, **opts)
+    f = netcdf.netcdf_file(str_f, "r")
+    assert f.ff_steps > opts["outfreq"]
+    assert len(calls) == 2
+    assert np.isclose(calls, [0, f.ff_t]).all()
+
+def test_ff_saturation(tmpdir, monkeypatch):
+    """ checking if the fast-forward ending with RH crossing saturation within one timestep
+        initialises the super-droplets below saturation and rebuilds the step plan for them """
+    inits, plans = [], []
+    micro_init, step_plan = pc._micro_init, pc._step_plan
+    def init(*args, **kwargs):
+      inits.append(micro_init(*args, **kwargs))
+      return inits[-1]
+    monkeypatch.setattr(pc, "_micro_init", init)
+    monkeypatch.setattr(pc, "_step_plan", lambda micro, *args: plans.append(micro) or step_plan(micro, *args))
+    str_f = str(tmpdir.join("test_saturation.nc"))
+    pc.parcel(outfile=str_f, ff_RH=.99999, **dict(opts, dt=1., outfreq=20))
+    f = netcdf.netcdf_file(str_f, "r")
+    assert len(inits) == 2
+    assert plans[-1] is inits[-1]
+    assert f.ff_t <= f.dt * (f.ff_steps + 1)
+    assert f.RH_max > 1
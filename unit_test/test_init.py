@@ -19,6 +19,35 @@ def test_supersat(tmpdir):
 @pytest.mark.parametrize("arg",[{"T_0" : 255},
                                 {"RH_0": 1.00001},
                                 {"w" : -1},
+                                {"backend" : "aqq"},
+                                {"dt_adapt" : '{"aqq": 1}'},
+                                {"dt_adapt" : '{"dt_min": 0}'},
+                                {"dt_adapt" : '{"dt_min": 1, "dt_max": 0.1}'},
+                                {"stop" : '{"aqq": 1}'},
+                                {"stop" : '{"z": -1}'},
+                                {"checkpoint" : -1},
+                                {"ff_RH" : 1.},
+                                {"sstp_auto" : '{"aqq": 1}'},
+                                {"pprof" : "aqq"},
+                                {"chem_gate" : '{"aqq": 1}'},
+                                {"chem_gate" : '{"RH": -1}'},
+                                {"chem_gate" : '{"LWC": 1e-6, "every": 0.5}'},
+                                {"chem_gate" : '{"every": 5}'},
+                                {"scheme" : "aqq"},
+                                {"scheme" : "blk_2m", "chem_dsl" : True},
+                                {"sd_alloc" : '{"aqq": 1}'},
+                                {"sd_alloc" : '{"modes": {"ammonium_sulfate": [1, 2]}}'},
+                                {"sd_alloc" : '{"tail": 1}', "large_tail" : True},
+                                {"sd_alloc" : '{"sampling": "aqq"}'},
+                                {"sd_adapt" : '{"RH": 1.01}'},
+                                {"sd_adapt" : '{"aqq": 1}'},
+                                {"aerosol" : '{"ammonium_sulfate": {"kappa": 0.61, "file": "aqq.csv", "dist": "aqq"}}'},
+                                {"sd_adapt" : '{"sd_conc": 64}', "chem_dsl" : True},
+                                {"sd_alloc" : '{"sampling": "stratified", "seed": -1}'},
+                                {"sstp_auto" : '{"cond_max": 1.5}'},
+                                {"sstp_auto" : '{"RH_tol": 1e-4}', "dt_adapt" : '{"dt_min": 0.01}'},
+                                {"ff_RH" : .9, "chem_dsl" : True},
+                                {"checkpoint" : 10, "dt_adapt" : '{"dt_min": 0.01}'},
                                 {"aerosol" : '{"zero_kappa": {"kappa" : 0., "mean_r": [2e-8], "gstdev": [1.2], "n_tot": [60e6]}}'},
                                 {"aerosol" : '{"unity_gstdev": {"kappa" : 0.61, "mean_r": [2e-8], "gstdev": [1.], "n_tot": [60e6]}}'},
                                 {"out_bin" : '{"radii": {"moms": [0], "drwt": "wet", "nbin": 26, "lnli": "log", "left": 1e-09}}'},
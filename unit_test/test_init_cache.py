@@ -0,0 +1,71 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from scipy.io import netcdf
+import numpy as np
+import json
+import os
+import pytest
+
+import parcel as pc
+
+"""
+checking if the SD placements taken from the init cache give the same runs as the ones computed again
+"""
+
+aerosol = {"ammonium_sulfate": {"kappa": 0.61, "mean_r": [2e-8, 1e-7], "gstdev": [1.4, 1.6], "n_tot": [60e6, 10e6]}}
+opts = {"z_max" : 20., "outfreq" : 10, "sd_conc" : 256, "aerosol" : json.dumps(aerosol), "sd_alloc" : '{"act": 1}'}
+
+def run(outfile, init_cache):
+  pc.parcel(outfile = outfile, init_cache = init_cache, **opts)
+  f = netcdf.netcdf_file(outfile, "r", mmap=False)
+  out = dict((var, f.variables[var][:].copy()) for var in ["th_d", "r_v", "radii_m0"])
+  lookup = f.init_cache
+  f.close()
+  return out, lookup
+
+def test_init_cache(tmpdir):
+  """ checking if the placement is taken from memory and from disk and gives the same output """
+  cache = json.dumps({"dir": str(tmpdir.join("cache"))})
+  pc._init_cache.clear()
+  out = {}
+  for name in ["miss", "memory", "disk"]:
+    if name == "disk":
+      pc._init_cache.clear()
+    out[name], lookup = run(str(tmpdir.join("test_" + name + ".nc")), cache)
+    assert lookup == name.encode()
+  for name in ["memory", "disk"]:
+    for var in out["miss"]:
+      assert np.array_equal(out[name][var], out["miss"][var]), var
+
+def test_init_cache_key(tmpdir):
+  """ checking if placements with any input changed are not taken from the cache """
+  cache = '{"max_mb": 64}'
+  pc._init_cache.clear()
+  alloc = {"act": 1}
+  first = pc._dry_sizes(aerosol, dict(opts, init_cache=cache), alloc, 293., {})
+  for sd_conc, T, alloc_2 in [(128, 293., alloc), (256, 290., alloc), (256, 293., {"act": 2})]:
+    info = {}
+    sizes = pc._dry_sizes(aerosol, dict(opts, init_cache=cache, sd_conc=sd_conc), alloc_2, T, info)
+    assert info["init_cache"] == "miss" and sizes != first
+
+@pytest.mark.parametrize("alloc", [{"sampling": "stratified"}, {"sampling": "quasi"}])
+def test_init_cache_random(alloc):
+  """ checking if random placements without a seed are not cached """
+  pc._init_cache.clear()
+  info = {}
+  for _ in range(2):
+    pc._dry_sizes(aerosol, dict(opts, init_cache='{"max_mb": 64}'), alloc, 293., info)
+  assert "init_cache" not in info and len(pc._init_cache) == 0
+
+def test_init_cache_evict(tmpdir, n=4):
+  """ checking if the least recently used placements are removed above max_mb """
+  path = str(tmpdir.join("cache"))
+  pc._init_cache.clear()
+  info = {}
+  size = len(pc.pickle.dumps(pc._dry_sizes(aerosol, dict(opts, init_cache='{}'), {"act": 1}, 293., info)))
+  cache = json.dumps({"dir": path, "max_mb": 2.5 * size / 2**20})
+  for i in range(n):
+    pc._dry_sizes(aerosol, dict(opts, init_cache=cache), {"act": 1 + i}, 293., info)
+  assert len(pc._init_cache) == 2
+  assert len(os.listdir(path)) == 2
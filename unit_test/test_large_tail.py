@@ -0,0 +1,57 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from scipy.io import netcdf as nc
+import subprocess
+import pytest
+
+import parcel as pc
+
+# checking if the space for the large tail SDs is sized to the spectrum and not to a fixed value
+def test_large_tail_n_sd_max():
+  outfile = "test_large_tail.nc"
+  pc.parcel(outfile = outfile, sd_conc = 64, large_tail = True, z_max = 20.)
+  f = nc.netcdf_file(outfile)
+
+  assert(f.n_sd_max < 1e6)
+  assert(64 < f.sd_peak <= f.n_sd_max)
+
+  f.close()
+  subprocess.call(["rm", outfile])
+
+# checking if n_sd_max is increased if the estimate was too low
+def test_large_tail_grow(monkeypatch):
+  monkeypatch.setattr(pc, "_n_sd_tail", lambda dry_distros, sd_conc: 0)
+
+  outfile = "test_large_tail.nc"
+  pc.parcel(outfile = outfile, sd_conc = 64, large_tail = True, z_max = 20.)
+  f = nc.netcdf_file(outfile)
+
+  assert(64 < f.sd_peak <= f.n_sd_max)
+
+  f.close()
+  subprocess.call(["rm", outfile])
+
+# checking if the model without the large tail is not affected
+def test_large_tail_off():
+  outfile = "test_large_tail.nc"
+  pc.parcel(outfile = outfile, sd_conc = 64, z_max = 20.)
+  f = nc.netcdf_file(outfile)
+
+  assert(not hasattr(f, "sd_peak"))
+
+  f.close()
+  subprocess.call(["rm", outfile])
+
+# checking if other errors of the initialisation are not retried with larger n_sd_max
+def test_large_tail_other_error(monkeypatch):
+  class failing(object):
+    def init(self, *args, **kwargs):
+      raise RuntimeError("not n_sd related")
+  calls = []
+  monkeypatch.setattr(pc, "_micro_factory", lambda opts_init, opts, info: calls.append(opts_init.n_sd_max) or failing())
+
+  with pytest.raises(RuntimeError, match="not n_sd related"):
+    pc.parcel(outfile = "test_large_tail.nc", sd_conc = 64, large_tail = True, z_max = 20.)
+  assert(len(calls) == 1)
+  subprocess.call(["rm", "-f", "test_large_tail.nc"])
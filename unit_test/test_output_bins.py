@@ -0,0 +1,53 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+import numpy as np
+import json
+import pytest
+
+import parcel as pc
+
+spectra = {
+  "wet"  : {"rght": 1e-4, "left": 1e-9, "drwt": "wet", "lnli": "log", "nbin": 26, "moms": [0, 1, 3]},
+  "dry"  : {"rght": 1e-6, "left": 1e-9, "drwt": "dry", "lnli": "lin", "nbin": 10, "moms": [0, "S_VI"]}
+}
+
+def output_bins_ref(fout, t, micro, opts, spectra):
+  # spectra diagnosed and written bin by bin (as before the bulk output)
+  for dim, dct in spectra.items():
+    for bin in range(dct["nbin"]):
+      r = fout.variables[dim+"_r_"+dct["drwt"]][bin]
+      dr = fout.variables[dim+"_dr_"+dct["drwt"]][bin]
+      if dct["drwt"] == 'wet':
+        micro.diag_wet_rng(r, r + dr)
+      else:
+        micro.diag_dry_rng(r, r + dr)
+      for vm in dct["moms"]:
+        if type(vm) == int:
+          if dct["drwt"] == 'wet':
+            micro.diag_wet_mom(vm)
+          else:
+            micro.diag_dry_mom(vm)
+          fout.variables[dim+'_m'+str(vm)][int(t), ..., int(bin)] = np.frombuffer(micro.outbuf())
+        else:
+          micro.diag_chem(pc._Chem_a_id[vm])
+          fout.variables[dim+'_'+vm][int(t), ..., int(bin)] = np.frombuffer(micro.outbuf())
+
+@pytest.mark.parametrize("nx", [0, 3])
+def test_output_bins(tmpdir, nx):
+  """ checking if the spectra written at once are the same as written bin by bin """
+  opts = pc._default_opts()
+  opts.update(chem_dsl = True, RH_0 = .95)
+  state, _ = pc._state_init(dict(opts, r_0 = pc._r_0(opts)), nx)
+  micro = pc._micro_init(json.loads(opts["aerosol"]), opts, state, {"RH_max" : 0}, nx=nx)
+
+  out = []
+  for name, output_bins in [("ref", output_bins_ref), ("bulk", pc._output_bins)]:
+    fout = pc._output_init(micro, dict(opts, outfile = str(tmpdir.join(name + ".nc"))), spectra)
+    for rec in range(2):
+      output_bins(fout, rec, micro, opts, spectra)
+    out.append(dict((v, fout.variables[v][:].copy()) for v in fout.variables))
+    fout.close()
+
+  for v in out[0]:
+    assert np.array_equal(out[0][v], out[1][v])
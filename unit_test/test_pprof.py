@@ -0,0 +1,73 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import pprofs, _heights, _p_hydro_const_rho, _p_hydro_const_th_rv
+from libcloudphxx import common
+import numpy as np
+import pytest
+
+"""
+checking if the precomputed pressure profiles give the same pressure and dry air density
+as the per-timestep formulas used before (for a single parcel and for a batch)
+"""
+
+T_0, p_0, r_0, dt = 300., 101300., .022, .1
+th_0 = T_0 * (common.p_1000 / p_0)**(common.R_d / common.c_pd)
+
+def pressure_ref(pprof, z, dz, p, th_d, r_v, rhod):
+    # pressure and dry air density at height z reached after displacement dz (as computed in each timestep before)
+    if pprof == "pprof_const_th_rv":
+        p_hydro = _p_hydro_const_th_rv(z, p_0, th_0, r_0)
+        rhod = common.rhod(p_hydro, th_0, r_0)
+        return common.p(rhod, r_v, common.T(th_d, rhod)), rhod
+    if pprof == "pprof_const_rhod":
+        p = _p_hydro_const_rho(z, p_0, 1.13)
+    elif pprof == "pprof_piecewise_const_rhod":
+        p = _p_hydro_const_rho(dz, p, rhod)
+    return p, common.rhod(p, common.th_dry2std(th_d, r_v), r_v)
+
+def ascent_ref(pprof, w, nt):
+    # p and rhod along the ascent with heights accumulated in each timestep (as in the timestepping loop before)
+    th_d, r_v = common.th_std2dry(th_0, r_0), r_0
+    z, p, rhod = 0, p_0, common.rhod(p_0, th_0, r_0)
+    out = []
+    for it in range(1, nt + 1):
+        z += w * dt
+        p, rhod = pressure_ref(pprof, z, w * dt, p, th_d, r_v, rhod)
+        out.append((p, rhod))
+    return np.array(out)
+
+def ascent(prof, w, nt):
+    # p and rhod along the ascent with constant th_d and r_v
+    th_d, r_v = common.th_std2dry(th_0, r_0), r_0
+    p, rhod = p_0, common.rhod(p_0, th_0, r_0)
+    out = []
+    for it in range(1, nt + 1):
+        p, rhod = prof(it, w * dt, p, th_d, r_v, rhod)
+        out.append((p, rhod))
+    return np.array(out)
+
+@pytest.mark.parametrize("pprof", list(pprofs.keys()))
+def test_pprof_precomputed(pprof, nt=100, w=1.):
+    """ checking if the precomputed profile is the same as the per-timestep formulas """
+    z = _heights(nt, w, dt)
+    assert np.array_equal(ascent(pprofs[pprof](z, p_0, th_0, r_0), w, nt), ascent_ref(pprof, w, nt))
+
+@pytest.mark.parametrize("pprof", list(pprofs.keys()))
+def test_pprof_batch(pprof):
+    """ checking if the profile precomputed for a batch of parcels is the same as for each parcel """
+    w, nt = np.array([.5, 1., 2.]), np.array([40, 20, 10])
+    prof = pprofs[pprof](_heights(nt, w, dt), p_0, th_0, r_0)
+    for i in range(w.size):
+        single = pprofs[pprof](_heights(nt[i], w[i], dt), p_0, th_0, r_0)
+        assert np.array_equal(ascent(lambda it, *args: prof((it, i), *args), w[i], nt[i]), ascent(single, w[i], nt[i]))
+
+@pytest.mark.parametrize("pprof", list(pprofs.keys()))
+def test_pprof_levels(pprof, nt=100, w=1.):
+    """ checking if the profile evaluated at one height at a time (as with dt_adapt) is the same as the precomputed one """
+    prof = pprofs[pprof](0., p_0, th_0, r_0)
+    z = _heights(nt, w, dt)
+    def single(it, *args):
+        prof.levels(z[it])
+        return prof((), *args)
+    assert np.array_equal(ascent(single, w, nt), ascent(pprofs[pprof](z, p_0, th_0, r_0), w, nt))
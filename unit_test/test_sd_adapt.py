@@ -0,0 +1,38 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from scipy.io import netcdf as nc
+import numpy as np
+import subprocess
+
+import parcel as pc
+
+out_bin = '{"dry": {"rght": 1, "left": 0, "drwt": "dry", "lnli": "lin", "nbin": 1, "moms": [0, 3]},\
+            "wet": {"rght": 1, "left": 0, "drwt": "wet", "lnli": "lin", "nbin": 1, "moms": [0, 3]}}'
+
+def test_sd_adapt():
+  """ checking if the SDs are re-allocated below saturation with the aerosol conserved """
+  outfile = "test_sd_adapt.nc"
+  pc.parcel(outfile = outfile, dt = .5, z_max = 200., outfreq = 20, RH_0 = .95, T_0 = 300., sd_conc = 32,
+            sd_adapt = '{"RH": 0.98, "sd_conc": 128}', out_bin = out_bin)
+  f = nc.netcdf_file(outfile)
+
+  # re-allocated once, before saturation, within the SD budget
+  RH = f.variables["RH"][:]
+  t = f.variables["t"][:]
+  assert 0 < f.sd_adapt_t <= t[-1]
+  assert RH[t < f.sd_adapt_t].max() < .98
+  assert 0 < f.sd_adapt_n_sd <= 128
+
+  # concentration of aerosol and its dry mass conserved
+  for mom in ["dry_m0", "wet_m0"]:
+    assert np.allclose(f.variables[mom][:, 0], f.variables[mom][0, 0], rtol=1e-2)
+  assert np.allclose(f.variables["dry_m3"][:, 0], f.variables["dry_m3"][0, 0], rtol=.1)
+
+  # total water (vapour and liquid) conserved across the re-allocation
+  assert f.sd_adapt_water_before > 0 and f.sd_adapt_water_after > 0
+  water = f.variables["r_v"][:] + 4./3 * np.pi * pc.common.rho_w * (f.variables["wet_m3"][:, 0] - f.variables["dry_m3"][:, 0])
+  assert np.allclose(water, water[0], atol=0, rtol=1e-5)
+
+  f.close()
+  subprocess.call(["rm", outfile])
@@ -0,0 +1,111 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from scipy.io import netcdf as nc
+import numpy as np
+import subprocess
+import json
+import pytest
+
+import parcel as pc
+
+aerosol = {"kappa": 0.61, "mean_r": [2e-8, 1e-7], "gstdev": [1.4, 1.6], "n_tot": [60e6, 10e6]}
+
+def sizes(alloc, sd_conc = 64):
+  dry_sizes = pc._sd_alloc("ammonium_sulfate", aerosol, alloc, sd_conc, 293.)
+  return np.array(list(dry_sizes.keys())), np.array([c for c, n in dry_sizes.values()])
+
+@pytest.mark.parametrize("alloc", [{}, {"act": 1}, {"tail": 1}, {"modes": {"ammonium_sulfate": [1, 4]}}])
+def test_sd_alloc_conc(alloc):
+  """ checking if the SDs represent the whole aerosol concentration whatever the weights """
+  r, conc = sizes(alloc)
+  assert len(r) == 64
+  assert np.isclose(conc.sum(), sum(aerosol["n_tot"]), rtol=1e-6)
+
+@pytest.mark.parametrize("sd_conc", [4096, 16384])
+@pytest.mark.parametrize("alloc", [{}, {"act": 1}, {"modes": {"ammonium_sulfate": [1, 3]}}])
+def test_sd_alloc_n_sd(alloc, sd_conc):
+  """ checking if the midpoint placement gives sd_conc distinct SDs also for many SDs per aerosol mode """
+  r, conc = sizes(alloc, sd_conc)
+  assert len(r) == sd_conc
+  assert np.isclose(conc.sum(), sum(aerosol["n_tot"]), rtol=1e-6)
+
+@pytest.mark.parametrize("sampling", ["stratified", "quasi"])
+def test_sd_alloc_seed(sampling):
+  """ checking if the random placement is reproducible with a seed and converges with sd_conc """
+  r_0, conc_0 = sizes({"sampling": sampling, "seed": 1})
+  r_1, conc_1 = sizes({"sampling": sampling, "seed": 1})
+  r_2, conc_2 = sizes({"sampling": sampling, "seed": 2})
+  assert np.array_equal(r_0, r_1) and np.array_equal(conc_0, conc_1)
+  assert not np.array_equal(r_0, r_2)
+
+  err = [abs(sizes({"sampling": sampling, "seed": 1}, n)[1].sum() / sum(aerosol["n_tot"]) - 1) for n in [16, 1024]]
+  assert err[1] < err[0] and err[1] < 1e-2
+
+def test_sd_alloc_act():
+  """ checking if more SDs are placed around the activation radius with the act weight """
+  A = 2 * pc._sd_alloc_sgm_w / pc.common.rho_w / pc.common.R_v / 293.
+  r_act = (4 * A**3 / 27 / aerosol["kappa"] / pc._sd_alloc_dflt["S_act"]**2)**(1./3)
+  n_act = lambda r: np.sum((r > r_act / 1.5) & (r < r_act * 1.5))
+  assert n_act(sizes({"act": 1})[0]) > n_act(sizes({})[0])
+
+def test_sd_alloc_tail():
+  """ checking if the tail weight extends the SDs to larger radii """
+  assert sizes({"tail": .5})[0].max() > sizes({})[0].max()
+
+@pytest.mark.parametrize("alloc", [{}, {"act": 1}, {"tail": 1}, {"modes": {"ammonium_sulfate": [1, 4]}}])
+def test_sd_alloc_mass(alloc):
+  """ checking if the midpoint placement preserves the dry mass whatever the weights """
+  mass = sum(n * r**3 * np.exp(4.5 * np.log(g)**2) for r, g, n in zip(aerosol["mean_r"], aerosol["gstdev"], aerosol["n_tot"]))
+  r, conc = sizes(alloc)
+  assert np.isclose((conc * r**3).sum(), mass, atol=0, rtol=1e-6)
+
+def test_sd_alloc_seed_only():
+  """ checking if the seed alone keeps the default placement of libcloudph++ """
+  opts = dict(pc._default_opts(), sd_alloc = '{"seed": 3}')
+  state, _ = pc._state_init(dict(opts, r_0 = pc._r_0(opts)))
+  micro = pc._micro_init(json.loads(opts["aerosol"]), opts, state, {"RH_max" : 0})
+  assert micro.opts_init.rng_seed == 3
+  assert micro.opts_init.dry_sizes == {} and micro.opts_init.dry_distros
+
+def moments(sd_conc, alloc):
+  # concentration and third moment of the dry spectrum after initialisation
+  opts = dict(pc._default_opts(), sd_conc = sd_conc, sd_alloc = json.dumps(alloc))
+  state, _ = pc._state_init(dict(opts, r_0 = pc._r_0(opts)))
+  micro = pc._micro_init({"ammonium_sulfate": aerosol}, opts, state, {"RH_max" : 0})
+  micro.diag_all()
+  mom = []
+  for k in [0, 3]:
+    micro.diag_dry_mom(k)
+    mom.append(np.frombuffer(micro.outbuf())[0])
+  return np.array(mom)
+
+@pytest.mark.parametrize("alloc", [{"sampling": "midpoint"}, {"act": 1}])
+def test_sd_alloc_vs_default(alloc, sd_conc = 64):
+  """ checking if the concentration and dry mass at small sd_conc are as accurate as with the default placement """
+  ref = moments(4096, {})
+  err_dflt = abs(moments(sd_conc, {}) / ref - 1)
+  err_alloc = abs(moments(sd_conc, alloc) / ref - 1)
+  assert (err_alloc <= np.maximum(err_dflt, 1e-2)).all()
+
+def test_sd_alloc_parcel():
+  """ checking if parcel with the SDs placed by sd_alloc starts with the same aerosol concentration """
+  out_bin = '{"dry": {"rght": 1, "left": 0, "drwt": "dry", "lnli": "lin", "nbin": 1, "moms": [0]}}'
+  m0 = []
+  for alloc in ['{}', '{"act": 1, "tail": 0.5}']:
+    outfile = "test_sd_alloc.nc"
+    pc.parcel(outfile = outfile, sd_conc = 1024, z_max = 20., sd_alloc = alloc, out_bin = out_bin)
+    f = nc.netcdf_file(outfile)
+    m0.append(f.variables["dry_m0"][0, 0])
+    f.close()
+    subprocess.call(["rm", outfile])
+
+  assert np.isclose(m0[0], m0[1], rtol=1e-2)
+
+def test_sd_alloc_act_T():
+  """ checking if the activation region for several temperatures covers the activation radii at all of them """
+  r_1 = pc._sd_alloc("ammonium_sulfate", aerosol, {"act": 1}, 64, 293.)
+  assert pc._sd_alloc("ammonium_sulfate", aerosol, {"act": 1}, 64, np.array([293., 293.])) == r_1
+  r_2 = pc._sd_alloc("ammonium_sulfate", aerosol, {"act": 1}, 64, np.array([273., 293.]))
+  assert r_2 != r_1
+  assert np.isclose(sum(c for c, n in r_2.values()), sum(aerosol["n_tot"]), rtol=1e-6)
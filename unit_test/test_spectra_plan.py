@@ -0,0 +1,51 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+import numpy as np
+import json
+import pytest
+
+import parcel as pc
+from test_output_bins import output_bins_ref
+
+spectra = {
+  "fine"   : {"rght": 1e-6, "left": 1e-9, "drwt": "dry", "lnli": "log", "nbin": 50, "moms": [0, 3]},
+  "coarse" : {"rght": 1e-6, "left": 1e-9, "drwt": "dry", "lnli": "log", "nbin": 5,  "moms": [0, 1, 3]},
+  "total"  : {"rght": 1e-6, "left": 1e-9, "drwt": "dry", "lnli": "log", "nbin": 1,  "moms": [0]},
+  "copy"   : {"rght": 1e-6, "left": 1e-9, "drwt": "dry", "lnli": "log", "nbin": 50, "moms": [0]},
+  "wet"    : {"rght": 1e-6, "left": 1e-9, "drwt": "wet", "lnli": "lin", "nbin": 7,  "moms": [0]}
+}
+
+def test_spectra_plan():
+  """ checking the number of diagnostic calls after merging identical and coarse bins """
+  plan = pc._spectra_plan(json.dumps(spectra))
+  # fine: 50 * (1+2), coarse: 5 * (1+1) (moments 0 and 3 are sums of fine bins),
+  # total: 0 (sum of coarse bins), copy: 0 (same as fine), wet: 7 * (1+1)
+  assert plan["calls"] == 150 + 10 + 14
+  assert plan["calls"] + plan["calls_saved"] == 150 + 20 + 2 + 100 + 14
+
+def test_spectra_plan_default():
+  """ checking that nothing is merged for the default spectrum """
+  plan = pc._spectra_plan(pc._default_opts()["out_bin"])
+  assert plan["calls"] == 2 and plan["calls_saved"] == 0
+  assert plan["derived"] == []
+
+@pytest.mark.parametrize("nx", [0, 3])
+def test_spectra_plan_output(tmpdir, nx):
+  """ checking if the planned spectra are the same as diagnosed bin by bin for each spectrum """
+  opts = pc._default_opts()
+  opts.update(RH_0 = .95)
+  state, _ = pc._state_init(dict(opts, r_0 = pc._r_0(opts)), nx)
+  micro = pc._micro_init(json.loads(opts["aerosol"]), opts, state, {"RH_max" : 0}, nx=nx)
+
+  out = []
+  for name, output_bins in [("ref", output_bins_ref), ("plan", pc._output_bins)]:
+    fout = pc._output_init(micro, dict(opts, outfile = str(tmpdir.join(name + ".nc"))), spectra)
+    output_bins(fout, 0, micro, opts, spectra)
+    out.append(dict((v, fout.variables[v][:].copy()) for v in fout.variables))
+    assert fout.spectra_diag_calls_saved > 0
+    fout.close()
+
+  assert out[0]["total_m0"].sum() > 0
+  for v in out[0]:
+    assert np.allclose(out[0][v], out[1][v], rtol=1e-12, atol=0), v
@@ -0,0 +1,75 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel import parcel
+from libcloudphxx import common
+from scipy.io import netcdf
+import numpy as np
+import pytest
+
+"""
+checking if the automatic choice of substeps reproduces RH_max of a run with a small
+constant timestep and if it saves the chosen numbers of substeps
+"""
+
+RH_init = .99999
+T_init  = 280.
+p_init  = 100000.
+r_init  = common.eps * RH_init * common.p_vs(T_init) / (p_init - RH_init * common.p_vs(T_init))
+
+opts = {"w" : 1., "T_0" : T_init, "p_0" : p_init, "r_0" : r_init, "z_max" : 50,
+        "sd_conc" : 1000, "chem_dsl" : True, "chem_dsc" : True, "chem_rct" : True}
+
+out_bin = '{"chem": {"rght": 1, "left": 1e-10, "drwt": "dry", "lnli": "log", "nbin": 1, "moms": ["S_VI"]}}'
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("sstp_auto")
+    data = {}
+
+    str_r = str(tmp.join("test_ref.nc"))
+    parcel(dt=.1/16, outfreq=160, outfile=str_r, **opts)
+    data["ref"] = netcdf.netcdf_file(str_r, "r")
+
+    str_a = str(tmp.join("test_auto.nc"))
+    parcel(dt=.1, outfreq=10, outfile=str_a, sstp_auto='{"cond_max": 16, "chem_max": 8}', **opts)
+    data["auto"] = netcdf.netcdf_file(str_a, "r")
+
+    # chemistry with a constant timestep (records at the end of the ascent and in the wait phase)
+    for name, auto in [("const", '{}'), ("flush", '{"chem_max": 8, "chem_tol": 0.1}')]:
+        str_c = str(tmp.join("test_" + name + ".nc"))
+        parcel(dt=.1, outfreq=333, wait=400, outfile=str_c, sstp_auto=auto, out_bin=out_bin, **opts)
+        data[name] = netcdf.netcdf_file(str_c, "r")
+    return data
+
+def test_sstp_auto_accuracy(data, eps=0.02):
+    """ checking if RH_max is close to the one with a small constant timestep """
+    assert np.isclose(data["auto"].RH_max - 1, data["ref"].RH_max - 1, atol=0, rtol=eps)
+
+def test_sstp_auto_substeps(data):
+    """ checking if the chosen numbers of substeps are saved and within the limits """
+    cond = data["auto"].variables["cond_substeps"][1:]
+    chem = data["auto"].variables["chem_every"][1:]
+    assert ((cond >= 1) & (cond <= 16)).all()
+    assert ((chem >= 1) & (chem <= 8)).all()
+
+def test_sstp_auto_calls(data):
+    """ checking if chemistry is not called more often than condensation """
+    n_steps = int(50 / .1)
+    assert n_steps <= data["auto"].cond_calls <= 16 * n_steps
+    assert 0 < data["auto"].chem_calls <= n_steps
+
+def test_sstp_auto_chem_flush(data, eps=0.005):
+    """ checking if chemistry pending at output records is applied before the output (S_VI as with constant timestep) """
+    S6_c = data["const"].variables["chem_S_VI"][:]
+    S6_f = data["flush"].variables["chem_S_VI"][:]
+    assert S6_c.shape == S6_f.shape
+    assert S6_c[-1].sum() > 0
+    assert np.isclose(S6_f, S6_c, atol=0, rtol=eps).all()
+
+def test_sstp_auto_no_steps(tmpdir):
+    """ checking if a run without timesteps (z_max below w * dt) ends without pending chemistry """
+    outfile = str(tmpdir.join("test_no_steps.nc"))
+    parcel(dt=.1, outfile=outfile, sstp_auto='{"chem_max": 8}', **dict(opts, z_max=.05))
+    f = netcdf.netcdf_file(outfile, "r")
+    assert f.cond_calls == 0 and f.chem_calls == 0
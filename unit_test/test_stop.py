@@ -0,0 +1,53 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+import parcel as pc
+from scipy.io import netcdf
+import numpy as np
+
+"""
+checking if the simulation stops when the criteria given in the stop option are met
+"""
+
+def test_stop_z(tmpdir):
+    """ checking if the simulation stops at given height and saves the state at stop """
+    str_f = str(tmpdir.join("test_pcl.nc"))
+    pc.parcel(outfile=str_f, outfreq=7, stop='{"z": 100}')
+    f_out = netcdf.netcdf_file(str_f, "r")
+
+    assert f_out.stop_criterion == b"z"
+    assert np.isclose(f_out.variables["z"][-1], 100, atol=1e-6, rtol=0)
+    assert np.isclose(f_out.variables["t"][-1], f_out.stop_t)
+
+def test_stop_RH_max(tmpdir):
+    """ checking if the simulation stops after RH_max and gives the same RH_max as the full one """
+    str_s = str(tmpdir.join("test_stop.nc"))
+    str_f = str(tmpdir.join("test_full.nc"))
+    pc.parcel(outfile=str_s, RH_0=.99, outfreq=1, stop='{"t_after_RH_max": 5}')
+    pc.parcel(outfile=str_f, RH_0=.99, outfreq=1)
+    f_stop = netcdf.netcdf_file(str_s, "r")
+    f_full = netcdf.netcdf_file(str_f, "r")
+
+    assert f_stop.stop_criterion == b"t_after_RH_max"
+    assert f_stop.stop_t < f_full.variables["t"][-1]
+    assert f_stop.RH_max == f_full.RH_max
+    t_RH_max = f_stop.variables["t"][np.argmax(f_stop.variables["RH"][:])]
+    assert np.isclose(f_stop.stop_t - t_RH_max, 5, atol=f_stop.dt, rtol=0)
+
+def test_stop_none(tmpdir):
+    """ checking if the criterion is saved also when the simulation was not stopped """
+    str_f = str(tmpdir.join("test_pcl.nc"))
+    pc.parcel(outfile=str_f, stop='{"LWC": 1}')
+    f_out = netcdf.netcdf_file(str_f, "r")
+
+    assert f_out.stop_criterion == b"none"
+    assert np.isclose(f_out.variables["z"][-1], f_out.z_max)
+
+def test_stop_wait(tmpdir):
+    """ checking if the wait phase stops at steady state """
+    str_f = str(tmpdir.join("test_pcl.nc"))
+    pc.parcel(outfile=str_f, RH_0=.99, z_max=50, outfreq=10, wait=10000, stop='{"wait_tol": 1e-6}')
+    f_out = netcdf.netcdf_file(str_f, "r")
+
+    assert f_out.stop_criterion == b"wait_tol"
+    assert f_out.stop_t < (500 + 10000) * f_out.dt
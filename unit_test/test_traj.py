@@ -0,0 +1,109 @@
+import sys
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+from parcel_batch import parcel_batch
+import parcel_traj
+from parcel_traj import parcel_trajectories
+from scipy.io import netcdf
+import numpy as np
+import json
+import pytest
+
+"""
+checking if parcels driven by trajectories read from NetCDF and npz files
+give the same results as the same parcels run with constant updraft in parcel_batch()
+"""
+
+members = [{"w" : .5, "RH_0" : .99}, {"w" : 1., "RH_0" : .99}, {"w" : 1., "T_0" : 290., "RH_0" : .95}]
+common_opts = {"dt" : .1, "outfreq" : 10, "sd_conc" : 64}
+nt = 500
+
+def traj_data(pressure):
+    # trajectories with constant w (and the pressure of the parcel_batch() run)
+    n = len(members)
+    data = {
+      "t"    : np.arange(nt + 1) * common_opts["dt"],
+      "w"    : np.array([[mbr["w"]] * (nt + 1) for mbr in members]),
+      "T_0"  : np.array([mbr.get("T_0", 300.) for mbr in members]),
+      "p_0"  : np.full(n, 101300.),
+      "RH_0" : np.array([mbr["RH_0"] for mbr in members])
+    }
+    if pressure is not None:
+      data["p"] = pressure
+      del data["w"], data["p_0"]
+    return data
+
+def write_nc(path, data):
+    with netcdf.netcdf_file(path, "w") as f:
+      f.createDimension("traj", len(members))
+      f.createDimension("t", nt + 1)
+      for k, val in data.items():
+        f.createVariable(k, 'd', ("t",) if k == "t" else ("traj", "t") if val.ndim == 2 else ("traj",))
+        f.variables[k][:] = val
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    tmp = tmpdir_factory.mktemp("traj")
+    data = {}
+
+    str_b = str(tmp.join("test_batch.nc"))
+    mbrs = [dict(mbr, z_max=nt * common_opts["dt"] * mbr["w"]) for mbr in members]
+    parcel_batch(members=json.dumps(mbrs), outfile=str_b, **common_opts)
+    data["batch"] = netcdf.netcdf_file(str_b, "r")
+
+    opts = dict(common_opts)
+    del opts["dt"]
+    for fmt in ["nc", "npz"]:
+      str_f = str(tmp.join("traj." + fmt))
+      if fmt == "nc":
+        write_nc(str_f, traj_data(None))
+      else:
+        np.savez(str_f, **traj_data(None))
+      str_t = str(tmp.join("test_traj_" + fmt + ".nc"))
+      parcel_trajectories(str_f, batch=len(members), outfile=str_t, **opts)
+      data[fmt] = netcdf.netcdf_file(str_t, "r")
+
+    # pressure prescribed (as in the run with w)
+    str_f = str(tmp.join("traj_p.npz"))
+    p = np.array([np.interp(np.arange(nt + 1), np.arange(0, nt + 1, 10), data["batch"].variables["p"][:, i]) for i in range(len(members))])
+    np.savez(str_f, **traj_data(p))
+    str_t = str(tmp.join("test_traj_p.nc"))
+    parcel_trajectories(str_f, batch=2, outfile=str_t, **opts)
+    data["p"] = netcdf.netcdf_file(str_t, "r")
+    return data
+
+@pytest.mark.parametrize("fmt", ["nc", "npz"])
+def test_traj_vs_batch(data, fmt):
+    """ checking if constant w trajectories give the same results as parcel_batch() """
+    f_b, f_t = data["batch"], data[fmt]
+    assert f_t.dimensions["parcel"] == len(members)
+    for var in ["z", "th_d", "T", "p", "r_v", "rhod", "RH", "radii_m0"]:
+        assert np.array_equal(f_t.variables[var][:], f_b.variables[var][:]), var
+    assert np.array_equal(f_t.variables["RH_max"][:], f_b.RH_max)
+
+def test_traj_pressure(data, eps=1e-3):
+    """ checking if prescribed pressure gives results close to the ones with w (run in two batches),
+        also for the heights calculated from the pressure """
+    f_b, f_t = data["batch"], data["p"]
+    for var in ["th_d", "T", "p", "r_v", "rhod"]:
+        assert np.isclose(f_t.variables[var][:], f_b.variables[var][:], atol=0, rtol=eps).all(), var
+    assert np.isclose(f_t.variables["z"][:], f_b.variables["z"][:], atol=0, rtol=10*eps).all()
+
+def test_traj_attrs(data):
+    """ checking if the attributes of parcel_batch() are saved also when run in two batches """
+    f_b, f_t = data["batch"], data["p"]
+    for attr in ["backend_used", "backend_threads"]:
+        assert getattr(f_t, attr) == getattr(f_b, attr), attr
+
+def test_traj_chunks(tmpdir, monkeypatch, batch=4, n=10, nt=40):
+    """ checking if the trajectories are read in chunks of batch trajectories """
+    chunks = []
+    read = parcel_traj._traj_file.read
+    monkeypatch.setattr(parcel_traj._traj_file, "read", lambda self, i0, i1: chunks.append((i0, i1)) or read(self, i0, i1))
+    str_f = str(tmpdir.join("traj.npz"))
+    np.savez(str_f, t=np.arange(nt + 1) * common_opts["dt"], w=np.ones((n, nt + 1)),
+      T_0=np.full(n, 300.), p_0=np.full(n, 101300.), RH_0=np.full(n, .99))
+    parcel_trajectories(str_f, batch=batch, outfile=str(tmpdir.join("test_chunks.nc")), outfreq=1, sd_conc=8)
+    assert chunks == [(0, 4), (4, 8), (8, 10)]
+    f = netcdf.netcdf_file(str(tmpdir.join("test_chunks.nc")), "r")
+    assert f.variables["z"].shape[:2] == (nt + 1, n)